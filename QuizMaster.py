@@ -1,24 +1,52 @@
 import tkinter as tk
-from tkinter import messagebox, filedialog, scrolledtext
+from tkinter import messagebox, filedialog, scrolledtext, ttk
 import webbrowser
 from tkinter.font import Font
 from tkinter import Label, Button, LabelFrame, Frame, Entry  # Possibly taking those from ttkbootstrap at some point
-from file_parser import parse_quiz_and_flashcards
-from expression_parser import parse_expression
+from file_parser import collect_quiz_and_flashcards, parse_quiz_and_flashcards, split_blocks
+from quiz_store import QuizStore, TEXT_FIELDS
+from lazy_bank import LazyBank
+from bank_layout import MeasureCache, RowLayout
+from background import BackgroundTask, track_lines
+from scheduler import Scheduler, ScheduleStore
+from sampling import draw_questions, make_rng
+from quiz_session import QuizSession
+from search_index import SearchIndex
+from results_log import ResultsLog, open_results_log
+from library import ERRORS, STABLE_IDS, load_lazy_library, load_library
+import instrumentation
+from functools import partial
+from itertools import islice
+import io
+import json
 import random
 import os
+import sys
+import time
+
+STARTED = time.perf_counter()  # Reference point of the startup latency measures
 
 LIGHTBULB = "💡"
-ERRORS = {1: "An unexpected error occurred.",
-          2: "An item was not properly ended.",
-          3: "Flashcards cannot have options.",
-          4: "Unknown line argument.",
-          5: "An item is missing required fields.",
-          6: "Answer not in options.",
-          7: "Arguments must be between Q or F and END.",
-          8: "No content."}
 APP_DIR = os.getenv("LOCALAPPDATA") + "\\QuizMaster"  # Sorry guys, Windows only
 QUIZZES_DIR = APP_DIR + '\\Quizzes'
+DATABASE_PATH = APP_DIR + '\\quizmaster.db'
+IMPORT_CACHE_PATH = APP_DIR + '\\import_cache.pickle'
+BANK_PATH = APP_DIR + '\\quizzes.qzb'  # Compiled bank of the default quiz files
+RESULTS_LOG_PATH = APP_DIR + '\\results.qzl'  # Every answer given in quizzes, see results_log.py
+VIRTUALIZE_THRESHOLD = 300  # Banks with more items are shown in a virtualized Question Bank
+LAZY_LOADING = os.getenv("QUIZMASTER_LAZY_LOADING") == "1"  # Read item bodies from the quiz files on demand
+LAZY_CACHE_BUDGET = int(os.getenv("QUIZMASTER_LAZY_BUDGET", str(1 << 20)))  # Bytes of item bodies kept in memory
+BANK_FONT = "TkDefaultFont"  # Font the Question Bank items are measured with
+SEARCH_LIMIT = 200  # Matches shown by the Question Bank search, the best first
+NEW_CARDS_PER_SESSION = 20  # New flashcards added to the review schedule each time it is opened
+SAMPLING_MODES = {"Random": 'uniform',  # How quiz questions are drawn from the matching ones
+                  "Most missed first": 'errors',
+                  "Least recent first": 'recency',
+                  "Balanced across tags": 'stratified'}
+
+
+text_measures = MeasureCache(lambda font_spec: Font(font=font_spec))  # Text widths are measured once per font
+answer_history = {}  # Item key -> (attempts, mistakes, time of the last attempt), from the results log
 
 
 def safe_callback(callback):
@@ -34,46 +62,33 @@ def safe_callback(callback):
     return wrapped
 
 
-def import_files(folder: str = None):
-    """
-    Import the default quiz files from the specified folder.
-    :param folder: The folder containing the default quiz files.
-    """
-    if folder is None:
-        folder = QUIZZES_DIR
-    errors = []
-    result = {}
-    nb_success = 0
-    for subdir in os.walk(folder):
-        for file in subdir[2]:
-            if file.endswith(".qz") or file.endswith(".txt"):
-                with open(os.path.join(subdir[0], file), 'r') as f:
-                    content = f.read()
-                    items, error_code = parse_quiz_and_flashcards(content)
-                    if error_code != 0:
-                        errors.append(f"{file} : Error {error_code} : {ERRORS.get(error_code, 'Unknown error.')}")
-                    else:
-                        result |= items
-                        nb_success += 1
-    return result, errors, nb_success
-
-
 class QuizMasterApp(tk.Tk):
     """
     The main application window for the Quiz Master app.
+    The window is shown right away, and the library is loaded in the background. Until it is ready,
+    the buttons that need the bank are disabled.
     """
 
-    def __init__(self):
+    def __init__(self, measure_startup: bool = False):
         super().__init__()
         self.title("Quiz Master")
         self.geometry("600x400")
-        global quiz_db
-        quiz_db, errors, nb = import_files()
-        print(quiz_db)
-        if errors:
-            messagebox.showerror("Error opening files",
-                                 "Errors have been found in the default files:\n" + "\n".join(
-                                     errors) + f"\n{nb} other files were opened successfully.")
+        global quiz_db, search_index, results_log, answer_history
+        search_index = SearchIndex()  # Filled by the worker too
+        results_log, results_error = open_results_log(RESULTS_LOG_PATH)  # Started anew if it cannot be read
+        answer_history = results_log.history
+        if LAZY_LOADING:
+            # Filled by the worker, the windows using it are disabled until then
+            quiz_db = LazyBank(LAZY_CACHE_BUDGET, STABLE_IDS)
+            load = partial(load_lazy_library, quiz_db, QUIZZES_DIR, search_index=search_index)
+        else:
+            quiz_db = QuizStore(DATABASE_PATH)  # Also creates the tables before the worker uses them
+            load = partial(load_library, DATABASE_PATH, QUIZZES_DIR, IMPORT_CACHE_PATH, BANK_PATH,
+                           search_index=search_index)
+        self.measure_startup = measure_startup
+        self.scheduler = None  # Review schedule of the flashcards
+        self.schedule_store = None
+        self.startup_times = {}  # Milliseconds since launch: 'window' when shown, 'library' when the bank is ready
         self.grid_columnconfigure(0, weight=1)  # Configure the weight of columns to allow for proper resizing
         self.grid_columnconfigure(1, weight=1)
         self.grid_rowconfigure(0, weight=1)
@@ -88,6 +103,51 @@ class QuizMasterApp(tk.Tk):
         self.create_main_buttons()
         self.bind("<Configure>", self.resize_text)
 
+        # Status line of the library loading
+        self.status_label = Label(self, text="Loading the library...")
+        self.status_label.grid(row=2, column=0, sticky="w", padx=10, pady=5)
+        self.progress_bar = ttk.Progressbar(self, mode="determinate", maximum=1.0)
+        self.progress_bar.grid(row=2, column=1, sticky="ew", padx=10, pady=5)
+        for button in self.bank_buttons:
+            button.configure(state="disabled")
+
+        self.after(0, self.on_window_shown)
+        if results_error is not None:
+            self.after(0, lambda: messagebox.showerror("Error opening the results",
+                                                       "The results of previous quizzes could not be read:\n" +
+                                                       results_error))
+        self.library_task = BackgroundTask(self.after, lambda task: load(progress=task.report),
+                                           on_done=self.on_library_loaded, on_error=self.on_library_error,
+                                           on_progress=lambda progress: self.progress_bar.configure(value=progress))
+        self.library_task.start()
+
+    def on_window_shown(self):
+        # First callback of the event loop, the window has been drawn by then
+        self.startup_times['window'] = (time.perf_counter() - STARTED) * 1000
+
+    def on_library_loaded(self, result):
+        errors, nb = result
+        self.startup_times['library'] = (time.perf_counter() - STARTED) * 1000
+        if self.measure_startup:
+            print(json.dumps(self.startup_times))
+            self.destroy()
+            return
+        self.progress_bar.grid_remove()
+        self.status_label.configure(text=f"{len(quiz_db)} items in the bank")
+        for button in self.bank_buttons:
+            button.configure(state="normal")
+        if errors:
+            messagebox.showerror("Error opening files",
+                                 "Errors have been found in the default files:\n" + "\n".join(
+                                     errors) + f"\n{nb} other files were opened successfully.")
+
+    def on_library_error(self, e):
+        self.progress_bar.grid_remove()
+        self.status_label.configure(text="The library could not be loaded.")
+        messagebox.showerror("Error", f"Failed to load the library: {e}")
+        for button in self.bank_buttons:
+            button.configure(state="normal")  # The bank may still hold the items of previous launches
+
     def create_main_buttons(self):
         # Import Files Button - Top Left
         self.import_button = Button(self, text="Import Quizzes & Cards", command=self.open_import_window,
@@ -113,6 +173,10 @@ class QuizMasterApp(tk.Tk):
         self.start_quiz_button.grid(row=1, column=1, sticky="nsew", padx=50, pady=50)
         self.buttons.append(self.start_quiz_button)
 
+        # Buttons that need the bank to be loaded
+        self.bank_buttons = [self.import_button, self.view_questions_bank_button, self.review_flashcards_button,
+                             self.start_quiz_button]
+
     def resize_text(self, event):
         # Simple logic to adjust font size based on window width
         new_size = max(8, min(24, int(self.winfo_width() / 80)))
@@ -127,7 +191,11 @@ class QuizMasterApp(tk.Tk):
         question_bank_window.grab_set()  # Optional: makes the import window modal
 
     def open_review_flashcards_window(self):
-        messagebox.showinfo("Placeholder", "The Flashcards review hasn't been implemented yet.")
+        if self.scheduler is None:  # Loaded once, the first time it is needed
+            self.schedule_store = ScheduleStore(DATABASE_PATH)
+            self.scheduler = Scheduler(self.schedule_store.load())
+        review_window = ReviewFlashcardsWindow(self.scheduler, self.schedule_store, self)
+        review_window.grab_set()
 
     def open_start_quiz_window(self):
         quiz_windows = QuizOptionsWindow(self)
@@ -164,6 +232,106 @@ class ScrollableFrame(Frame):
         self.canvas.config(scrollregion=self.canvas.bbox('all'))
 
 
+class VirtualBankView(Frame):
+    """
+    Scrollable view of the bank that only creates widgets for the rows inside the viewport.
+    Rows all have the same height, so the visible ones are found from the scroll position alone,
+    and row widgets leaving the viewport are recycled for the rows entering it.
+    """
+
+    PARKED_Y = -10000  # Row widgets out of use are moved there, above the scroll region
+
+    def __init__(self, master, on_click, **kwargs):
+        super().__init__(master, **kwargs)
+        self.on_click = on_click
+        self.canvas = tk.Canvas(self, borderwidth=0, background="#ffffff", highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.canvas.bind("<Configure>", self.on_configure)
+
+        self.rows = []  # Each row is a list of (key, item type, text)
+        self.visible = {}  # Row index -> row widget currently showing it
+        self.pool = []  # Row widgets not showing anything
+
+        # Measure the height of a row once, on a sample row
+        sample = self.new_row()
+        self.fill_row(sample, [(None, 'quiz', "Sample")])
+        sample.update_idletasks()
+        self.row_height = sample.winfo_reqheight()
+        self.pool.append(sample)
+
+    def new_row(self):
+        row = Frame(self.canvas, background="#ffffff")
+        row.slots = []  # (LabelFrame, Label) pairs, reused from one item to the next
+        row.window_id = self.canvas.create_window((0, self.PARKED_Y), window=row, anchor="nw",
+                                                  width=self.canvas.winfo_width())
+        return row
+
+    def fill_row(self, row, items):
+        while len(row.slots) < len(items):
+            item_frame = LabelFrame(row, borderwidth=1, relief="solid")
+            label = Label(item_frame, anchor="w")
+            label.pack(fill="x")
+            row.slots.append((item_frame, label))
+        for (item_frame, label), (key, item_type, text) in zip(row.slots, items):
+            item_frame.configure(text="Quiz" if item_type == 'quiz' else "Flashcard")
+            label.configure(text=text)
+            for widget in (item_frame, label):
+                widget.bind("<Button-1>", lambda event, k=key: self.on_click(k))
+            if not item_frame.winfo_manager():  # Slots hidden for a shorter row are packed again
+                item_frame.pack(side="left", expand=True, padx=10, pady=5)
+        for item_frame, _ in row.slots[len(items):]:
+            item_frame.pack_forget()
+
+    def set_rows(self, rows, first_changed=0):
+        """
+        Replaces the laid out rows and redraws the viewport.
+        :param first_changed: Index of the first row that changed, rows before it are not redrawn.
+        """
+        self.rows = rows
+        for index in [index for index in self.visible if index >= first_changed]:
+            self.release(index)
+        self.canvas.configure(yscrollincrement=self.row_height,
+                              scrollregion=(0, 0, self.canvas.winfo_width(), len(rows) * self.row_height))
+        self.render()
+
+    def on_configure(self, event):
+        for row in self.pool + list(self.visible.values()):
+            self.canvas.itemconfigure(row.window_id, width=event.width)
+        self.render()
+
+    def yview(self, *args):
+        self.canvas.yview(*args)
+        self.render()
+
+    def on_mouse_wheel(self, event):
+        self.canvas.yview_scroll(int(-event.delta / 120), "units")
+        self.render()
+
+    def render(self):
+        """
+        Shows the rows inside the viewport and recycles the others.
+        """
+        top = self.canvas.canvasy(0)
+        first = max(0, int(top // self.row_height))
+        last = min(len(self.rows), int((top + self.canvas.winfo_height()) // self.row_height) + 1)
+        for index in [index for index in self.visible if not first <= index < last]:
+            self.release(index)
+        for index in range(first, last):
+            if index not in self.visible:
+                row = self.pool.pop() if self.pool else self.new_row()
+                self.fill_row(row, self.rows[index])
+                self.canvas.coords(row.window_id, 0, index * self.row_height)
+                self.visible[index] = row
+
+    def release(self, index):
+        row = self.visible.pop(index)
+        self.canvas.coords(row.window_id, 0, self.PARKED_Y)
+        self.pool.append(row)
+
+
 class ImportFilesWindow(tk.Toplevel):
     def __init__(self, master=None):
         super().__init__(master)
@@ -198,6 +366,16 @@ class ImportFilesWindow(tk.Toplevel):
         # Questions and flashcards preview
         self.preview_frame = ScrollableFrame(self)
         self.preview_frame.grid(row=1, column=3, sticky="nsew", padx=10, pady=10)
+        self.error_label = Label(self.preview_frame.scrollable_frame, fg="red")
+        self.preview_blocks = []  # (block text, preview frames) for each block of the content, in order
+        self.parsed_blocks = {}  # Block text -> (items, error code)
+
+        # Progress of the file reads and parses running in the background
+        self.progress_bar = ttk.Progressbar(self, mode="determinate", maximum=1.0)
+        self.progress_bar.grid(row=2, column=0, columnspan=3, padx=5, pady=5, sticky="ew")
+        self.progress_bar.grid_remove()
+        self.tasks = {}  # Name -> running BackgroundTask, at most one of each kind
+        self.bind("<Destroy>", self.on_destroy)
 
         # Label to display between the text area and submit button
         self.add_to_db_label = Label(self, text="These questions will be added to the database")
@@ -217,6 +395,7 @@ class ImportFilesWindow(tk.Toplevel):
 
     def on_text_change(self, event=None):
         self.content_text.edit_modified(0)  # reset the modified flag
+        self.cancel_task('preview')  # Its result would be stale
         if self.last_text_change:
             self.after_cancel(self.last_text_change)
         self.last_text_change = self.after(500, self.update_preview)  # Debounce for 500 ms
@@ -229,48 +408,129 @@ class ImportFilesWindow(tk.Toplevel):
             self.file_path_label.configure(text=file_path)
             self.content_text.delete('1.0', tk.END)  # Clear previous content
 
+    def run_task(self, name, function, on_done, error_message="An error occurred"):
+        # Run function on a worker thread, replacing the previous task of the same name
+        self.cancel_task(name)
+
+        def done(result):
+            self.tasks.pop(name, None)
+            self.update_progress_bar()
+            on_done(result)
+
+        def error(e):
+            self.tasks.pop(name, None)
+            self.update_progress_bar()
+            messagebox.showerror("Error", f"{error_message}: {e}")
+
+        self.tasks[name] = BackgroundTask(self.after, function, on_done=done, on_error=error,
+                                          on_progress=lambda progress: self.progress_bar.configure(value=progress))
+        self.progress_bar.configure(value=0)
+        self.update_progress_bar()
+        self.tasks[name].start()
+
+    def cancel_task(self, name):
+        task = self.tasks.pop(name, None)
+        if task is not None:
+            task.cancel()
+            self.update_progress_bar()
+
+    def update_progress_bar(self):
+        if self.tasks:
+            self.progress_bar.grid()
+        else:
+            self.progress_bar.grid_remove()
+
+    def on_destroy(self, event):
+        if event.widget is self:
+            for task in self.tasks.values():
+                task.cancel()
+
     def get_file_content(self):
-        # Read the content of the file and place it in the content_text area
+        # Read the content of the file in the background and place it in the content_text area
         file_path = self.file_path_label['text']
-        try:
-            with open(file_path, 'r') as file:
-                content = file.read()
-                self.content_text.delete('1.0', tk.END)
-                self.content_text.insert('1.0', content)
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to read file: {e}")
 
-    def update_preview(self):
-        # Clear the current content of the preview frame
-        if self.content_text.get('1.0', tk.END) != "Or paste your content here\n":
-            for widget in self.preview_frame.scrollable_frame.winfo_children():
-                widget.destroy()
+        def read(task):
+            with open(file_path, 'r') as file:
+                return ''.join(track_lines(file, os.path.getsize(file_path), task))
 
-            # Pre-parsed items
-            parsed_items, error_code = parse_quiz_and_flashcards(self.content_text.get('1.0', tk.END))
+        def show(content):
+            self.content_text.delete('1.0', tk.END)
+            self.content_text.insert('1.0', content)
 
-            if error_code not in (0, 8):
-                # Display the error message
-                error_message = f"Error {error_code} : {ERRORS.get(error_code, 'Unknown error.')}"
-                error_label = Label(self.preview_frame.scrollable_frame, text=error_message, fg="red")
-                error_label.pack(pady=10)
-
-            else:
+        self.run_task('read', read, show, "Failed to read file")
 
+    def update_preview(self):
+        content = self.content_text.get('1.0', tk.END)
+        if content == "Or paste your content here\n":
+            return
+        parsed_blocks = self.parsed_blocks
+
+        def parse(task):
+            # Only the blocks whose text changed are parsed again
+            with instrumentation.span("update_preview.parse", size=len(content)):
+                blocks = split_blocks(content)
+                parsed = []
+                for i, block in enumerate(blocks):
+                    if i % 100 == 0:
+                        task.check()
+                        task.report(i / len(blocks))
+                    parsed.append(parsed_blocks.get(block) or parse_quiz_and_flashcards(block, STABLE_IDS))
+                return blocks, parsed
+
+        self.run_task('preview', parse, self.show_preview)
+
+    @instrumentation.traced("update_preview.show")
+    def show_preview(self, result):
+        blocks, parsed = result
+        self.parsed_blocks = dict(zip(blocks, parsed))
+
+        # Keep the frames of the unchanged blocks at both ends, and rebuild the ones in between
+        old_blocks = [block for block, _ in self.preview_blocks]
+        prefix = 0
+        while prefix < min(len(blocks), len(old_blocks)) and blocks[prefix] == old_blocks[prefix]:
+            prefix += 1
+        suffix = 0
+        while (suffix < min(len(blocks), len(old_blocks)) - prefix
+               and blocks[-1 - suffix] == old_blocks[-1 - suffix]):
+            suffix += 1
+
+        kept_end = self.preview_blocks[len(old_blocks) - suffix:]
+        for _, frames in self.preview_blocks[prefix:len(old_blocks) - suffix]:
+            for frame in frames:
+                frame.destroy()
+        before = next((frames[0] for _, frames in kept_end if frames), None)  # New frames go above this one
+
+        changed = []
+        for block, (items, error_code) in zip(blocks[prefix:len(blocks) - suffix],
+                                              parsed[prefix:len(blocks) - suffix]):
+            frames = []
+            if error_code == 0:
                 # Iterate over the parsed items and create widgets for each
-                for item in parsed_items.values():
+                for item in items.values():
                     if item['type'] == 'quiz':
-                        self.create_quiz_preview(item)
+                        frames.append(self.create_quiz_preview(item, before))
                     elif item['type'] == 'flashcard':
-                        self.create_flashcard_preview(item)
+                        frames.append(self.create_flashcard_preview(item, before))
+            changed.append((block, frames))
+        self.preview_blocks = self.preview_blocks[:prefix] + changed + kept_end
+
+        # Display the first error above the items
+        error_code = next((error_code for _, error_code in parsed if error_code not in (0, 8)), 0)
+        if error_code:
+            error_message = f"Error {error_code} : {ERRORS.get(error_code, 'Unknown error.')}"
+            self.error_label.configure(text=error_message)
+            slaves = self.preview_frame.scrollable_frame.pack_slaves()
+            self.error_label.pack(pady=10, before=slaves[0] if slaves and slaves[0] is not self.error_label else None)
+        else:
+            self.error_label.pack_forget()
 
-            self.preview_frame.update_scrollregion()
+        self.preview_frame.update_scrollregion()
 
-    def create_quiz_preview(self, quiz):
+    def create_quiz_preview(self, quiz, before=None):
         # Create a frame for the quiz
         quiz_frame = LabelFrame(self.preview_frame.scrollable_frame, text=quiz['question'], borderwidth=1,
                                 relief="solid")
-        quiz_frame.pack(fill="x", expand=True, padx=10, pady=5)
+        quiz_frame.pack(fill="x", expand=True, padx=10, pady=5, before=before)
 
         # Add options to the quiz frame
         for key, value in quiz['options'].items():
@@ -285,12 +545,14 @@ class ImportFilesWindow(tk.Toplevel):
         if 'tags' in quiz:
             tags_label = Label(quiz_frame, text="Tags: " + ", ".join(quiz['tags']), anchor="w", fg="gray")
             tags_label.pack(fill="x")
+        instrumentation.count("widgets_created", 1 + len(quiz_frame.winfo_children()))
+        return quiz_frame
 
-    def create_flashcard_preview(self, flashcard):
+    def create_flashcard_preview(self, flashcard, before=None):
         # Create a frame for the flashcard
         flashcard_frame = LabelFrame(self.preview_frame.scrollable_frame, text="Flashcard", borderwidth=1,
                                      relief="solid")
-        flashcard_frame.pack(fill="x", expand=True, padx=10, pady=5)
+        flashcard_frame.pack(fill="x", expand=True, padx=10, pady=5, before=before)
 
         # Add fact and answer to the flashcard frame
         fact_label = Label(flashcard_frame, text=flashcard['fact'], anchor="w")
@@ -302,36 +564,70 @@ class ImportFilesWindow(tk.Toplevel):
         if 'tags' in flashcard:
             tags_label = Label(flashcard_frame, text="Tags: " + ", ".join(flashcard['tags']), anchor="w", fg="gray")
             tags_label.pack(fill="x")
+        instrumentation.count("widgets_created", 1 + len(flashcard_frame.winfo_children()))
+        return flashcard_frame
 
     def submit_data(self):
         content = self.content_text.get('1.0', tk.END)
-        items, error_code = parse_quiz_and_flashcards(content)
+
+        def parse(task):
+            if not content:
+                return {}, 8
+            return collect_quiz_and_flashcards(track_lines(io.StringIO(content), len(content), task), STABLE_IDS)
+
+        self.submit_button.configure(state="disabled")
+        self.run_task('submit', parse, self.add_to_bank)
+
+    def add_to_bank(self, result):
+        self.submit_button.configure(state="normal")
+        items, error_code = result
         if error_code != 0:
             messagebox.showerror("Error", f"Error {error_code} : {ERRORS.get(error_code, 'Unknown error.')}")
         else:
             try:
                 global quiz_db
-                quiz_db |= items
+                quiz_db |= items  # Items already in the bank are replaced
+                search_index.update(items)
             except Exception as e:
                 messagebox.showerror("Error", f"An error occurred: {e}")
             else:
-                messagebox.showinfo("Success",
-                                    """Data submitted successfully!
-Note: This data will not be saved after the app is closed.
-If you want this data to be saved, you can add it to a file in the AppData/Local/QuizMaster/Quizzes folder.
-"""
-                                    )
+                messagebox.showinfo("Success", "Data submitted successfully!")
                 self.content_text.delete('1.0', tk.END)
 
 
 class QuestionBankWindow(tk.Toplevel):
-    def __init__(self, master=None):
+    def __init__(self, master=None, virtualized: bool = None):
         super().__init__(master)
         self.title("Question Bank")
         self.geometry("600x400")
 
-        self.scrollable_frame = ScrollableFrame(self)
-        self.scrollable_frame.pack(fill="both", expand=True)
+        self.entries = []  # (key, item type, text) of the items, in bank order, or of the search results
+        self.layout = RowLayout()
+
+        # Search over the text of the items, updated as the user types
+        search_frame = Frame(self)
+        search_frame.pack(fill="x", padx=10, pady=5)
+        Label(search_frame, text="Search:").pack(side="left")
+        self.search_entry = Entry(search_frame)
+        self.search_entry.pack(side="left", fill="x", expand=True, padx=5)
+        self.search_label = Label(search_frame, text="", fg="gray")
+        self.search_label.pack(side="left")
+        self.search_entry.bind("<KeyRelease>", self.on_search)
+        self.search_after_id = None
+
+        # Large banks only get widgets for the items in view
+        self.virtualized = len(quiz_db) > VIRTUALIZE_THRESHOLD if virtualized is None else virtualized
+        if self.virtualized:
+            self.bank_view = VirtualBankView(self, on_click=self.edit_item)
+            self.bank_view.pack(fill="both", expand=True)
+            self.bind("<MouseWheel>", self.bank_view.on_mouse_wheel)
+            self.rows = []  # Entries of each row, as given to the view
+        else:
+            self.scrollable_frame = ScrollableFrame(self)
+            self.scrollable_frame.pack(fill="both", expand=True)
+            self.item_frames = {}  # key -> (item frame, text label)
+            self.row_frames = []
+            self.row_keys = []  # Keys of the items packed in each row frame
 
         self.last_width = self.winfo_width()
         self.resize_after_id = None
@@ -348,77 +644,141 @@ class QuestionBankWindow(tk.Toplevel):
             self.last_width = current_width
             if self.resize_after_id is not None:
                 self.after_cancel(self.resize_after_id)
-            self.resize_after_id = self.after(100, self.populate_bank)  # Delay repopulating
+            self.resize_after_id = self.after(100, self.reflow)  # Delay the reflow
 
     @safe_callback
-    def populate_bank(self):
-        # Clear current content
-        for widget in self.scrollable_frame.scrollable_frame.winfo_children():
-            widget.destroy()
-
-        # Update the scrollable_frame's geometry
+    def on_search(self, event):
+        # Search once the user stops typing for a moment
+        if self.search_after_id is not None:
+            self.after_cancel(self.search_after_id)
+        self.search_after_id = self.after(150, self.populate_bank)
+
+    def search_entries(self, query):
+        # (key, item type, text) of the best matches of a search, the best first
+        results = search_index.search(query, limit=SEARCH_LIMIT)
+        self.search_label.configure(text=f"Best {len(results)} matches" if len(results) == SEARCH_LIMIT
+                                    else f"{len(results)} matches")
+        entries = []
+        for key, _ in results:
+            if key in quiz_db:
+                item = quiz_db[key]
+                entries.append((key, item['type'], item[TEXT_FIELDS[item['type']]]))
+        return entries
+
+    def get_available_width(self):
+        if self.virtualized:
+            self.bank_view.update_idletasks()
+            return self.bank_view.canvas.winfo_width()
+        # Update the scrollable_frame's geometry, and get its width now that it has been updated
         self.scrollable_frame.update_idletasks()
+        return self.scrollable_frame.winfo_width()
 
-        # Get the width of the scrollable_frame now that it has been updated
-        frame_width = self.scrollable_frame.winfo_width()
-
-        # Keep track of the current row frame
-        current_row_frame = None
-        row_width = 0
-
-        # Iterate over the parsed items and create widgets for each
-        for item_key in quiz_db:
-            item = quiz_db[item_key]
-            item_frame_width = self.get_item_frame_width(item)
-
-            if current_row_frame is None or row_width + item_frame_width > frame_width:
-                # If there's no row frame or we've exceeded the width, start a new row
-                current_row_frame = Frame(self.scrollable_frame.scrollable_frame)
-                current_row_frame.pack(fill='x')
-                row_width = 0  # Reset the row width
+    @safe_callback
+    @instrumentation.traced()
+    def populate_bank(self):
+        # Reload the items and lay them out again from the first one that changed
+        old_entries = self.entries
+        self.search_after_id = None
+        query = self.search_entry.get().strip()
+        if query:
+            self.entries = self.search_entries(query)
+        else:
+            self.search_label.configure(text="")
+            self.entries = quiz_db.texts()
+        first_changed = next((i for i, (old, new) in enumerate(zip(old_entries, self.entries)) if old != new),
+                             min(len(old_entries), len(self.entries)))
+        if not self.virtualized:
+            self.update_item_frames()
+        widths = [self.get_item_frame_width(text) for _, _, text in self.entries]
+        first_row = self.layout.update(widths, self.get_available_width())
+        if first_changed < len(self.entries):
+            first_row = min(first_row, self.layout.row_of(first_changed))
+        self.apply_layout(first_row)
 
-            if item['type'] == 'quiz':
-                self.create_quiz_preview(item_key, current_row_frame)
-            elif item['type'] == 'flashcard':
-                self.create_flashcard_preview(item_key, current_row_frame)
+    @safe_callback
+    def reflow(self):
+        self.apply_layout(self.layout.update(max_width=self.get_available_width()))
+
+    def apply_layout(self, first_row):
+        # Only the rows from first_row on may have changed
+        rows = [[self.entries[i] for i in self.layout.row_items(row)] for row in range(first_row, len(self.layout))]
+        if self.virtualized:
+            self.rows[first_row:] = rows
+            self.bank_view.set_rows(self.rows, first_row)
+            return
 
-            # Increment the row width by the width of the newly added item frame
-            row_width += item_frame_width
+        container = self.scrollable_frame.scrollable_frame
+        for row, entries in enumerate(rows, first_row):
+            keys = [key for key, _, _ in entries]
+            if row < len(self.row_frames):
+                if self.row_keys[row] == keys:
+                    continue
+                row_frame = self.row_frames[row]
+                for item_frame in row_frame.pack_slaves():
+                    item_frame.pack_forget()
+            else:
+                row_frame = Frame(container)
+                row_frame.pack(fill='x')
+                self.row_frames.append(row_frame)
+                self.row_keys.append([])
+            # Existing item frames are moved to their new row rather than created again
+            for key in keys:
+                item_frame = self.item_frames[key][0]
+                item_frame.pack(in_=row_frame, side="left", expand=True, padx=10, pady=5)
+                item_frame.lift(row_frame)  # Item frames are siblings of the rows, keep them on top
+            self.row_keys[row] = keys
+
+        for row_frame in self.row_frames[len(self.layout):]:
+            row_frame.destroy()
+        del self.row_frames[len(self.layout):]
+        del self.row_keys[len(self.layout):]
 
         self.scrollable_frame.update_scrollregion()
 
+    def update_item_frames(self):
+        # Create the frames of new items, update the edited ones and destroy the removed ones
+        container = self.scrollable_frame.scrollable_frame
+        removed = set(self.item_frames)
+        for key, item_type, text in self.entries:
+            removed.discard(key)
+            if key not in self.item_frames:
+                if item_type == 'quiz':
+                    self.item_frames[key] = self.create_quiz_preview(key, text, container)
+                elif item_type == 'flashcard':
+                    self.item_frames[key] = self.create_flashcard_preview(key, text, container)
+            elif self.item_frames[key][1].cget("text") != text:
+                self.item_frames[key][1].configure(text=text)
+        for key in removed:
+            self.item_frames.pop(key)[0].destroy()
+
     @safe_callback
-    def get_item_frame_width(self, item):
-        return Font().measure(item['question'] if item['type'] == 'quiz' else item['fact'])
+    def get_item_frame_width(self, text):
+        return text_measures.measure(BANK_FONT, text)
 
     @safe_callback
-    def create_quiz_preview(self, key, parent_frame):
+    def create_quiz_preview(self, key, text, parent_frame):
         quiz_frame = LabelFrame(parent_frame, text="Quiz", borderwidth=1, relief="solid")
-        quiz_frame.pack(side="left", expand=True, padx=10, pady=5)
         quiz_frame.bind("<Button-1>", lambda event, k=key: self.edit_item(k))
 
-        for child in quiz_frame.winfo_children():
-            child.bind("<Button-1>", lambda event, k=key: self.edit_item(k))
-
-        question_label = Label(quiz_frame, text=quiz_db[key]['question'], anchor="w")
+        question_label = Label(quiz_frame, text=text, anchor="w")
         question_label.pack(fill="x")
         question_label.bind("<Button-1>", lambda event, k=key: self.edit_item(k))
 
         # ... add options and answer labels ...
+        instrumentation.count("widgets_created", 2)
+        return quiz_frame, question_label
 
     @safe_callback
-    def create_flashcard_preview(self, key, parent_frame):
+    def create_flashcard_preview(self, key, text, parent_frame):
         flashcard_frame = LabelFrame(parent_frame, text="Flashcard", borderwidth=1,
                                      relief="solid")
-        flashcard_frame.pack(side="left", expand=True, padx=10, pady=5)
         flashcard_frame.bind("<Button-1>", lambda event, k=key: self.edit_item(k))
 
-        for child in flashcard_frame.winfo_children():
-            child.bind("<Button-1>", lambda event, k=key: self.edit_item(k))
-
-        fact_label = Label(flashcard_frame, text=quiz_db[key]['fact'], anchor="w")
+        fact_label = Label(flashcard_frame, text=text, anchor="w")
         fact_label.pack(fill="x")
         fact_label.bind("<Button-1>", lambda event, k=key: self.edit_item(k))
+        instrumentation.count("widgets_created", 2)
+        return flashcard_frame, fact_label
 
     def edit_item(self, key):
         # Open EditItemWindow
@@ -519,7 +879,8 @@ class EditItemWindow(tk.Toplevel):
                 self.item['tags'] = [tag.strip() for tag in self.tags_entry.get().split(',')]
 
         quiz_db[self.item_key] = self.item  # Commit changes to the database
-        messagebox.showinfo("Success", "Item updated successfully.\nDo note that only the current session is updated.")
+        search_index.add(self.item_key, self.item)
+        messagebox.showinfo("Success", "Item updated successfully.")
         self.master.populate_bank()
         self.destroy()  # Close the window
 
@@ -531,7 +892,7 @@ class QuizOptionsWindow(tk.Toplevel):
         self.geometry("500x400")
 
         # Configure grid layout
-        self.all_tags = {tag for item in quiz_db.values() for tag in item.get('tags', []) if item['type'] == 'quiz'}
+        self.all_tags = quiz_db.tags('quiz')
 
         # Grid configuration for layout management
         self.grid_columnconfigure(0, weight=1)
@@ -563,20 +924,34 @@ class QuizOptionsWindow(tk.Toplevel):
         self.hints_spinbox = tk.Spinbox(self, from_=0, to=10)
         self.hints_spinbox.grid(row=5, column=1, sticky="ew", padx=10, pady=5)
 
+        # How questions are drawn, and the seed to draw the same quiz again
+        tk.Label(self, text="Question Selection:").grid(row=6, column=0, sticky="w", padx=10, pady=5)
+        self.sampling_mode = tk.StringVar(value=next(iter(SAMPLING_MODES)))
+        tk.OptionMenu(self, self.sampling_mode, *SAMPLING_MODES).grid(row=6, column=1, sticky="ew", padx=10, pady=5)
+
+        tk.Label(self, text="Seed (optional):").grid(row=7, column=0, sticky="w", padx=10, pady=5)
+        self.seed_entry = tk.Entry(self)
+        self.seed_entry.grid(row=7, column=1, sticky="ew", padx=10, pady=5)
+
+        # Only questions containing these words, on top of the tag filter
+        tk.Label(self, text="Text search (optional):").grid(row=8, column=0, sticky="w", padx=10, pady=5)
+        self.search_entry = tk.Entry(self)
+        self.search_entry.grid(row=8, column=1, sticky="ew", padx=10, pady=5)
+
         # Start Quiz button
-        tk.Button(self, text="Start Quiz", command=self.start_quiz).grid(row=6, column=0, columnspan=2, pady=10,
+        tk.Button(self, text="Start Quiz", command=self.start_quiz).grid(row=9, column=0, columnspan=2, pady=10,
                                                                          sticky="ew", padx=10)
 
         # Scrollable list of tags positioned at the bottom
         self.tag_list_label = tk.Label(self, text="Available Tags:")
-        self.tag_list_label.grid(row=7, column=0, padx=10, pady=(5, 0), sticky="w")
+        self.tag_list_label.grid(row=10, column=0, padx=10, pady=(5, 0), sticky="w")
         self.tag_list = tk.Listbox(self, height=4)
         self.tag_list_scrollbar = tk.Scrollbar(self, orient="vertical", command=self.tag_list.yview)
         self.tag_list.configure(yscrollcommand=self.tag_list_scrollbar.set)
         for tag in self.all_tags:
             self.tag_list.insert(tk.END, tag)
-        self.tag_list.grid(row=8, column=0, sticky="ew", padx=10)
-        self.tag_list_scrollbar.grid(row=8, column=1, sticky="ns")
+        self.tag_list.grid(row=11, column=0, sticky="ew", padx=10)
+        self.tag_list_scrollbar.grid(row=11, column=1, sticky="ns")
         self.tag_list.bind('<Double-1>', self.on_tag_double_click)
 
     def toggle_timer_option(self):
@@ -603,52 +978,148 @@ class QuizOptionsWindow(tk.Toplevel):
         num_questions = int(self.questions_spinbox.get())
         num_hints = int(self.hints_spinbox.get())
         timer_seconds = int(self.timer_duration_spinbox.get()) if use_timer else 0
-        available_questions = []
-        for key, item in quiz_db.items():
-            if item['type'] == 'quiz' and parse_expression(tags, item.get('tags', [])):
-                available_questions.append(key)
-
-        if len(available_questions) < num_questions:
-            messagebox.showwarning("Warning", "Not enough questions available for the selected tags.")
-            quiz_questions = available_questions.copy()
-        elif len(available_questions) == num_questions:
-            random.shuffle(available_questions)
-            quiz_questions = available_questions.copy()
-        else:
-            quiz_questions = random.sample(available_questions, num_questions)
+        seed = self.seed_entry.get().strip()
+        if not seed.isdigit() and seed:
+            messagebox.showerror("Error", "The seed must be a whole number.")
+            return
+        seed = int(seed) if seed else random.randrange(2 ** 32)  # Shown by the quiz window, to draw it again
+        text = self.search_entry.get().strip()
+        try:
+            with instrumentation.span("start_quiz.draw_questions", expression=tags, count=num_questions):
+                within = search_index.matches(text, 'quiz') if text else None
+                quiz_questions = draw_questions(quiz_db, tags, num_questions, SAMPLING_MODES[self.sampling_mode.get()],
+                                                make_rng(seed), answer_history, within)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
 
-        # Placeholder for starting the quiz with these options
-        for key in quiz_questions:
-            print(quiz_db[key])
+        if len(quiz_questions) < num_questions:
+            messagebox.showwarning("Warning", "Not enough questions available for the selected tags and search.")
+        if not quiz_questions:
+            return
 
-        quiz_window = QuizWindow(questions=[quiz_db[key] for key in quiz_questions], master=self, timer=use_timer,
-                                 duration=timer_seconds, hints=num_hints)
+        with instrumentation.span("start_quiz.open_window"):
+            quiz_window = QuizWindow(questions=[quiz_db[key] for key in quiz_questions], master=self,
+                                     timer=use_timer, duration=timer_seconds, hints=num_hints, keys=quiz_questions,
+                                     seed=seed)
         self.wait_window(quiz_window)
         self.destroy()
 
 
+class ReviewFlashcardsWindow(tk.Toplevel):
+    """
+    Reviews the flashcards that are due, one at a time. Each card is graded after its answer is
+    shown, and the scheduler decides when it comes back.
+    """
+
+    GRADES = (("Again", 1), ("Hard", 3), ("Good", 4), ("Easy", 5))  # SM-2 grade of each button
+
+    def __init__(self, scheduler: Scheduler, schedule_store: ScheduleStore, master=None):
+        super().__init__(master)
+        self.title("Review Flashcards")
+        self.geometry("600x400")
+        self.scheduler = scheduler
+        self.schedule_store = schedule_store
+        self.current_card = None
+        self.reviewed = 0
+
+        self.fact_label = tk.Label(self, font=('Arial', 16), wraplength=500)
+        self.fact_label.pack(pady=(30, 10), padx=20)
+        self.answer_label = tk.Label(self, font=('Arial', 14), wraplength=500)
+        self.answer_label.pack(pady=10, padx=20)
+        self.explanation_label = tk.Label(self, font=('Arial', 12), wraplength=500)
+        self.explanation_label.pack(pady=10, padx=20)
+
+        self.show_answer_button = tk.Button(self, text="Show Answer", command=self.show_answer)
+        self.grades_frame = tk.Frame(self)
+        for text, grade in self.GRADES:
+            tk.Button(self.grades_frame, text=text, width=10,
+                      command=lambda grade=grade: self.grade_card(grade)).pack(side="left", padx=5)
+        self.status_label = tk.Label(self)
+        self.status_label.pack(side="bottom", pady=5)
+
+        # A few flashcards never reviewed join the schedule, without going through the whole bank
+        if LAZY_LOADING:  # The bank is only in memory
+            new_keys = islice((key for key in quiz_db.iter_query('', 'flashcard') if key not in self.scheduler),
+                              NEW_CARDS_PER_SESSION)
+        else:
+            new_keys = self.schedule_store.new_cards(NEW_CARDS_PER_SESSION)
+        for key in new_keys:
+            self.schedule_store.save(self.scheduler.add(key))
+
+        self.show_next_card()
+
+    def show_next_card(self):
+        state = self.scheduler.next_due()
+        while state is not None and state.key not in quiz_db:  # Removed from the bank since
+            self.scheduler.remove(state.key)
+            self.schedule_store.delete(state.key)
+            state = self.scheduler.next_due()
+        if state is None:
+            next_time = self.scheduler.next_due_time()
+            message = f"You reviewed {self.reviewed} cards, none are due anymore."
+            if next_time is not None:
+                message += f"\nNext review: {time.strftime('%Y-%m-%d %H:%M', time.localtime(next_time))}"
+            messagebox.showinfo("Review Completed", message)
+            self.destroy()
+            return
+
+        self.current_card = state.key
+        card = quiz_db[state.key]
+        self.fact_label.config(text=card['fact'])
+        self.answer_label.config(text="")
+        self.explanation_label.config(text="")
+        self.grades_frame.pack_forget()
+        self.show_answer_button.pack(side="bottom", pady=10)
+        self.status_label.config(text=f"Reviewed: {self.reviewed}")
+
+    def show_answer(self):
+        card = quiz_db[self.current_card]
+        self.answer_label.config(text=card['answer'])
+        explanation = card.get('explanation', '')
+        self.explanation_label.config(text=f"Explanation : {explanation}" if explanation else explanation)
+        self.show_answer_button.pack_forget()
+        self.grades_frame.pack(side="bottom", pady=10)
+
+    def grade_card(self, grade):
+        self.schedule_store.save(self.scheduler.review(self.current_card, grade))
+        self.reviewed += 1
+        self.show_next_card()
+
+
 class QuizWindow(tk.Toplevel):
+    """
+    Displays a QuizSession, which holds the rules of the quiz, and forwards the user's actions to it.
+    """
+
     def __init__(self, questions, master=None, **kwargs):
         super().__init__(master)
         self.title("Quiz")
         self.geometry("800x600")  # Example size, adjust as needed
 
-        self.questions = questions
-        self.current_question_index = 0
-        self.answered = None
-        self.current_question = None
-        self.current_options = None
-
         self.use_timer = kwargs.get('timer', False)
-        self.time_limit = kwargs.get('duration', 30)
-        self.hints_used = 0
-        self.max_hints = kwargs.get('hints', 0)
-        self.good_answers = 0
+        keys = kwargs.get('keys')  # Keys of the questions, to record the answers in the results log
+        self.session = QuizSession(questions, keys, kwargs.get('hints', 0),
+                                   kwargs.get('duration', 30) if self.use_timer else None,
+                                   on_answer=self.record_answer)
+        self.timer_id = None
+        self.question_shown = time.perf_counter()  # To record the response time of each answer
 
         self.next_button = tk.Button(self, text="Next", command=self.next_question)
-        self.hint_button = tk.Button(self, text=str(self.max_hints) + LIGHTBULB, command=self.show_hint)
+        self.hint_button = tk.Button(self, text=str(self.session.max_hints) + LIGHTBULB, command=self.show_hint)
         self.hint_button.place(relx=1.0, rely=0.0, x=-2, y=2, anchor="ne")
 
+        # Entering the seed again in the quiz options draws the same quiz from the same bank
+        self.seed = kwargs.get('seed')
+        if self.seed is not None:
+            seed_frame = tk.Frame(self)
+            tk.Label(seed_frame, text="Seed:").pack(side="left")
+            seed_entry = tk.Entry(seed_frame, width=12)  # Read-only, but it can be selected and copied
+            seed_entry.insert(0, str(self.seed))
+            seed_entry.config(state="readonly")
+            seed_entry.pack(side="left")
+            seed_frame.place(relx=0.0, rely=0.0, x=2, y=2, anchor="nw")
+
         self.question_label = tk.Label(self, font=('Arial', 16))
         self.question_label.pack(pady=(20, 10), padx=20)
 
@@ -664,17 +1135,15 @@ class QuizWindow(tk.Toplevel):
 
         self.button_font = Font(family="Arial", size=14)
 
-        self.update_content(self.questions[self.current_question_index])
+        self.update_content()
 
-    def update_content(self, q):
-        self.hint_button.config(state="normal")
-        self.current_question = q
+    def update_content(self):
+        self.hint_button.config(state="normal" if self.session.can_use_hint() else "disabled")
         self.next_button.pack_forget()
         self.explanation_label.config(text="")  # Clear explanation text
-        self.question_label.config(text=q['question'])
-        self.answered = False  # Reset answered flag for the new question
-        self.current_options = q['options'].items()
+        self.question_label.config(text=self.session.question['question'])
         self.display_options()
+        self.question_shown = time.perf_counter()
         if self.use_timer:
             self.start_timer()
 
@@ -682,79 +1151,68 @@ class QuizWindow(tk.Toplevel):
         for widget in self.options_frame.winfo_children():
             widget.destroy()
 
-        rows = (len(self.current_options) + 1) // 2
-        for index, (option_key, option_value) in enumerate(self.current_options):
+        rows = (len(self.session.options) + 1) // 2
+        for index, (option_key, option_value) in enumerate(self.session.options):
             row = index // 2
             column = index % 2
             button = tk.Button(self.options_frame, text=f"{option_key}: {option_value}", padx=10, pady=5,
                                font=self.button_font)
             button.grid(row=row, column=column, sticky="nsew", padx=5, pady=5)
-            button.bind("<Button-1>",
-                        lambda event, correct=(option_key == self.current_question['answer']),
-                               widget=button: self.answer_selected(correct,
-                                                                   widget))
+            button.bind("<Button-1>", lambda event, label=option_key, widget=button: self.answer_selected(label, widget))
 
             self.options_frame.grid_columnconfigure(column, weight=1)
         for row_index in range(rows):
             self.options_frame.grid_rowconfigure(row_index, weight=1)
 
     def show_hint(self):
-        right_answer = [(k, v) for k, v in self.current_options if k == self.current_question['answer']]
-        wrong_answers = [(k, v) for k, v in self.current_options if k != self.current_question['answer']]
-        random.shuffle(wrong_answers)
-        self.current_options = right_answer + wrong_answers[:1]
-
-        print(self.current_options)
-
-        self.hints_used += 1
-        if self.hints_used == self.max_hints:
+        if not self.session.use_hint():
+            return
+        if self.session.hints_left == 0:
             self.hint_button.place_forget()
         else:
-            self.hint_button.config(text=str(self.max_hints - self.hints_used) + LIGHTBULB)
+            self.hint_button.config(text=str(self.session.hints_left) + LIGHTBULB)
 
         self.hint_button.config(state="disabled")
 
         self.display_options()
 
     def start_timer(self):
-        self.time_left = self.time_limit
-        self.timer_label.config(text=f"00:{self.time_left:02}")
-        self.update_timer()
+        self.timer_label.config(text=f"00:{self.session.time_left:02}")
+        self.timer_id = self.after(1000, self.update_timer)
 
     def update_timer(self):
-        if self.time_left > 0:
-            self.time_left -= 1
-            self.timer_label.config(text=f"00:{self.time_left:02}")
-            self.timer_id = self.after(1000, self.update_timer)
+        time_up = self.session.tick()
+        self.timer_label.config(text=f"00:{self.session.time_left:02}")
+        if time_up:
+            self.show_answer(None)
         else:
-            self.time_up()
-
-    def time_up(self):
-        if not self.answered:
-            self.answer_selected(False, None)  # Handle time up as incorrect answer
+            self.timer_id = self.after(1000, self.update_timer)
 
-    def answer_selected(self, is_correct, widget):
-        if self.answered:  # Check if an answer has already been processed
+    def answer_selected(self, label, widget):
+        if self.session.answered:  # Check if an answer has already been processed
             return
-        self.answered = True  # Set the answered flag
+        self.session.answer(label)
+        if self.use_timer:
+            self.after_cancel(self.timer_id)
+        self.show_answer(widget)
+
+    def record_answer(self, key, correct):
+        results_log.record(key, correct, time.perf_counter() - self.question_shown, self.session.hint_used,
+                           self.session.question.get('tags', ()))
 
+    def show_answer(self, widget):
         # Disable further clicks immediately after one has been processed
         for child in self.options_frame.winfo_children():
             if isinstance(child, tk.Button):
                 child.config(state="disabled")
 
-        if self.use_timer:
-            self.after_cancel(self.timer_id)
-
-        if is_correct:
+        if self.session.last_answer_correct:
             if widget:
                 widget.config(bg="green", fg="white", disabledforeground="white")
-            self.good_answers += 1
-        elif widget:
-            widget.config(bg="red", fg="black", disabledforeground="black")
-
-        if not is_correct:
-            correct_key = self.current_question['answer']  # Assuming 'answer' holds the key of the correct option
+        else:
+            if widget:
+                widget.config(bg="red", fg="black", disabledforeground="black")
+            correct_key = self.session.question['answer']
             for child in self.options_frame.winfo_children():
                 if isinstance(child, tk.Button):
                     option_key = child.cget("text").split(":")[
@@ -763,7 +1221,7 @@ class QuizWindow(tk.Toplevel):
                         child.config(bg="green", fg="white", disabledforeground="white")
                         break
 
-        explanation = self.current_question.get('explanation', '')
+        explanation = self.session.question.get('explanation', '')
         self.explanation_label.config(text=f"Explanation : {explanation}" if explanation else explanation)
 
         self.hint_button.config(state="disabled")
@@ -771,16 +1229,17 @@ class QuizWindow(tk.Toplevel):
         self.next_button.pack(side="bottom", pady=10)
 
     def next_question(self):
-        if self.current_question_index + 1 < len(self.questions):
-            self.current_question_index += 1
-            self.update_content(self.questions[self.current_question_index])
+        if self.session.next_question():
+            self.update_content()
         else:
             self.end_quiz()
 
     def end_quiz(self):
+        results_log.checkpoint()  # The answers are in the log already, this saves the totals
         tk.messagebox.showinfo("Quiz Completed",
-                               f"""You have completed the quiz using {self.hints_used} hints!
-You got {self.good_answers} good answers, and your grade is {int(80 * self.good_answers / len(self.questions)) / 4}/20.""")
+                               f"""You have completed the quiz using {self.session.hints_used} hints!
+You got {self.session.good_answers} good answers, and your grade is {self.session.grade}/20.""" +
+                               ("" if self.seed is None else f"\nEnter the seed {self.seed} to take this quiz again."))
         self.destroy()
 
 
@@ -792,7 +1251,17 @@ if __name__ == "__main__":
     elif not os.path.isdir(QUIZZES_DIR):
         os.mkdir(QUIZZES_DIR)
 
-    quiz_db: dict = {}
+    quiz_db: QuizStore | LazyBank = None
+    search_index: SearchIndex = None
+    results_log: ResultsLog = None
 
-    app = QuizMasterApp()
+    # --trace records the time spent on the hot paths, see instrumentation.py
+    if "--trace" in sys.argv:
+        instrumentation.enable()
+    # --measure-startup prints the startup times as JSON and quits once the library is loaded
+    app = QuizMasterApp(measure_startup="--measure-startup" in sys.argv)
     app.mainloop()
+    quiz_db.close()
+    results_log.close()
+    if app.schedule_store is not None:
+        app.schedule_store.close()
@@ -0,0 +1,118 @@
+from typing import Callable, Iterable, Iterator
+import queue
+import threading
+
+POLL_INTERVAL = 16  # Milliseconds between two polls of the result queue, about 60 times per second
+PROGRESS_EVERY = 1000  # Number of lines between two progress reports
+
+
+class Cancelled(BaseException):
+    """
+    Raised inside a background task when it has been cancelled. Not an Exception, so that code
+    catching every error, like the parser, lets it through.
+    """
+
+
+class BackgroundTask:
+    """
+    Runs a function on a worker thread and hands its progress and result back to the GUI thread.
+
+    The worker never touches the GUI: it only puts messages in a queue, which is drained from the
+    GUI thread by polling it with schedule (a widget's after method). The function is called with
+    the task itself, to report progress with task.report() and to stop early with task.check()
+    once the task has been cancelled. A cancelled task never calls its callbacks.
+    """
+
+    def __init__(self, schedule: Callable, function: Callable[['BackgroundTask'], object],
+                 on_done: Callable[[object], None] = None, on_progress: Callable[[float], None] = None,
+                 on_error: Callable[[Exception], None] = None, poll_interval: int = POLL_INTERVAL):
+        self.schedule = schedule
+        self.function = function
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.poll_interval = poll_interval
+        self.messages = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.finished = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> 'BackgroundTask':
+        self.thread.start()
+        self.schedule(self.poll_interval, self.poll)
+        return self
+
+    def run(self):
+        # Worker thread
+        try:
+            result = self.function(self)
+        except Cancelled:
+            self.messages.put(('cancelled', None))
+        except Exception as e:
+            self.messages.put(('error', e))
+        else:
+            self.messages.put(('done', result))
+
+    def report(self, progress: float):
+        """
+        Reports the progress of the task, between 0 and 1. Called from the worker thread.
+        """
+        self.messages.put(('progress', progress))
+
+    def check(self):
+        """
+        Raises Cancelled if the task has been cancelled. Called from the worker thread.
+        """
+        if self.cancel_event.is_set():
+            raise Cancelled
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """
+        Asks the worker to stop. Its result, if any, is dropped.
+        """
+        self.cancel_event.set()
+
+    def poll(self):
+        # GUI thread: handle every pending message, only the latest progress is shown
+        if self.cancelled:
+            return  # Stop polling, the widget behind schedule may be gone already
+        progress = None
+        while True:
+            try:
+                kind, value = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                progress = value
+                continue
+            self.finished = True
+            if kind == 'cancelled':
+                return
+            if kind == 'done' and self.on_done is not None:
+                self.on_done(value)
+            elif kind == 'error':
+                if self.on_error is None:
+                    raise value
+                self.on_error(value)
+            return
+        if progress is not None and self.on_progress is not None and not self.cancelled:
+            self.on_progress(progress)
+        self.schedule(self.poll_interval, self.poll)
+
+
+def track_lines(lines: Iterable[str], total_size: int, task: BackgroundTask) -> Iterator[str]:
+    """
+    Passes lines through, reporting the share of total_size read so far and stopping if the task
+    is cancelled. Used to follow a parser working on a file or a large text.
+    """
+    read = 0
+    for count, line in enumerate(lines, 1):
+        read += len(line)
+        if count % PROGRESS_EVERY == 0:
+            task.check()
+            task.report(read / total_size if total_size else 1)
+        yield line
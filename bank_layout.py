@@ -0,0 +1,107 @@
+from bisect import bisect_right
+from typing import Callable, Dict, Hashable, List, Sequence, Tuple
+
+
+class MeasureCache:
+    """
+    Caches the width of texts, per font. Fonts are described by any hashable specification, such as
+    ("Arial", 12), and only turned into font objects once, by font_factory.
+    """
+
+    def __init__(self, font_factory: Callable[[Hashable], object]):
+        self.font_factory = font_factory
+        self.fonts: Dict[Hashable, object] = {}
+        self.widths: Dict[Tuple[Hashable, str], int] = {}
+
+    def measure(self, font_spec: Hashable, text: str) -> int:
+        """
+        :return: The width of text in pixels, as given by the font's measure method.
+        """
+        key = (font_spec, text)
+        width = self.widths.get(key)
+        if width is None:
+            font = self.fonts.get(font_spec)
+            if font is None:
+                font = self.fonts[font_spec] = self.font_factory(font_spec)
+            width = self.widths[key] = font.measure(text)
+        return width
+
+
+class RowLayout:
+    """
+    Greedy row packing of items of known widths, as done by the Question Bank: items are put on the
+    current row until the next one would overflow the available width, and every row holds at
+    least one item.
+
+    Row assignments are kept between updates. When the widths or the available width change, the
+    rows before the first affected one are kept as they are, and packing resumes from there.
+    """
+
+    def __init__(self):
+        self.max_width = 0
+        self.widths: List[int] = []
+        self.rows: List[int] = []  # Index of the first item of each row
+        self.row_widths: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def row_items(self, row: int) -> range:
+        """
+        :return: The indexes of the items of a row.
+        """
+        end = self.rows[row + 1] if row + 1 < len(self.rows) else len(self.widths)
+        return range(self.rows[row], end)
+
+    def row_of(self, index: int) -> int:
+        """
+        :return: The row of the item at index, or the last row for an index past the last item.
+        """
+        return max(0, bisect_right(self.rows, index) - 1)
+
+    def _row_holds(self, row: int) -> bool:
+        # A row is unchanged if its items still fit (or it holds a single item) and the next item still doesn't
+        items = self.row_items(row)
+        total = self.row_widths[row]
+        if len(items) > 1 and total > self.max_width:
+            return False
+        return items.stop == len(self.widths) or total + self.widths[items.stop] > self.max_width
+
+    def update(self, widths: Sequence[int] = None, max_width: int = None) -> int:
+        """
+        Lays the items out again after their widths or the available width changed.
+        :param widths: The new widths of the items, if they changed.
+        :param max_width: The new available width, if it changed.
+        :return: The index of the first row that changed. Rows before it are untouched.
+        """
+        first_row = len(self.rows)
+        if widths is not None:
+            item_count = len(self.widths)
+            first_item = next((i for i, (old, new) in enumerate(zip(self.widths, widths)) if old != new),
+                              min(item_count, len(widths)))
+            self.widths = list(widths)
+            if first_item < item_count or len(widths) != item_count:
+                first_row = self.row_of(first_item)
+                if 0 < first_row < len(self.rows) and self.rows[first_row] == first_item \
+                        and not self._row_holds(first_row - 1):
+                    first_row -= 1  # The previous row may now take the first item of this one
+        if max_width is not None and max_width != self.max_width:
+            self.max_width = max_width
+            first_row = next((row for row in range(first_row) if not self._row_holds(row)), first_row)
+        if first_row >= len(self.rows) and self.rows:
+            return len(self.rows)  # Nothing changed
+
+        start = self.rows[first_row] if first_row < len(self.rows) else 0
+        del self.rows[first_row:]
+        del self.row_widths[first_row:]
+        row_width = 0
+        for index in range(start, len(self.widths)):
+            width = self.widths[index]
+            if index == start or row_width + width > self.max_width:
+                self.rows.append(index)
+                self.row_widths.append(0)
+                row_width = 0
+            row_width += width
+            self.row_widths[-1] = row_width
+        return first_row
+
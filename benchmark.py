@@ -0,0 +1,195 @@
+from typing import Callable, Dict, List
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from expression_parser import compile_expression, evaluate_postfix, parse_expression
+from file_parser import parse_quiz_and_flashcards
+from library import import_files
+from quiz_store import QuizStore
+from qzb import BankFile, compile_bank
+from sampling import draw_questions, make_rng
+from tag_index import TagIndex
+from tag_matrix import TagMatrix
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+EXPRESSION = "(tag0 OR tag3) AND NOT tag1"  # Filter of the filtering and selection benchmarks
+QUIZ_LENGTH = 20
+SELECTIONS = 20  # Quizzes drawn per selection benchmark
+
+
+def generate_items(count: int, tags: int = 50, options: int = 4, flashcard_share: float = 0.2,
+                   seed: int = 0) -> str:
+    """
+    Generates the source of a synthetic bank. The same arguments always give the same bank.
+    :param count: The number of items.
+    :param tags: The number of distinct tags. Items get 1 to 3 of them, the first ones being the most common.
+    :param options: The number of options of each quiz.
+    :param flashcard_share: The share of flashcards among the items.
+    """
+    rng = random.Random(seed)
+    tag_names = [f"tag{i}" for i in range(tags)]
+    tag_weights = [1 / (rank + 1) for rank in range(tags)]  # Zipf-like, as in real banks
+    labels = [chr(ord('A') + i) for i in range(options)]
+    lines = []
+    for i in range(count):
+        item_tags = ", ".join(set(rng.choices(tag_names, tag_weights, k=rng.randint(1, 3))))
+        if rng.random() < flashcard_share:
+            lines += [f"F: Fact number {i} {rng.random():.6f}", f"A: Answer {i}"]
+        else:
+            lines += [f"Q: Question number {i} {rng.random():.6f}?", "O:"]
+            lines += [f"{label}. Option {label} of question {i}" for label in labels]
+            lines.append(f"A: {rng.choice(labels)}")
+        if rng.random() < 0.5:
+            lines.append(f"E: Explanation of item {i}.")
+        lines += [f"T: {item_tags}", "END", ""]
+    return "\n".join(lines)
+
+
+def generate_corpus(folder: str, count: int, files: int = 20, seed: int = 0, **options) -> List[str]:
+    """
+    Writes a synthetic bank of count items into quiz files spread over a directory tree.
+    Other keyword arguments are passed to generate_items.
+    :return: The paths of the files.
+    """
+    paths = []
+    for i in range(files):
+        directory = os.path.join(folder, f"group{i % 3}", f"set{i % 5}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"bank{i}.qz")
+        file_count = count // files + (i < count % files)
+        with open(path, "w") as file:
+            file.write(generate_items(file_count, seed=seed * 1000 + i, **options))
+        paths.append(path)
+    return paths
+
+
+def measure(function: Callable, repeat: int) -> float:
+    """
+    :return: The best time of repeat calls of function, in seconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(sizes=DEFAULT_SIZES, seed: int = 0, log=print) -> Dict[str, float]:
+    """
+    Runs every benchmark at every bank size.
+    :return: The time of each benchmark in seconds, keyed by "<benchmark>/<size>".
+    """
+    results = {}
+
+    def record(name, size, seconds):
+        results[f"{name}/{size}"] = seconds
+        log(f"{name:<28} {size:>9} items {seconds * 1000:12.3f} ms")
+
+    for size in sizes:
+        repeat = 5 if size <= 10_000 else 1
+        content = generate_items(size, seed=seed)
+        record("parse", size, measure(lambda: parse_quiz_and_flashcards(content, True), repeat))
+        items, _ = parse_quiz_and_flashcards(content, True)
+        del content
+
+        with tempfile.TemporaryDirectory() as folder:
+            generate_corpus(folder, size, seed=seed)
+            record("import_files", size, measure(lambda: import_files(folder, workers=1, stable_ids=True), repeat))
+
+            tag_sets = [item.tags for item in items.values() if item.type == 'quiz']
+            tag_lists = [list(tags) for tags in tag_sets]
+            postfix = compile_expression(EXPRESSION).postfix
+            record("filter/parse_expression", size,
+                   measure(lambda: sum(parse_expression(EXPRESSION, tags) for tags in tag_sets), repeat))
+            record("filter/evaluate_postfix", size,
+                   measure(lambda: sum(evaluate_postfix(postfix, tags) for tags in tag_lists), repeat))
+            index = TagIndex.from_items(items)
+            record("filter/tag_index", size, measure(lambda: index.query(EXPRESSION), repeat))
+            if TagMatrix.available:
+                matrix = TagMatrix.from_items(items)
+                record("filter/tag_matrix", size,
+                       measure(lambda: matrix.evaluate_postfix(postfix), repeat))
+                del matrix
+
+            def select(bank):
+                rng = make_rng(seed)
+                for _ in range(SELECTIONS):
+                    draw_questions(bank, EXPRESSION, QUIZ_LENGTH, 'uniform', rng)
+
+            store = QuizStore()
+            store.update(items)
+            record("select/quiz_store", size, measure(lambda: select(store), repeat) / SELECTIONS)
+            store.close()
+            bank_path = os.path.join(folder, "bank.qzb")
+            compile_bank(sorted(os.path.join(root, file) for root, _, files in os.walk(folder) for file in files),
+                         bank_path)
+            bank = BankFile(bank_path)
+            record("select/bank_file", size, measure(lambda: select(bank), repeat) / SELECTIONS)
+            bank.close()
+        del items
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float, log=print) -> List[str]:
+    """
+    Compares results with a baseline.
+    :return: The benchmarks slower than the baseline by more than the threshold factor.
+    """
+    regressions = []
+    for name, seconds in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        ratio = seconds / reference
+        flag = ""
+        if ratio > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        elif ratio < 1 / threshold:
+            flag = "  faster"
+        log(f"{name:<40} {reference * 1000:12.3f} ms -> {seconds * 1000:12.3f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+
+# Run the benchmarks:
+#   python benchmark.py [--sizes 1000,100000,1000000] [--output results.json] [--save-baseline]
+# Results are compared with benchmark_baseline.json if it exists, and the exit code is 1 if a
+# benchmark got slower than the baseline by more than the threshold factor.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks QuizMaster on synthetic banks.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Comma-separated bank sizes, in items.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Where to write the results as JSON. Printed if not given.")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Results to compare with.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline.")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="Slowdown factor over the baseline reported as a regression.")
+    arguments = parser.parse_args()
+
+    sizes = [int(size) for size in arguments.sizes.split(",")]
+    results = run(sizes, arguments.seed, log=lambda line: print(line, file=sys.stderr))
+    report = {'python': platform.python_version(), 'platform': platform.platform(), 'seed': arguments.seed,
+              'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'results': results}
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    regressions = []
+    if arguments.save_baseline:
+        with open(arguments.baseline, "w") as file:
+            json.dump(report, file, indent=2)
+    elif os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, arguments.threshold, log=lambda line: print(line, file=sys.stderr))
+    sys.exit(1 if regressions else 0)
@@ -1,29 +1,61 @@
+from functools import lru_cache
+
+OPERATOR_WORDS = {'AND': 'AND', 'OR': 'OR', 'NOT': 'NOT'}
+OPERATOR_SYMBOLS = {'&&': 'AND', '&': 'AND', '||': 'OR', '|': 'OR'}
+
+
+class TagSet(frozenset):
+    """
+    A set of tags that are already normalized (stripped and lowercase), as stored in item records.
+    Evaluating an expression on it skips the normalization step.
+    """
+
+
+class Tags(tuple):
+    """
+    The tags of an item as written, in order, as stored in item records. The TagSet of their
+    normalized forms is kept alongside, for expression evaluation and membership tests.
+    """
+
+    normalized: TagSet
+
+    def __contains__(self, tag) -> bool:
+        return tag in self.normalized
+
+
 def tokenize_expression(expression):
+    """
+    Splits an expression into tags, operators and parentheses in a single pass.
+    Operator words (and, or, not) are only recognized as whole words, so tags like "history" or
+    "notation" are left untouched. The symbols &, &&, | and || are operators wherever they appear.
+    """
     tokens = []
     current_token = []
 
-    normalized_expression = expression.replace('&&', 'AND').replace('&', 'AND')
-    normalized_expression = normalized_expression.replace('||', 'OR').replace('|', 'OR')
-    normalized_expression = normalized_expression.replace('not', 'NOT').replace('Not', 'NOT')
-    normalized_expression = normalized_expression.replace('and', 'AND').replace('And', 'AND')
-    normalized_expression = normalized_expression.replace('or', 'OR').replace('Or', 'OR')
+    def flush():
+        if current_token:
+            word = ''.join(current_token)
+            tokens.append(OPERATOR_WORDS.get(word.upper(), word))
+            current_token.clear()
 
-    operators = {'AND', 'OR', 'NOT', '(', ')'}
-
-    for char in normalized_expression:
+    index = 0
+    length = len(expression)
+    while index < length:
+        char = expression[index]
         if char.isspace():
-            if current_token:
-                tokens.append(''.join(current_token))
-                current_token = []
-        elif char in ['(', ')']:
-            if current_token:
-                tokens.append(''.join(current_token))
-                current_token = []
+            flush()
+        elif char in '()':
+            flush()
             tokens.append(char)
+        elif char in '&|':
+            flush()
+            if expression[index:index + 2] in OPERATOR_SYMBOLS:
+                index += 1
+            tokens.append(OPERATOR_SYMBOLS[char])
         else:
             current_token.append(char)
-    if current_token:  # Add the last token if there's any
-        tokens.append(''.join(current_token))
+        index += 1
+    flush()  # Add the last token if there's any
     return tokens
 
 
@@ -35,7 +67,9 @@ def infix_to_postfix(expression):
 
     for token in tokens:
         if token in precedence:  # If it's an operator, check precedence
-            while stack and stack[-1] != '(' and precedence[stack[-1]] >= precedence[token]:
+            # NOT is a right-associative prefix operator, so it never pops another NOT
+            while (stack and stack[-1] != '(' and token != 'NOT'
+                   and precedence[stack[-1]] >= precedence[token]):
                 postfix.append(stack.pop())
             stack.append(token)
         elif token == '(':
@@ -55,7 +89,10 @@ def infix_to_postfix(expression):
 
 def evaluate_postfix(postfix, tags):
     stack = []
-    tags = set(tag.lower() for tag in tags)  # Convert to set for efficient lookup
+    if isinstance(tags, Tags):
+        tags = tags.normalized
+    elif not isinstance(tags, TagSet):
+        tags = set(tag.lower() for tag in tags)  # Convert to set for efficient lookup
 
     for token in postfix:
         if token == 'AND':
@@ -75,6 +112,84 @@ def evaluate_postfix(postfix, tags):
     return stack.pop()
 
 
+class CompiledExpression:
+    """
+    A reusable predicate over tag lists, built once from an expression by :func:`compile_expression`.
+    AND and OR short-circuit, so the right operand is only evaluated when needed.
+    """
+
+    __slots__ = ('expression', 'postfix', 'matches')
+
+    def __init__(self, expression, postfix):
+        self.expression = expression
+        self.postfix = postfix
+        self.matches = build_predicate(postfix)
+
+    def __call__(self, tags):
+        """
+        :param tags: The list of tags to evaluate the expression on, in any case.
+        :return: True if the list of tags follows the expression, False otherwise.
+        """
+        if isinstance(tags, Tags):
+            return self.matches(tags.normalized)
+        if isinstance(tags, TagSet):
+            return self.matches(tags)
+        return self.matches({tag.lower() for tag in tags})
+
+    def __repr__(self):
+        return f"CompiledExpression({self.expression!r})"
+
+
+def build_predicate(postfix):
+    """
+    Turns a postfix expression into a function taking a set of lowercase tags.
+    An empty expression matches everything.
+    """
+    if not postfix:
+        return lambda tags: True
+
+    stack = []
+    try:
+        for token in postfix:
+            if token == 'AND':
+                right = stack.pop()
+                left = stack.pop()
+                stack.append(lambda tags, left=left, right=right: left(tags) and right(tags))
+            elif token == 'OR':
+                right = stack.pop()
+                left = stack.pop()
+                stack.append(lambda tags, left=left, right=right: left(tags) or right(tags))
+            elif token == 'NOT':
+                operand = stack.pop()
+                stack.append(lambda tags, operand=operand: not operand(tags))
+            else:
+                stack.append(lambda tags, tag=token: tag in tags)
+    except IndexError:
+        raise ValueError("Malformed expression: an operator is missing an operand.") from None
+
+    if len(stack) != 1:
+        raise ValueError("Malformed expression: tags must be separated by operators.")
+    return stack.pop()
+
+
+@lru_cache(maxsize=128)
+def compile_expression(expression):
+    """
+    Compiles a logical expression on tags into a reusable predicate. Compiled expressions are
+    cached by their text, so compiling the same expression again is free.
+    :param expression: A logical expression, with parentheses, AND, OR, and NOT.
+    :return: A CompiledExpression, to be called with a list of tags.
+    :raises ValueError: If the expression is malformed.
+    """
+    try:
+        postfix = tuple(infix_to_postfix(expression))
+    except IndexError:
+        raise ValueError("Malformed expression: unbalanced parentheses.") from None
+    if '(' in postfix:
+        raise ValueError("Malformed expression: unbalanced parentheses.")
+    return CompiledExpression(expression, postfix)
+
+
 def parse_expression(expression, tags):
     """
     Parses the logical expression on the tags and returns the result.
@@ -82,5 +197,4 @@ def parse_expression(expression, tags):
     :param tags: The list of tags to evaluate the expression on.
     :return: True if the list of tags follows the expression, False otherwise.
     """
-    postfix = infix_to_postfix(expression)
-    return evaluate_postfix(postfix, tags)
+    return compile_expression(expression)(tags)
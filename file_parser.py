@@ -1,35 +1,49 @@
-from typing import List, Dict, Tuple
+from typing import Dict, Generator, Iterable, List, Tuple
+import hashlib
+import io
+import json
 import uuid
+from quiz_items import Item, make_item
+from instrumentation import traced
 
 
-def parse_quiz_and_flashcards(content: str) -> Tuple[List[Dict], int]:
+def item_key(item: Dict) -> str:
     """
-    Parses content with quizzes and flashcards into a list of dictionaries.
+    Content-addressed key of an item: a hash of its type, question or fact, options and answer.
+    Explanations and tags are not part of it, so two items only differing by those share a key.
+    """
+    if item['type'] == 'quiz':
+        content = ['quiz', item['question'], list(item['options'].items()), item['answer']]
+    else:
+        content = ['flashcard', item['fact'], item['answer']]
+    canonical = json.dumps(content, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
 
-    :param content: The content containing quiz and flashcard items.
 
-    :returns: Tuple[List[Dict], int]: A list of quiz and flashcard items
-      as dictionaries, and an error code indicating the parsing status :
-      - 1: Unexpected error
-      - 2: Item started before the previous one ended
-      - 3: Flashcard block contains options
-      - 4: Unknown line argument
-      - 5: Missing arguments
-      - 6: Answer not in options
-      - 7: Argument outside of item block
-      - 8: Empty content
+def iter_quiz_and_flashcards(lines: Iterable[str],
+                             stable_ids: bool = False) -> Generator[Tuple[str, Item], None, int]:
+    """
+    Lazily parses quizzes and flashcards from an iterable of lines, such as an open file.
+
+    Items are yielded one at a time as ``(key, item)`` pairs as soon as their END line is read, so
+    memory use does not depend on the size of the input. Parsing stops at the first error, and the
+    error code is the return value of the generator (see :func:`parse_quiz_and_flashcards`).
+
+    :param lines: The lines containing quiz and flashcard items.
+    :param stable_ids: If True, keys are computed by :func:`item_key` from the content of the items,
+      so parsing the same item twice gives the same key. Otherwise, every item gets a new uuid1.
+
+    :returns: Generator[Tuple[str, Item], None, int]: The parsed items, as QuizItem and Flashcard
+      records, then the error code.
     """
-    items = {}
     item = {}
     options = []
     in_options = False
-
-    if not content:
-        return items, 8
+    empty = True
 
     try:
-        lines = content.strip().split('\n')
         for line in lines:
+            empty = False
             line = line.strip()
             if line:
                 if in_options and line[1] == ':':
@@ -38,20 +52,20 @@ def parse_quiz_and_flashcards(content: str) -> Tuple[List[Dict], int]:
                 content = content.strip()
 
                 if not item and command not in ('Q', 'F'):
-                    return items, 7
+                    return 7
 
                 match command:
                     case 'Q':
                         if item:  # Start of a new item before the previous one ended
-                            return items, 2
+                            return 2
                         item = {'type': 'quiz', 'question': content}
                     case 'F':
                         if item:  # Start of a new item before the previous one ended
-                            return items, 2
+                            return 2
                         item = {'type': 'flashcard', 'fact': content}
                     case 'O':
                         if item.get('type') == 'flashcard':
-                            return items, 3
+                            return 3
                         options = dict()
                         in_options = True
                     case _ if in_options:
@@ -61,7 +75,7 @@ def parse_quiz_and_flashcards(content: str) -> Tuple[List[Dict], int]:
                             item['options'] = options
                             in_options = False
                             if content not in options:
-                                return items, 6  # Answer not in options
+                                return 6  # Answer not in options
                         item['answer'] = content
                     case 'E':
                         item['explanation'] = content
@@ -69,31 +83,103 @@ def parse_quiz_and_flashcards(content: str) -> Tuple[List[Dict], int]:
                         item['tags'] = [tag.strip() for tag in content.split(',')]
                     case 'END':
                         if item['type'] == 'quiz' and ('options' not in item or 'answer' not in item):
-                            return items, 5
+                            return 5
                         if item['type'] == 'flashcard' and 'answer' not in item:
-                            return items, 5
-                        items[str(uuid.uuid1())] = item
+                            return 5
+                        record = make_item(item)
+                        yield item_key(record) if stable_ids else str(uuid.uuid1()), record
                         item = {}  # Reset for the next item
                         options = []
                     case _:
-                        return items, 4  # Unknown line argument
+                        return 4  # Unknown line argument
 
     except Exception as e:
         print(f"An error occurred: {e}")
-        return items, 1
+        return 1
+
+    if empty:
+        return 8
 
     if item:
-        return items, 2
+        return 2
+
+    return 0
+
+
+def collect_quiz_and_flashcards(lines: Iterable[str], stable_ids: bool = False) -> Tuple[Dict[str, Dict], int]:
+    """
+    Drains :func:`iter_quiz_and_flashcards` into a dictionary. With stable IDs, duplicated items
+    collapse into one, the last one winning.
+
+    :param lines: The lines containing quiz and flashcard items.
+    :param stable_ids: Whether keys are derived from the content of the items.
 
-    return items, 0
+    :returns: Tuple[Dict[str, Dict], int]: The items parsed before the first error, and the error code.
+    """
+    items = {}
+    parser = iter_quiz_and_flashcards(lines, stable_ids)
+    while True:
+        try:
+            key, item = next(parser)
+        except StopIteration as stop:
+            return items, stop.value
+        items[key] = item
+
+
+@traced()
+def parse_quiz_and_flashcards(content: str, stable_ids: bool = False) -> Tuple[Dict[str, Dict], int]:
+    """
+    Parses content with quizzes and flashcards into a list of dictionaries.
+
+    :param content: The content containing quiz and flashcard items.
+    :param stable_ids: Whether keys are derived from the content of the items (see :func:`item_key`)
+      rather than random.
+
+    :returns: Tuple[Dict[str, Dict], int]: A dictionary of quiz and flashcard items
+      keyed by item ID, and an error code indicating the parsing status :
+      - 1: Unexpected error
+      - 2: Item started before the previous one ended
+      - 3: Flashcard block contains options
+      - 4: Unknown line argument
+      - 5: Missing arguments
+      - 6: Answer not in options
+      - 7: Argument outside of item block
+      - 8: Empty content
+    """
+    if not content:
+        return {}, 8
+    return collect_quiz_and_flashcards(io.StringIO(content), stable_ids)
+
+
+def split_blocks(content: str) -> List[str]:
+    """
+    Splits content into blocks that can be parsed independently, each starting at a Q: or F: line and
+    running until the next one. Anything before the first item is a block of its own, unless blank.
+    Parsing the blocks one by one finds the same items, and the same first error, as parsing the
+    whole content.
+    """
+    blocks = []
+    current = []
+    has_content = False
+    for line in content.splitlines(keepends=True):
+        if has_content and line.strip().partition(':')[0] in ('Q', 'F'):
+            blocks.append(''.join(current))
+            current = []
+            has_content = False
+        current.append(line)
+        has_content = has_content or bool(line.strip())
+    if has_content:
+        blocks.append(''.join(current))
+    return blocks
 
 
-def parse_quiz_and_flashcards_file(file_path: str) -> Tuple[Dict[str, Dict], int]:
+@traced()
+def parse_quiz_and_flashcards_file(file_path: str, stable_ids: bool = False) -> Tuple[Dict[str, Dict], int]:
     """
-    Wrapper to parse files directly.
+    Wrapper to parse files directly. The file is read line by line rather than loaded at once.
     """
     with open(file_path, "r") as file:
-        return parse_quiz_and_flashcards(file.read())
+        return collect_quiz_and_flashcards(file, stable_ids)
 
 
 # Example usage:
@@ -0,0 +1,94 @@
+from typing import Dict, Iterable, Optional, Tuple
+import hashlib
+import os
+import pickle
+
+CACHE_VERSION = 4  # Bump whenever the parser output changes, to invalidate old caches
+
+
+def file_digest(file_path: str) -> bytes:
+    """
+    Hashes the content of a file, reading it in chunks.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+class ImportCache:
+    """
+    On-disk cache of parsed quiz files, so unchanged files are not parsed again on every launch.
+
+    Entries are keyed by path and validated against the file's size and modification time. When
+    those changed but the size did not, the content hash decides whether the entry is still good,
+    so touching a file without editing it does not trigger a re-parse.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # file path -> (size, mtime_ns, digest, items, error_code)
+        self.entries: Dict[str, Tuple[int, int, bytes, Dict[str, Dict], int]] = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        """
+        Loads the cache from disk. A missing, corrupted or outdated cache is silently discarded.
+        """
+        try:
+            with open(self.path, "rb") as file:
+                version, entries = pickle.load(file)
+        except Exception:  # Unpickling can fail in many ways, and the cache is only an optimization
+            return
+        if version == CACHE_VERSION and isinstance(entries, dict):
+            self.entries = entries
+
+    def save(self):
+        """
+        Writes the cache to disk if it changed. The file is replaced atomically.
+        """
+        if not self.dirty:
+            return
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            pickle.dump((CACHE_VERSION, self.entries), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, self.path)
+        self.dirty = False
+
+    def lookup(self, file_path: str, stat: os.stat_result) -> Optional[Tuple[Dict[str, Dict], int]]:
+        """
+        :param file_path: The path of the quiz file.
+        :param stat: The current os.stat of the file.
+        :return: The cached (items, error_code) of the file, or None if it must be parsed again.
+        """
+        entry = self.entries.get(file_path)
+        if entry is None:
+            return None
+        size, mtime, digest, items, error_code = entry
+        if size != stat.st_size:
+            return None
+        if mtime != stat.st_mtime_ns:
+            if file_digest(file_path) != digest:
+                return None
+            self.entries[file_path] = (size, stat.st_mtime_ns, digest, items, error_code)
+            self.dirty = True
+        return items, error_code
+
+    def store(self, file_path: str, stat: os.stat_result, items: Dict[str, Dict], error_code: int):
+        """
+        Records the parse result of a file.
+        :param stat: The os.stat of the file taken before it was parsed.
+        """
+        self.entries[file_path] = (stat.st_size, stat.st_mtime_ns, file_digest(file_path), items, error_code)
+        self.dirty = True
+
+    def prune(self, file_paths: Iterable[str]):
+        """
+        Drops the entries of files that are not in file_paths anymore.
+        """
+        file_paths = set(file_paths)
+        for file_path in [file_path for file_path in self.entries if file_path not in file_paths]:
+            del self.entries[file_path]
+            self.dirty = True
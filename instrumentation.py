@@ -0,0 +1,141 @@
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+# Tracing is off unless QUIZMASTER_TRACE is set, to 1 or to the path of the trace file, or the app
+# is started with --trace. While off, spans and counters only cost a check of ENABLED.
+ENABLED = False
+DEFAULT_TRACE_PATH = "quizmaster_trace.json"
+
+trace_path: Optional[str] = None
+spans: List[Tuple[str, int, int, int, Optional[Dict]]] = []  # (name, start, duration in ns, thread, args)
+counters: Dict[str, int] = defaultdict(int)
+_lock = threading.Lock()
+_origin = time.perf_counter_ns()
+_disabled_span = nullcontext()
+
+
+def enable(path: str = None):
+    """
+    Starts recording spans and counters. On exit, the trace is written to path as Chrome trace
+    events, to be opened in chrome://tracing or Perfetto, and a summary is printed.
+    :param path: Where to write the trace. By default, the path already set, else DEFAULT_TRACE_PATH.
+    """
+    global ENABLED, trace_path
+    if not ENABLED:
+        atexit.register(_on_exit)
+    ENABLED = True
+    trace_path = path or trace_path or DEFAULT_TRACE_PATH
+
+
+def reset():
+    spans.clear()
+    counters.clear()
+
+
+@contextmanager
+def _span(name: str, args: Optional[Dict]):
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        spans.append((name, start - _origin, time.perf_counter_ns() - start, threading.get_ident(), args))
+
+
+def span(name: str, **args):
+    """
+    Times a block of code: with span("import_files"): ...
+    :param args: Details shown with the span in the trace.
+    """
+    if not ENABLED:
+        return _disabled_span
+    return _span(name, args or None)
+
+
+def traced(name: str = None):
+    """
+    Decorator timing every call of a function as a span, named after the function by default.
+    """
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with _span(span_name, None):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, value: int = 1):
+    """
+    Adds value to a counter, such as the number of files parsed.
+    """
+    if ENABLED:
+        with _lock:
+            counters[name] += value
+
+
+def chrome_trace() -> Dict:
+    """
+    :return: The recorded spans as complete events, and the counters as counter events at the end
+      of the trace, in the Chrome trace-event format.
+    """
+    pid = os.getpid()
+    events = [{'name': name, 'ph': 'X', 'ts': start / 1000, 'dur': duration / 1000, 'pid': pid, 'tid': thread,
+               **({'args': args} if args else {})}
+              for name, start, duration, thread, args in list(spans)]
+    end = max((event['ts'] + event['dur'] for event in events), default=0)
+    events += [{'name': name, 'ph': 'C', 'ts': end, 'pid': pid, 'args': {'value': value}}
+               for name, value in sorted(counters.items())]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def summary() -> str:
+    """
+    :return: A table of the total, mean and maximum time of each span, slowest first, and the counters.
+    """
+    totals = defaultdict(lambda: [0, 0, 0])  # name -> [calls, total, max]
+    for name, _, duration, _, _ in list(spans):
+        entry = totals[name]
+        entry[0] += 1
+        entry[1] += duration
+        entry[2] = max(entry[2], duration)
+    lines = [f"{'Span':<40} {'Calls':>8} {'Total ms':>12} {'Mean ms':>10} {'Max ms':>10}"]
+    for name, (calls, total, longest) in sorted(totals.items(), key=lambda entry: -entry[1][1]):
+        lines.append(f"{name:<40} {calls:>8} {total / 1e6:>12.2f} {total / calls / 1e6:>10.3f} {longest / 1e6:>10.3f}")
+    if counters:
+        lines.append("")
+        lines.append(f"{'Counter':<40} {'Value':>8}")
+        lines += [f"{name:<40} {value:>8}" for name, value in sorted(counters.items())]
+    return "\n".join(lines)
+
+
+def dump(path: str):
+    with open(path, "w") as file:
+        json.dump(chrome_trace(), file)
+
+
+def _on_exit():
+    try:
+        dump(trace_path)
+    except OSError as e:
+        print(f"Could not write the trace: {e}", file=sys.stderr)
+    else:
+        print(f"Trace written to {os.path.abspath(trace_path)}", file=sys.stderr)
+    print(summary(), file=sys.stderr)
+
+
+if os.getenv("QUIZMASTER_TRACE"):
+    enable(None if os.getenv("QUIZMASTER_TRACE") == "1" else os.getenv("QUIZMASTER_TRACE"))
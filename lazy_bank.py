@@ -0,0 +1,275 @@
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import locale
+from expression_parser import Tags, compile_expression
+from file_parser import iter_quiz_and_flashcards, parse_quiz_and_flashcards
+from quiz_items import Item, make_item
+from tag_index import TagIndex
+from query_planner import TagStatistics
+from quiz_store import TEXT_FIELDS
+from search_index import search_text
+
+DEFAULT_BUDGET = 1 << 20  # Bytes of item source kept in memory by the body cache
+
+
+class ItemRef:
+    """
+    What a lazy bank keeps in memory for an item: its key, type and tags, and where its source is.
+    Items edited during the session have no file, their body stays in memory.
+    """
+
+    __slots__ = ('key', 'type', 'tags', 'path', 'offset', 'length')
+
+    def __init__(self, key: str, item_type: str, tags: Tags, path: Optional[str], offset: int, length: int):
+        self.key = key
+        self.type = item_type
+        self.tags = tags
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+
+def index_file(file_path: str, stable_ids: bool = False) -> Tuple[List[ItemRef], int]:
+    """
+    Parses a quiz file and records the byte range of each item instead of keeping it.
+    The file is read in binary, decoded line by line with the encoding open() would use.
+    :return: The references of the items parsed before the first error, and the error code.
+    """
+    encoding = locale.getpreferredencoding(False)
+    refs = []
+    position = 0
+    start = 0
+
+    def lines(file):
+        nonlocal position, start
+        for line in file:
+            text = line.decode(encoding)
+            if text.strip().partition(':')[0] in ('Q', 'F'):
+                start = position
+            position += len(line)
+            yield text
+
+    with open(file_path, "rb") as file:
+        parser = iter_quiz_and_flashcards(lines(file), stable_ids)
+        while True:
+            try:
+                key, item = next(parser)
+            except StopIteration as stop:
+                return refs, stop.value
+            # The parser yields an item as soon as its END line is read, so position is right after it
+            refs.append(ItemRef(key, item.type, item.tags, file_path, start, position - start))
+
+
+def read_item(ref: ItemRef, file=None) -> Item:
+    """
+    Loads the body of an item from its file.
+    :param file: An already open binary file on ref.path, to read several items without reopening it.
+    """
+    if file is None:
+        with open(ref.path, "rb") as file:
+            return read_item(ref, file)
+    file.seek(ref.offset)
+    source = file.read(ref.length).decode(locale.getpreferredencoding(False))
+    items, error_code = parse_quiz_and_flashcards(source)
+    if error_code != 0 or len(items) != 1:
+        raise ValueError(f"{ref.path} changed since it was indexed")
+    return next(iter(items.values()))
+
+
+class ItemCache:
+    """
+    LRU cache of item bodies bounded by a memory budget. The cost of an item is the size of its
+    source, which its resident size is roughly proportional to.
+    """
+
+    def __init__(self, budget: int = DEFAULT_BUDGET):
+        self.budget = budget
+        self.used = 0
+        self.entries: OrderedDict[str, Tuple[Item, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: str) -> Optional[Item]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, item: Item, cost: int):
+        self.discard(key)
+        self.entries[key] = (item, cost)
+        self.used += cost
+        while self.used > self.budget and len(self.entries) > 1:  # The newest item is always kept
+            _, (_, evicted_cost) = self.entries.popitem(last=False)
+            self.used -= evicted_cost
+
+    def discard(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.used -= entry[1]
+
+
+class LazyBank(MutableMapping):
+    """
+    Bank of items that only keeps their key, type and tags in memory. Bodies are read back from the
+    quiz files when accessed, through an LRU cache with a memory budget, so resident memory grows
+    with the number of items rather than with the size of the library.
+
+    It offers the same interface as QuizStore. Items set or edited are kept in memory for the
+    session and not written back to the files.
+    """
+
+    def __init__(self, budget: int = DEFAULT_BUDGET, stable_ids: bool = False):
+        self.stable_ids = stable_ids
+        self.refs: Dict[str, ItemRef] = {}
+        self.edited: Dict[str, Item] = {}
+        self.index = TagIndex()
+        self.cache = ItemCache(budget)
+
+    def close(self):
+        pass  # Files are only opened while reading from them
+
+    def _add_ref(self, ref: ItemRef):
+        old = self.refs.pop(ref.key, None)  # Replaced items move to the end, as in a dictionary update
+        if old is not None:
+            self.index.remove(ref.key, {'type': old.type, 'tags': old.tags})
+        self.refs[ref.key] = ref
+        self.index.add(ref.key, {'type': ref.type, 'tags': ref.tags})
+
+    def add_file(self, file_path: str) -> int:
+        """
+        Indexes the items of a quiz file. Items with a key already in the bank replace the previous ones.
+        :return: The error code of the parse. A file with an error is left out entirely, as import_files does.
+        """
+        refs, error_code = index_file(file_path, self.stable_ids)
+        if error_code != 0:
+            return error_code
+        for ref in refs:
+            self.edited.pop(ref.key, None)
+            self.cache.discard(ref.key)
+            self._add_ref(ref)
+        return error_code
+
+    # Reading
+
+    def __getitem__(self, key: str) -> Item:
+        ref = self.refs[key]
+        if ref.path is None:
+            return self.edited[key]
+        item = self.cache.get(key)
+        if item is None:
+            item = read_item(ref)
+            self.cache.put(key, item, ref.length)
+        return item
+
+    def __contains__(self, key) -> bool:
+        return key in self.refs
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.refs)
+
+    def __len__(self) -> int:
+        return len(self.refs)
+
+    def items_of_type(self, item_type: str = None) -> Iterator[Tuple[str, Item]]:
+        """
+        Iterates over the (key, item) pairs of the bank, optionally only those of one type.
+        """
+        for key, ref in list(self.refs.items()):
+            if item_type is None or ref.type == item_type:
+                yield key, self[key]
+
+    def _read_all(self, text_of) -> List[Tuple[str, str, str]]:
+        # (key, type, text_of(item)) of every item, in order. Bodies are read file by file and not
+        # cached, so listing the bank does not evict the items in use.
+        texts = {}
+        by_path = {}
+        for key, ref in self.refs.items():
+            if ref.path is None:
+                texts[key] = text_of(self.edited[key])
+            else:
+                by_path.setdefault(ref.path, []).append(ref)
+        for path, refs in by_path.items():
+            with open(path, "rb") as file:
+                for ref in sorted(refs, key=lambda ref: ref.offset):
+                    texts[ref.key] = text_of(read_item(ref, file))
+        return [(key, ref.type, texts[key]) for key, ref in self.refs.items()]
+
+    def texts(self) -> List[Tuple[str, str, str]]:
+        """
+        :return: The (key, type, question or fact) of every item, in order. Bodies are read file by
+          file and not cached, so listing the bank does not evict the items in use.
+        """
+        return self._read_all(lambda item: item[TEXT_FIELDS[item.type]])
+
+    def documents(self) -> List[Tuple[str, str, str]]:
+        """
+        :return: The (key, type, searchable text) of every item, in order, for the search index.
+        """
+        return self._read_all(search_text)
+
+    # Writing
+
+    def __setitem__(self, key: str, item: Item):
+        if not isinstance(item, Item):
+            item = make_item(item)
+        self.cache.discard(key)
+        self.edited[key] = item
+        self._add_ref(ItemRef(key, item.type, item.tags, None, 0, 0))
+
+    def __delitem__(self, key: str):
+        ref = self.refs.pop(key)
+        self.index.remove(key, {'type': ref.type, 'tags': ref.tags})
+        self.edited.pop(key, None)
+        self.cache.discard(key)
+
+    def __ior__(self, items: Dict[str, Dict]) -> 'LazyBank':
+        self.update(items)
+        return self
+
+    def add_missing(self, items: Dict[str, Dict]) -> int:
+        """
+        Adds the items whose key is not in the bank yet.
+        :return: The number of items added.
+        """
+        inserted = 0
+        for key, item in items.items():
+            if key not in self:
+                self[key] = item
+                inserted += 1
+        return inserted
+
+    # Tag queries
+
+    def tags(self, item_type: str = 'quiz', expression: str = None) -> List[str]:
+        """
+        :param expression: If given, only the tags of the items matching this tag expression.
+        :return: The normalized tags used by at least one item of the given type, sorted.
+        """
+        if expression is None or not expression.strip():
+            return sorted(self.index.tags(item_type))
+        return sorted({tag for key in self.query(expression, item_type) for tag in self.refs[key].tags.normalized})
+
+    def statistics(self, item_type: str = 'quiz') -> TagStatistics:
+        return self.index.statistics(item_type)
+
+    def query(self, expression: str, item_type: str = 'quiz') -> Set[str]:
+        """
+        Evaluates a tag expression against the in-memory tag index.
+        :return: The set of keys of the matching items.
+        :raises ValueError: If the expression is malformed.
+        """
+        return self.index.query(expression, item_type)
+
+    def iter_query(self, expression: str, item_type: str = 'quiz') -> Iterator[str]:
+        """
+        Same as query, as an iterator over the keys in bank order, like QuizStore.iter_query. The order
+        of a set of keys changes with the hash seed of the process, which would change seeded quizzes.
+        The tags of each item are tested as the keys are read, so no set of matches is built.
+        :raises ValueError: If the expression is malformed.
+        """
+        matches = compile_expression(expression)
+        return (key for key, ref in self.refs.items() if ref.type == item_type and matches(ref.tags))
@@ -0,0 +1,203 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict
+import os
+from file_parser import parse_quiz_and_flashcards_file
+from tag_index import TagIndex
+from quiz_store import QuizStore
+from lazy_bank import LazyBank
+from search_index import SearchIndex
+from import_cache import ImportCache
+from qzb import BankFile, bank_state, open_fresh_bank, write_bank
+import instrumentation
+
+ERRORS = {1: "An unexpected error occurred.",
+          2: "An item was not properly ended.",
+          3: "Flashcards cannot have options.",
+          4: "Unknown line argument.",
+          5: "An item is missing required fields.",
+          6: "Answer not in options.",
+          7: "Arguments must be between Q or F and END.",
+          8: "No content."}
+IMPORT_WORKERS = int(os.getenv("QUIZMASTER_IMPORT_WORKERS", "1"))  # More than 1 parses files in parallel
+STABLE_IDS = True  # Key items by a hash of their content, so re-imports give the same keys
+
+
+def find_quiz_files(folder: str):
+    """
+    List the quiz files of a folder and its subfolders, in the order os.walk visits them.
+    """
+    return [os.path.join(subdir[0], file) for subdir in os.walk(folder) for file in subdir[2]
+            if file.endswith(".qz") or file.endswith(".txt")]
+
+
+@instrumentation.traced()
+def import_files(folder: str, index: TagIndex = None, workers: int = None, cache: ImportCache = None,
+                 stable_ids: bool = None, progress=None, bank_path: str = None, sources: Dict[str, str] = None):
+    """
+    Import the quiz files of a folder.
+    :param folder: The folder containing the quiz files.
+    :param index: If given, the tag index is updated with the imported items.
+    :param workers: Number of processes parsing files in parallel, IMPORT_WORKERS by default.
+      Files are merged in the same order either way, so the result does not depend on it.
+    :param cache: If given, only new or modified files are parsed, the others are taken from the cache.
+      The cache is updated and saved afterwards. A cache must always be used with the same stable_ids.
+    :param stable_ids: Whether item keys are derived from their content, STABLE_IDS by default. With
+      stable IDs, the same item found in several files is only imported once.
+    :param progress: If given, called with the share of files parsed so far, between 0 and 1.
+    :param bank_path: If given, a compiled bank file (.qzb) that is up to date with the files is used
+      instead of parsing them, and the result is then a read-only BankFile to close after use.
+      Otherwise, the bank file is compiled from the parsed files for the next import.
+    :param sources: If given, filled with the path of the file each parsed item comes from. When the
+      compiled bank is used instead, BankFile.sources gives them.
+    """
+    if workers is None:
+        workers = IMPORT_WORKERS
+    if stable_ids is None:
+        stable_ids = STABLE_IDS
+    parse_file = partial(parse_quiz_and_flashcards_file, stable_ids=stable_ids)
+    errors = []
+    result = {}
+    nb_success = 0
+    paths = find_quiz_files(folder)
+    parsed = [None] * len(paths)
+
+    if bank_path is not None:
+        bank = open_fresh_bank(bank_path, paths, stable_ids)
+        if bank is not None:
+            for path, _, _, error_code in bank.manifest['files']:
+                if error_code != 0:
+                    errors.append(f"{os.path.basename(path)} : Error {error_code} : "
+                                  f"{ERRORS.get(error_code, 'Unknown error.')}")
+                else:
+                    nb_success += 1
+            if index is not None:
+                index.update(bank)
+            if progress is not None:
+                progress(1)
+            instrumentation.count("items_ingested", len(bank))
+            return bank, errors, nb_success
+
+    if cache is not None or bank_path is not None:
+        stats = [os.stat(path) for path in paths]
+    if cache is not None:
+        for i, path in enumerate(paths):
+            parsed[i] = cache.lookup(path, stats[i])
+    to_parse = [i for i, result_and_code in enumerate(parsed) if result_and_code is None]
+    instrumentation.count("files_parsed", len(to_parse))
+
+    if workers > 1 and len(to_parse) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map yields results in submission order, which keeps the merge deterministic
+            new_results = executor.map(parse_file, [paths[i] for i in to_parse],
+                                       chunksize=max(1, len(to_parse) // (workers * 4)))
+            for count, (i, result_and_code) in enumerate(zip(to_parse, new_results), 1):
+                parsed[i] = result_and_code
+                if progress is not None:
+                    progress(count / len(to_parse))
+    else:
+        for count, i in enumerate(to_parse, 1):
+            parsed[i] = parse_file(paths[i])
+            if progress is not None:
+                progress(count / len(to_parse))
+
+    if cache is not None:
+        for i in to_parse:
+            cache.store(paths[i], stats[i], *parsed[i])
+        cache.prune(paths)
+        try:
+            cache.save()
+        except OSError as e:
+            print(f"Could not save the import cache: {e}")
+
+    item_sources = {}
+    for path, (items, error_code) in zip(paths, parsed):
+        if error_code != 0:
+            errors.append(f"{os.path.basename(path)} : Error {error_code} : "
+                          f"{ERRORS.get(error_code, 'Unknown error.')}")
+        else:
+            if index is not None:
+                for key in items.keys() & result.keys():  # Duplicates replace the previous item
+                    index.remove(key, result[key])
+                index.update(items)
+            result.update(items)
+            item_sources.update(dict.fromkeys(items, path))
+            nb_success += 1
+    instrumentation.count("items_ingested", len(result))
+
+    if bank_path is not None:
+        files = [(path, stat.st_size, stat.st_mtime_ns, error_code)
+                 for path, stat, (_, error_code) in zip(paths, stats, parsed)]
+        try:
+            write_bank(bank_path, result, files, stable_ids, item_sources)
+        except OSError as e:
+            print(f"Could not save the compiled bank: {e}")
+    if sources is not None:
+        sources.update(item_sources)
+    return result, errors, nb_success
+
+
+def load_library(database_path: str, folder: str, cache_path: str = None, bank_path: str = None,
+                 progress=None, search_index: SearchIndex = None):
+    """
+    Import the quiz files of a folder into the bank database. Meant to run on the startup worker, so
+    it uses its own connection to the database.
+    :param cache_path: If given, the import cache of the folder, see ImportCache.
+    :param bank_path: If given, the compiled bank of the folder, see import_files.
+    :param progress: If given, called with the share of files parsed so far.
+    :param search_index: If given, filled with the text of the items of the bank.
+    :return: The import errors and the number of files opened successfully.
+    """
+    store = QuizStore(database_path)
+    try:
+        sources = {}
+        items, errors, nb = import_files(folder, cache=None if cache_path is None else ImportCache(cache_path),
+                                         progress=progress, bank_path=bank_path, sources=sources)
+        # The bank file is only reused when no quiz file changed, so its state identifies the imported items.
+        # If it was merged at the last launch, the store is already up to date.
+        state = None if bank_path is None else bank_state(bank_path)
+        if isinstance(items, BankFile):
+            if state != store.imported_state():
+                store.import_items(items, items.sources(), state)  # Items edited in the app keep their edits
+            items.close()
+        else:
+            store.import_items(items, sources, state)
+        if search_index is not None:
+            index_library(search_index, store.documents())
+    finally:
+        store.close()
+    return errors, nb
+
+
+def load_lazy_library(bank: LazyBank, folder: str, progress=None, search_index: SearchIndex = None):
+    """
+    Index the quiz files of a folder into a lazy bank, which only keeps the location of the items.
+    :param progress: If given, called with the share of files indexed so far.
+    :param search_index: If given, filled with the text of the items of the bank.
+    :return: The import errors and the number of files opened successfully.
+    """
+    errors = []
+    nb_success = 0
+    paths = find_quiz_files(folder)
+    for count, path in enumerate(paths, 1):
+        error_code = bank.add_file(path)
+        if error_code != 0:
+            errors.append(f"{os.path.basename(path)} : Error {error_code} : "
+                          f"{ERRORS.get(error_code, 'Unknown error.')}")
+        else:
+            nb_success += 1
+        if progress is not None:
+            progress(count / len(paths))
+    if search_index is not None:
+        index_library(search_index, bank.documents())
+    return errors, nb_success
+
+
+@instrumentation.traced()
+def index_library(search_index: SearchIndex, documents):
+    """
+    Fills the search index with the (key, type, text) documents of a bank, and ranks the common
+    words so that the first searches of the session are as fast as the next ones.
+    """
+    search_index.update_documents(documents)
+    search_index.rank_common_words()
@@ -0,0 +1,251 @@
+from functools import lru_cache
+from typing import Callable, List, Mapping, Optional, Sequence, Tuple
+from expression_parser import compile_expression
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+
+class TagStatistics:
+    """
+    How many items of a type carry each tag, out of how many. Banks keep them up to date as
+    items are imported, and the planner uses them to estimate how many items an expression matches.
+    """
+
+    __slots__ = ('frequency', 'total')
+
+    def __init__(self, frequency: Callable[[str], int], total: int):
+        """
+        :param frequency: Gives the number of items carrying a normalized tag, 0 if none does.
+        :param total: The number of items.
+        """
+        self.frequency = frequency
+        self.total = total
+
+    @classmethod
+    def from_counts(cls, counts: Mapping[str, int], total: int) -> 'TagStatistics':
+        return cls(lambda tag: counts.get(tag, 0), total)
+
+    @classmethod
+    def from_items(cls, items: Mapping[str, Mapping], item_type: str = 'quiz') -> 'TagStatistics':
+        counts = {}
+        total = 0
+        for item in items.values():
+            if item['type'] == item_type:
+                total += 1
+                for tag in {tag.strip().lower() for tag in item.get('tags', [])}:
+                    counts[tag] = counts.get(tag, 0) + 1
+        return cls.from_counts(counts, total)
+
+
+# Plan nodes are tuples: ('TAG', tag), ('NOT', node), ('AND', operands), ('OR', operands) and
+# ('CONST', bool). Once planned, NOT only applies to tags, and each operand comes with its
+# estimated number of matches: ('AND', ((node, estimate), ...)).
+
+def build_tree(postfix: Sequence[str]):
+    """
+    Turns a postfix expression into a tree, merging chains of the same operator into one node.
+    :raises ValueError: If the expression is malformed.
+    """
+    if not postfix:
+        return 'CONST', True
+    stack = []
+    try:
+        for token in postfix:
+            if token in ('AND', 'OR'):
+                right = stack.pop()
+                left = stack.pop()
+                operands = ()
+                for operand in (left, right):
+                    operands += operand[1] if operand[0] == token else (operand,)
+                stack.append((token, operands))
+            elif token == 'NOT':
+                stack.append(('NOT', stack.pop()))
+            else:
+                stack.append(('TAG', token))
+    except IndexError:
+        raise ValueError("Malformed expression: an operator is missing an operand.") from None
+    if len(stack) != 1:
+        raise ValueError("Malformed expression: tags must be separated by operators.")
+    return stack.pop()
+
+
+def push_not_down(node, negate: bool = False):
+    """
+    Moves the NOTs down to the tags with De Morgan's laws, so that AND and OR operands can be
+    reordered freely: NOT (a AND b) becomes NOT a OR NOT b, and NOT NOT a becomes a.
+    """
+    kind = node[0]
+    if kind == 'NOT':
+        return push_not_down(node[1], not negate)
+    if kind in ('AND', 'OR'):
+        if negate:
+            kind = 'OR' if kind == 'AND' else 'AND'
+        return kind, tuple(push_not_down(operand, negate) for operand in node[1])
+    if kind == 'CONST':
+        return 'CONST', node[1] != negate
+    return ('NOT', node) if negate else node
+
+
+@lru_cache(maxsize=128)
+def normal_form(postfix: Tuple[str, ...]):
+    """
+    :return: The tree of a postfix expression with the NOTs pushed down. It does not depend on the
+      statistics, so it is cached like compiled expressions.
+    """
+    return push_not_down(build_tree(postfix))
+
+
+def fold_and_order(node, statistics: TagStatistics):
+    """
+    Plans a tree in normal form, from the tags up:
+    - tags no item carries become False, and tags every item carries become True, then the
+      operators around them are simplified;
+    - the operands of AND are sorted from the most to the least selective, so that intermediate
+      results stay small and per-item evaluation fails early, and the operands of OR from the
+      most to the least likely, so that per-item evaluation succeeds early. Ties keep the typed order.
+    Estimates assume that tags are independent.
+    :return: The planned node and its estimated number of matches.
+    """
+    total = statistics.total
+    kind = node[0]
+    if kind in ('TAG', 'NOT'):
+        frequency = statistics.frequency(node[1] if kind == 'TAG' else node[1][1])
+        if frequency == 0 or frequency >= total:
+            value = (frequency != 0) == (kind == 'TAG')
+            return ('CONST', value), total if value else 0
+        return node, frequency if kind == 'TAG' else total - frequency
+    if kind == 'CONST':
+        return node, total if node[1] else 0
+
+    absorbing = kind == 'OR'  # False absorbs AND, True absorbs OR
+    operands = []
+    for operand in node[1]:
+        operand = fold_and_order(operand, statistics)
+        operand_kind = operand[0][0]
+        if operand_kind == 'CONST':
+            if operand[0][1] == absorbing:
+                return operand
+            continue  # Neutral element
+        if operand_kind == kind:  # Folding may leave an AND right under an AND
+            operands += operand[0][1]
+        else:
+            operands.append(operand)
+    if not operands:
+        return ('CONST', not absorbing), 0 if absorbing else total
+    if len(operands) == 1:
+        return operands[0]
+    operands.sort(key=lambda operand: operand[1], reverse=absorbing)
+    share = 1.0
+    for _, count in operands:
+        share *= (1 - count / total) if absorbing else count / total
+    return (kind, tuple(operands)), total * (1 - share if absorbing else share)
+
+
+def tree_to_postfix(node, postfix: List[str]) -> List[str]:
+    kind, value = node[0]
+    if kind == 'TAG':
+        postfix.append(value)
+    elif kind == 'NOT':
+        postfix += (value[1], 'NOT')
+    else:
+        tree_to_postfix(value[0], postfix)
+        for operand in value[1:]:
+            tree_to_postfix(operand, postfix)
+            postfix.append(kind)
+    return postfix
+
+
+class Plan:
+    """
+    The cheapest evaluation found for an expression on a bank.
+    If constant is not None, the expression matches either every item or none, and nothing needs
+    to be evaluated. Otherwise, postfix is the expression to evaluate, in the planned order.
+    """
+
+    __slots__ = ('expression', 'postfix', 'constant', 'tree', 'statistics')
+
+    def __init__(self, expression: str, postfix: Tuple[str, ...], constant: Optional[bool], tree,
+                 statistics: TagStatistics):
+        self.expression = expression
+        self.postfix = postfix
+        self.constant = constant
+        self.tree = tree
+        self.statistics = statistics
+
+    @property
+    def estimate(self) -> float:
+        return self.tree[1]
+
+    def explain(self) -> str:
+        """
+        :return: The planned evaluation order, one operand per line in the order it is evaluated,
+          with the estimated number of items matching it.
+        """
+        total = self.statistics.total
+        lines = [f"Expression: {self.expression}", f"Items: {total}"]
+        tags = dict.fromkeys(token for token in compile_expression(self.expression).postfix if token not in OPERATORS)
+        for tag in (tag for tag in tags if tag not in self.postfix):
+            frequency = self.statistics.frequency(tag)
+            lines.append(f"Folded: {tag} is carried by {'every item' if frequency else 'no item'}")
+        if self.constant is not None:
+            lines.append(f"Constant: matches {'every item' if self.constant else 'no item'}, nothing to evaluate")
+            return "\n".join(lines)
+        lines.append(f"Plan: {' '.join(self.postfix)}")
+
+        def describe(node, depth):
+            (kind, value), count = node
+            if kind == 'TAG':
+                label = value
+            elif kind == 'NOT':
+                label = f"NOT {value[1]}"
+            else:
+                label = kind
+            lines.append(f"{'  ' * depth}{label:<{max(1, 40 - 2 * depth)}} ~{count:.0f}")
+            if kind in ('AND', 'OR'):
+                for operand in value:
+                    describe(operand, depth + 1)
+
+        describe(self.tree, 0)
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"Plan({self.expression!r}, {' '.join(self.postfix)!r})"
+
+
+def plan(expression: str, statistics: TagStatistics) -> Plan:
+    """
+    Plans the evaluation of a tag expression: NOTs are pushed down to the tags, tags no item
+    carries (or every item carries) are folded into constants, and the operands of AND and OR are
+    reordered by their estimated selectivity. The plan matches the same items as the expression.
+    :param statistics: The tag statistics of the items the expression is evaluated on.
+    :raises ValueError: If the expression is malformed.
+    """
+    tree = fold_and_order(normal_form(compile_expression(expression).postfix), statistics)
+    if tree[0][0] == 'CONST':
+        return Plan(expression, (), tree[0][1], tree, statistics)
+    return Plan(expression, tuple(tree_to_postfix(tree, [])), None, tree, statistics)
+
+
+def explain(bank, expression: str, item_type: str = 'quiz') -> str:
+    """
+    :param bank: A bank with tag statistics, such as QuizStore, BankFile or TagIndex.
+    :return: The plan of the expression on the bank, see Plan.explain.
+    """
+    return plan(expression, bank.statistics(item_type)).explain()
+
+
+# Show the plan of an expression on a compiled bank, or on a synthetic bank with a skewed tag
+# distribution: python query_planner.py "(tag0 OR tag3) AND NOT tag1" [bank.qzb]
+if __name__ == '__main__':
+    import sys
+
+    expression = sys.argv[1] if len(sys.argv) > 1 else "tag0 AND tag1 AND tag40 AND NOT (tag2 OR missing)"
+    if len(sys.argv) > 2:
+        from qzb import BankFile
+        bank = BankFile(sys.argv[2])
+    else:
+        from benchmark import generate_items
+        from file_parser import parse_quiz_and_flashcards
+        from tag_index import TagIndex
+        bank = TagIndex.from_items(parse_quiz_and_flashcards(generate_items(100_000), True)[0])
+    print(explain(bank, expression))
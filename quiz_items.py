@@ -0,0 +1,163 @@
+from collections.abc import Mapping
+from typing import Dict, Iterable, Tuple
+import sys
+from expression_parser import Tags, TagSet
+from tag_index import normalize_tag
+
+# Option texts up to this length are interned, so common ones like "True" or "False" are shared
+INTERN_MAX_LENGTH = 32
+
+# Tags and short option tuples are shared between all the items that have the same ones
+_tags: Dict[Tags, Tags] = {}
+_tag_sets: Dict[TagSet, TagSet] = {}
+_option_tuples: Dict[Tuple[Tuple[str, str], ...], Tuple[Tuple[str, str], ...]] = {}
+
+
+def make_tags(tags: Iterable[str]) -> Tags:
+    """
+    Strips and interns tags, dropping empty ones and those repeated in another case. The order and
+    case of the others are kept. Equal tags are the same object, and so are equal normalized sets.
+    """
+    written = {}
+    for tag in tags:
+        normalized = normalize_tag(tag)
+        if normalized and normalized not in written:
+            written[normalized] = sys.intern(tag.strip())
+    tags = Tags(written.values())
+    shared = _tags.get(tags)
+    if shared is None:
+        normalized = TagSet(map(sys.intern, written))
+        tags.normalized = _tag_sets.setdefault(normalized, normalized)
+        shared = _tags[tags] = tags
+    return shared
+
+
+def make_options(options: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    """
+    Turns an options dictionary, or (label, text) pairs, into a tuple of (label, text) pairs,
+    interning labels and short texts. When all texts are short, equal option tuples are the same object.
+    """
+    if isinstance(options, Mapping):
+        options = options.items()
+    options = tuple((sys.intern(label), sys.intern(text) if len(text) <= INTERN_MAX_LENGTH else text)
+                    for label, text in options)
+    short = all(len(text) <= INTERN_MAX_LENGTH for _, text in options)
+    return _option_tuples.setdefault(options, options) if short else options
+
+
+class Item(Mapping):
+    """
+    Base class of the compact item records. Records can be read like the dictionaries the parser
+    used to produce: item['question'], item.get('tags', []), 'explanation' in item...
+    Optional fields that are not set (no explanation, no tags) are absent from the mapping.
+    """
+
+    __slots__ = ()
+    type: str
+    fields: Tuple[str, ...]
+
+    def __getitem__(self, name: str):
+        if name == 'type':
+            return self.type
+        if name not in self.fields:
+            raise KeyError(name)
+        value = getattr(self, name)
+        if name == 'options':
+            return dict(value)
+        if (name == 'explanation' and value is None) or (name == 'tags' and not value):
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name: str, value):
+        if name not in self.fields:
+            raise KeyError(name)
+        if name == 'options':
+            value = make_options(value)
+        elif name == 'tags':
+            value = make_tags(value)
+        setattr(self, name, value)
+
+    def __iter__(self):
+        yield 'type'
+        for name in self.fields:
+            if name in self:
+                yield name
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __contains__(self, name) -> bool:
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def __reduce__(self):
+        # Unpickled records go through __init__ again, so their tags and options are shared again
+        return type(self), tuple(getattr(self, name) for name in self.fields)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.fields)})"
+
+
+class QuizItem(Item):
+    __slots__ = ('question', 'options', 'answer', 'explanation', 'tags')
+    type = 'quiz'
+    fields = __slots__
+
+    def __init__(self, question: str, options: Dict[str, str], answer: str, explanation: str = None,
+                 tags: Iterable[str] = ()):
+        self.question = question
+        self.options = make_options(options)
+        self.answer = sys.intern(answer)
+        self.explanation = explanation
+        self.tags = make_tags(tags)
+
+
+class Flashcard(Item):
+    __slots__ = ('fact', 'answer', 'explanation', 'tags')
+    type = 'flashcard'
+    fields = __slots__
+
+    def __init__(self, fact: str, answer: str, explanation: str = None, tags: Iterable[str] = ()):
+        self.fact = fact
+        self.answer = answer
+        self.explanation = explanation
+        self.tags = make_tags(tags)
+
+
+def make_item(item: Dict) -> Item:
+    """
+    Builds the record of an item given as a dictionary.
+    """
+    if item['type'] == 'quiz':
+        return QuizItem(item['question'], item['options'], item['answer'], item.get('explanation'),
+                        item.get('tags', ()))
+    return Flashcard(item['fact'], item['answer'], item.get('explanation'), item.get('tags', ()))
+
+
+# Measure the resident size of items as dictionaries and as records
+if __name__ == '__main__':
+    import tracemalloc
+
+    def fresh(text):
+        return ''.join(list(text))  # A new string, as the parser would create
+
+    def build(as_record):
+        items = []
+        for i in range(100_000):
+            item = {'type': 'quiz', 'question': f"Is {i} even?",
+                    'options': {fresh('A'): fresh("True"), fresh('B'): fresh("False")},
+                    'answer': fresh('A' if i % 2 == 0 else 'B'),
+                    'tags': [fresh("Math"), fresh("Parity"), f"Level {i % 10}"]}
+            items.append(make_item(item) if as_record else item)
+        return items
+
+    for as_record in (False, True):
+        tracemalloc.start()
+        items = build(as_record)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{'Records' if as_record else 'Dictionaries'}: {size / len(items):.0f} bytes per item")
+        del items
@@ -0,0 +1,204 @@
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+
+class Connection:
+    """
+    Persistent HTTP/1.1 connection to the quiz server, sending one JSON request at a time.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str):
+        self.reader = reader
+        self.writer = writer
+        self.host = host
+
+    @classmethod
+    async def open(cls, host: str, port: int) -> 'Connection':
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer, host)
+
+    async def request(self, method: str, path: str, payload: Dict = None) -> Tuple[int, Dict]:
+        """
+        :return: The HTTP status and the JSON payload of the response.
+        :raises ConnectionError: If the server closed the connection.
+        """
+        body = b"" if payload is None else json.dumps(payload).encode()
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await self.writer.drain()
+        try:
+            head = await self.reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("The server closed the connection.") from None
+        status_line, *header_lines = head.decode('latin-1').split("\r\n")
+        length = 0
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        data = await self.reader.readexactly(length)
+        return int(status_line.split(" ")[1]), json.loads(data) if data else {}
+
+    def close(self):
+        self.writer.close()
+
+
+def percentile(values: List[float], share: float) -> float:
+    """
+    :param values: Sorted values.
+    :return: The value below which share of the values are (nearest rank).
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(share * len(values) + 0.5) - 1))]
+
+
+async def take_quizzes(host: str, port: int, deadline: float, quiz: Dict, rng: random.Random,
+                       latencies: Dict[str, List[float]], errors: Counter, hint_rate: float = 0.3) -> int:
+    """
+    Plays quizzes one after the other until the deadline, like a taker would: each question is
+    fetched, sometimes with a hint, answered at random, then the quiz moves on, and is finished.
+    :param quiz: The fields of the requests starting the quizzes.
+    :param latencies: Gets the seconds taken by each request, by endpoint.
+    :param errors: Gets the number of failed requests, by endpoint and status.
+    :return: The number of quizzes finished.
+    """
+    connection = await Connection.open(host, port)
+
+    async def call(endpoint, method, path, payload=None, expected=200):
+        start = time.perf_counter()
+        status, response = await connection.request(method, path, payload)
+        latencies[endpoint].append(time.perf_counter() - start)
+        if status != expected:
+            errors[f"{endpoint} {status}"] += 1
+            return None
+        return response
+
+    finished = 0
+    try:
+        while time.perf_counter() < deadline:
+            state = await call('start', 'POST', '/sessions', {**quiz, 'seed': rng.randrange(2 ** 32)}, 201)
+            if state is None:
+                continue
+            path = f"/sessions/{state['session']}"
+            while True:
+                state = await call('question', 'GET', path + "/question")
+                if state is None:
+                    break
+                if state['can_use_hint'] and rng.random() < hint_rate:
+                    state = await call('hint', 'POST', path + "/hint") or state
+                label = rng.choice(state['options'])[0]
+                await call('answer', 'POST', path + "/answer", {'answer': label})
+                state = await call('next', 'POST', path + "/next")
+                if state is None or state['finished']:
+                    break
+            if await call('finish', 'POST', path + "/finish") is not None:
+                finished += 1
+    except ConnectionError:
+        errors["connection lost"] += 1
+    finally:
+        connection.close()
+    return finished
+
+
+async def run(host: str = "127.0.0.1", port: int = 8080, takers: int = 100, duration: float = 10,
+              quiz: Dict = None, seed: int = 0) -> Dict:
+    """
+    Runs concurrent takers against a quiz server for a while.
+    :param quiz: The fields of the requests starting the quizzes, see QuizServer.
+    :return: The number of requests, quizzes and errors, the requests per second, and the latency
+      percentiles in milliseconds, overall and by endpoint.
+    """
+    quiz = {'questions': 10, 'hints': 2} if quiz is None else quiz
+    latencies = {endpoint: [] for endpoint in ('start', 'question', 'hint', 'answer', 'next', 'finish')}
+    errors = Counter()
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    deadline = start + duration
+    finished = await asyncio.gather(*(take_quizzes(host, port, deadline, quiz, random.Random(rng.random()),
+                                                   latencies, errors)
+                                      for _ in range(takers)))
+    elapsed = time.perf_counter() - start
+
+    def describe(values):
+        values = sorted(values)
+        return {'requests': len(values), **{name: percentile(values, share) * 1000
+                                            for name, share in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))},
+                'max': values[-1] * 1000 if values else 0.0}
+
+    requests = sum(len(values) for values in latencies.values())
+    return {'takers': takers, 'seconds': elapsed, 'requests': requests, 'requests_per_second': requests / elapsed,
+            'quizzes': sum(finished), 'errors': dict(errors),
+            'latency_ms': describe([value for values in latencies.values() for value in values]),
+            'endpoints_ms': {endpoint: describe(values) for endpoint, values in latencies.items() if values}}
+
+
+def report(results: Dict) -> str:
+    lines = [f"{results['takers']} takers, {results['seconds']:.1f} s: {results['requests']} requests, "
+             f"{results['requests_per_second']:.0f} requests/s, {results['quizzes']} quizzes finished",
+             f"{'Endpoint':<12} {'Requests':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+    for endpoint, latency in [*results['endpoints_ms'].items(), ('all', results['latency_ms'])]:
+        lines.append(f"{endpoint:<12} {latency['requests']:>9} {latency['p50']:>9.2f} {latency['p90']:>9.2f} "
+                     f"{latency['p99']:>9.2f} {latency['max']:>9.2f}")
+    if results['errors']:
+        lines.append("Errors: " + ", ".join(f"{name}: {number}" for name, number in sorted(results['errors'].items())))
+    return "\n".join(lines)
+
+
+async def wait_for_server(host: str, port: int, timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            connection = await Connection.open(host, port)
+        except OSError:
+            await asyncio.sleep(0.2)
+            continue
+        connection.close()
+        return True
+    return False
+
+
+# Load a quiz server with concurrent takers:
+#   python quiz_loadgen.py [--port 8080] [--takers 100] [--duration 10] [--tags "tag0 OR tag1"] [--json]
+# With --synthetic N, a server is started first on a synthetic bank of N items, and stopped afterwards.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measures the throughput and latency of a quiz server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--takers", type=int, default=100, help="Concurrent takers, one connection each.")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load.")
+    parser.add_argument("--tags", default="", help="Tag expression of the quizzes.")
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--hints", type=int, default=2)
+    parser.add_argument("--mode", default='uniform')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--synthetic", type=int, help="Start a server on a synthetic bank of this many items.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    arguments = parser.parse_args()
+
+    server: Optional[subprocess.Popen] = None
+    if arguments.synthetic:
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                "quiz_server.py"),
+                                   "--synthetic", str(arguments.synthetic), "--host", arguments.host,
+                                   "--port", str(arguments.port)])
+        if not asyncio.run(wait_for_server(arguments.host, arguments.port, 600)):
+            server.terminate()
+            sys.exit("The server did not start.")
+    try:
+        results = asyncio.run(run(arguments.host, arguments.port, arguments.takers, arguments.duration,
+                                  {'tags': arguments.tags, 'questions': arguments.questions,
+                                   'hints': arguments.hints, 'mode': arguments.mode}, arguments.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print(json.dumps(results, indent=2) if arguments.json else report(results))
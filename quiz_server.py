@@ -0,0 +1,384 @@
+from typing import Dict, Optional, Tuple
+import asyncio
+import json
+import os
+import tempfile
+import time
+import traceback
+import uuid
+import instrumentation
+from qzb import BankFile
+from quiz_session import QuizSession
+from quiz_store import QuizStore
+from library import import_files, index_library
+from sampling import draw_questions, make_rng, record_answer
+from search_index import SearchIndex
+
+SESSION_TTL = 3600  # Seconds after which an idle session is dropped
+MAX_SESSIONS = 10_000  # Sessions kept in memory at most, new ones are refused beyond
+MAX_QUESTIONS = 100  # Questions of a session at most
+MAX_BODY = 1 << 16  # Bytes of a request body at most
+MAX_HEADER = 1 << 14  # Bytes of a request line and headers at most
+SAMPLING_MODES = ('uniform', 'errors', 'recency', 'stratified')
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 431: "Request Header Fields Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class RequestError(Exception):
+    """
+    A request that cannot be served, answered with its HTTP status and message.
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ServerSession:
+    """
+    A quiz being taken: its QuizSession, and when its current question was shown and it was last used.
+    """
+
+    __slots__ = ('quiz', 'question_started', 'last_seen')
+
+    def __init__(self, quiz: QuizSession, now: float):
+        self.quiz = quiz
+        self.question_started = now
+        self.last_seen = now
+
+
+def load_bank(folder: str, bank_path: str = None):
+    """
+    Imports the quiz files of a folder once for the server, with import_files. The bank is served
+    from its compiled file, which is read-only and the fastest to draw questions from.
+    :param bank_path: Where the compiled bank of the folder is, or is written if it is not up to
+      date. By default, it is written to a temporary file.
+    :return: The bank, a BankFile or an in-memory QuizStore if the compiled bank could not be
+      written, the import errors and the number of files opened successfully.
+    """
+    temporary = bank_path is None
+    if temporary:
+        file, bank_path = tempfile.mkstemp(suffix=".qzb")
+        os.close(file)
+        os.remove(bank_path)  # Only its name is needed
+    items, errors, nb_success = import_files(folder, bank_path=bank_path)
+    if not isinstance(items, BankFile) and os.path.exists(bank_path):  # Compiled from the parsed files
+        items = BankFile(bank_path)
+    if temporary and os.path.exists(bank_path):
+        try:
+            os.remove(bank_path)  # The mapping stays readable on POSIX systems
+        except OSError:
+            pass
+    if isinstance(items, BankFile):
+        return items, errors, nb_success
+    bank = QuizStore()
+    bank.update(items)
+    return bank, errors, nb_success
+
+
+class QuizServer:
+    """
+    Serves quizzes on one shared bank to many takers at once, as a JSON API over HTTP. It plays
+    the same rules as QuizWindow through QuizSession, and keeps the sessions in memory:
+
+    - POST /sessions {"tags", "questions", "hints", "time_limit", "mode", "seed", "search", "taker"}
+      starts a quiz, every field being optional, and returns its id and first question;
+    - GET /sessions/<id>/question returns the current question;
+    - POST /sessions/<id>/hint narrows the options down to the right one and a wrong one;
+    - POST /sessions/<id>/answer {"answer": label} returns whether it was right, the right answer
+      and the explanation;
+    - POST /sessions/<id>/next moves to the next question once answered, and returns it;
+    - POST /sessions/<id>/finish returns the grade and ends the session;
+    - GET /status returns the number of items and sessions.
+
+    Requests are handled one at a time on the event loop, so sessions need no lock. Most of them
+    only update one session, in microseconds. Starting a quiz evaluates its tag expression on the
+    bank, which takes about 2 ms on 10,000 items.
+    """
+
+    def __init__(self, bank, search_index: SearchIndex = None, clock=time.monotonic):
+        """
+        :param bank: A bank with iter_query, tags and item access, such as BankFile or QuizStore.
+        :param search_index: If given, sessions can be started on the questions matching a text search.
+        :param clock: Gives the time in seconds, for the timer and session expiry.
+        """
+        self.bank = bank
+        self.search_index = search_index
+        self.clock = clock
+        self.sessions: Dict[str, ServerSession] = {}
+        self.histories: Dict[str, Dict] = {}  # Taker name -> answer history, for the weighted modes
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    # Sessions
+
+    def expire_sessions(self):
+        deadline = self.clock() - SESSION_TTL
+        for session_id in [session_id for session_id, session in self.sessions.items()
+                           if session.last_seen < deadline]:
+            del self.sessions[session_id]
+
+    def get_session(self, session_id: str) -> ServerSession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise RequestError(404, "Unknown or expired session.")
+        now = self.clock()
+        session.last_seen = now
+        quiz = session.quiz
+        # The timer runs out between requests, as QuizSession.tick would have made it
+        if quiz.time_limit is not None and not quiz.answered:
+            quiz.time_left = max(0, quiz.time_limit - int(now - session.question_started))
+            if quiz.time_left == 0:
+                quiz.answer(None)
+        return session
+
+    def question_state(self, session_id: str, session: ServerSession) -> Dict:
+        quiz = session.quiz
+        state = {'session': session_id, 'index': quiz.index, 'count': len(quiz.questions),
+                 'question': quiz.question['question'], 'options': quiz.options, 'answered': quiz.answered,
+                 'hints_left': quiz.hints_left, 'can_use_hint': quiz.can_use_hint(), 'time_left': quiz.time_left}
+        if quiz.answered:
+            state.update(self.answer_state(quiz))
+        return state
+
+    @staticmethod
+    def answer_state(quiz: QuizSession) -> Dict:
+        return {'correct': quiz.last_answer_correct, 'answer': quiz.question['answer'],
+                'explanation': quiz.question.get('explanation', '')}
+
+    def start(self, request: Dict) -> Tuple[int, Dict]:
+        self.expire_sessions()
+        if len(self.sessions) >= MAX_SESSIONS:
+            raise RequestError(503, "Too many sessions, try again later.")
+        try:
+            tags = str(request.get('tags', ''))
+            count = whole_number(request.get('questions', 10))
+            hints = whole_number(request.get('hints', 0))
+            time_limit = None if request.get('time_limit') is None else whole_number(request['time_limit'])
+            seed = None if request.get('seed') is None else whole_number(request['seed'])
+        except (TypeError, ValueError, OverflowError):
+            raise RequestError(400, "questions, hints, time_limit and seed must be whole numbers.") from None
+        mode = request.get('mode', 'uniform')
+        if mode not in SAMPLING_MODES:
+            raise RequestError(400, f"mode must be one of {', '.join(SAMPLING_MODES)}.")
+        if not 1 <= count <= MAX_QUESTIONS or hints < 0 or (time_limit is not None and time_limit < 1):
+            raise RequestError(400, f"A quiz has 1 to {MAX_QUESTIONS} questions, and hints and time_limit "
+                                    f"cannot be negative.")
+        search = str(request.get('search', '')).strip()
+        if search and self.search_index is None:
+            raise RequestError(400, "Text search is not enabled on this server.")
+        taker = request.get('taker')
+        history = None if taker is None else self.histories.setdefault(str(taker), {})
+
+        rng = make_rng(seed)
+        within = self.search_index.matches(search, 'quiz') if search else None
+        try:
+            keys = draw_questions(self.bank, tags, count, mode, rng, history, within)
+        except ValueError as e:
+            raise RequestError(400, str(e)) from None
+        if not keys:
+            raise RequestError(404, "No question matches the selected tags and search.")
+        quiz = QuizSession([self.bank[key] for key in keys], keys, hints, time_limit, rng,
+                           None if history is None else lambda key, correct: record_answer(history, key, correct))
+        session_id = uuid.uuid4().hex
+        session = self.sessions[session_id] = ServerSession(quiz, self.clock())
+        return 201, self.question_state(session_id, session)
+
+    def hint(self, session_id: str, session: ServerSession) -> Tuple[int, Dict]:
+        used = session.quiz.use_hint()
+        return 200, {'used': used, 'options': session.quiz.options, 'hints_left': session.quiz.hints_left}
+
+    def answer(self, session_id: str, session: ServerSession, request: Dict) -> Tuple[int, Dict]:
+        if session.quiz.answered:
+            raise RequestError(409, "The question is already answered, or its time ran out.")
+        label = request.get('answer')
+        session.quiz.answer(None if label is None else str(label))
+        return 200, self.answer_state(session.quiz)
+
+    def next(self, session_id: str, session: ServerSession) -> Tuple[int, Dict]:
+        quiz = session.quiz
+        if not quiz.answered:
+            raise RequestError(409, "Answer the question first.")
+        if not quiz.next_question():
+            return 200, {'session': session_id, 'finished': True}
+        session.question_started = self.clock()
+        return 200, {'finished': False, **self.question_state(session_id, session)}
+
+    def finish(self, session_id: str, session: ServerSession) -> Tuple[int, Dict]:
+        del self.sessions[session_id]
+        quiz = session.quiz
+        return 200, {'questions': len(quiz.questions), 'answered': quiz.index + quiz.answered,
+                     'good_answers': quiz.good_answers, 'hints_used': quiz.hints_used, 'grade': quiz.grade}
+
+    # HTTP
+
+    def handle(self, method: str, target: str, body: bytes = b"") -> Tuple[int, Dict]:
+        """
+        Serves a request.
+        :return: The HTTP status and the JSON payload of the response.
+        """
+        instrumentation.count("server_requests")
+        parts = [part for part in target.partition("?")[0].split("/") if part]
+        try:
+            try:
+                request = json.loads(body) if body else {}
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                raise RequestError(400, "The body must be JSON.") from None
+            if not isinstance(request, dict):
+                raise RequestError(400, "The body must be a JSON object.")
+
+            if parts == ['status']:
+                expect(method, 'GET')
+                return 200, {'items': len(self.bank), 'sessions': len(self.sessions)}
+            if parts == ['sessions']:
+                expect(method, 'POST')
+                with instrumentation.span("quiz_server.start"):
+                    return self.start(request)
+            if len(parts) != 3 or parts[0] != 'sessions':
+                raise RequestError(404, "Unknown endpoint.")
+            session_id, action = parts[1:]
+            routes = {'question': 'GET', 'hint': 'POST', 'answer': 'POST', 'next': 'POST', 'finish': 'POST'}
+            if action not in routes:
+                raise RequestError(404, "Unknown endpoint.")
+            expect(method, routes[action])
+            session = self.get_session(session_id)
+            with instrumentation.span(f"quiz_server.{action}"):
+                if action == 'question':
+                    return 200, self.question_state(session_id, session)
+                if action == 'answer':
+                    return self.answer(session_id, session, request)
+                return getattr(self, action)(session_id, session)
+        except RequestError as e:
+            return e.status, {'error': str(e)}
+        except Exception:  # A bug should not drop the connection without a response
+            traceback.print_exc()
+            return 500, {'error': "Internal server error."}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # HTTP/1.1 with persistent connections, one request at a time
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await respond(writer, 431, {'error': "Request headers too large."}, False)
+                    break
+                request_line, *header_lines = head.decode('latin-1').split("\r\n")
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.split(" ")
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    await respond(writer, 400, {'error': "Malformed request."}, False)
+                    break
+                if length < 0:
+                    await respond(writer, 400, {'error': "Malformed request."}, False)
+                    break
+                if length > MAX_BODY:
+                    await respond(writer, 413, {'error': "Request body too large."}, False)
+                    break
+                try:
+                    body = await reader.readexactly(length) if length else b""
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                status, payload = self.handle(method, target, body)
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == "HTTP/1.0" else connection != 'close'
+                await respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def expire_periodically(self):
+        while True:
+            await asyncio.sleep(60)
+            self.expire_sessions()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080):
+        """
+        Serves until cancelled.
+        """
+        self.server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER)
+        expiry = asyncio.ensure_future(self.expire_periodically())
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            expiry.cancel()
+
+
+def whole_number(value) -> int:
+    """
+    Converts a request field to an integer. Booleans and JSON numbers that are not whole, such as
+    2.5 or 1e400, which is infinite, are rejected rather than truncated.
+    :raises ValueError: If it is not a whole number.
+    """
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"{value!r} is not a whole number.")
+    return int(value)
+
+
+def expect(method: str, expected: str):
+    if method != expected:
+        raise RequestError(405, f"Use {expected} on this endpoint.")
+
+
+async def respond(writer: asyncio.StreamWriter, status: int, payload: Dict, keep_alive: bool):
+    data = json.dumps(payload).encode()
+    connection = "" if keep_alive else "Connection: close\r\n"
+    writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\n{connection}\r\n".encode() + data)
+    await writer.drain()
+
+
+# Serve the quiz files of a folder, or a synthetic bank, to concurrent takers:
+#   python quiz_server.py [folder] [--bank bank.qzb] [--synthetic 100000] [--search] [--port 8080] [--trace]
+# quiz_loadgen.py plays quizzes against it and measures its throughput.
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serves quizzes from a shared bank over HTTP.")
+    parser.add_argument("folder", nargs="?", help="Folder of quiz files, unless --synthetic is given.")
+    parser.add_argument("--bank", help="Compiled bank of the folder, used if it is up to date and written otherwise.")
+    parser.add_argument("--synthetic", type=int, help="Serve a synthetic bank of this many items instead.")
+    parser.add_argument("--search", action="store_true", help="Index the text of the items for text searches.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--trace", action="store_true",
+                        help="Record the time spent per endpoint, see instrumentation.py.")
+    arguments = parser.parse_args()
+    if arguments.folder is None and not arguments.synthetic:
+        parser.error("a folder of quiz files or --synthetic is required")
+    if arguments.trace:
+        instrumentation.enable()
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as synthetic_folder:
+        folder = arguments.folder
+        if arguments.synthetic:
+            from benchmark import generate_corpus
+            generate_corpus(synthetic_folder, arguments.synthetic)
+            folder = synthetic_folder
+        bank, errors, nb_success = load_bank(folder, arguments.bank)
+    for error in errors:
+        print(error)
+    search_index = None
+    if arguments.search:
+        search_index = SearchIndex()
+        index_library(search_index, bank.documents())
+    print(f"Loaded {len(bank)} items from {nb_success} files in {time.perf_counter() - start:.1f} s, "
+          f"serving on http://{arguments.host}:{arguments.port}")
+    try:
+        asyncio.run(QuizServer(bank, search_index).serve(arguments.host, arguments.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bank.close()
@@ -0,0 +1,192 @@
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import random
+import time
+from sampling import draw_questions, make_rng, record_answer
+
+
+class QuizSession:
+    """
+    The rules of a quiz, without any display: question progression, hints, the timer and grading.
+    QuizWindow shows a session and forwards the user's actions to it, and the simulator plays it
+    directly.
+
+    A session alternates between asking a question and showing its answer: answer() ends a
+    question, then next_question() moves to the next one, until finished is set.
+    """
+
+    def __init__(self, questions: Sequence, keys: Sequence[str] = None, hints: int = 0, time_limit: int = None,
+                 rng: random.Random = random, on_answer: Callable[[str, bool], None] = None):
+        """
+        :param questions: The quiz items, with question, options and answer.
+        :param keys: Their keys, passed to on_answer.
+        :param hints: The number of hints of the whole quiz.
+        :param time_limit: The seconds given for each question, or None for no timer.
+        :param rng: Picks the wrong option kept by hints.
+        :param on_answer: Called with the key of each question answered and whether it was right.
+        """
+        if not questions:
+            raise ValueError("A quiz needs at least one question.")
+        self.questions = questions
+        self.keys = keys
+        self.max_hints = hints
+        self.time_limit = time_limit
+        self.rng = rng
+        self.on_answer = on_answer
+        self.index = 0
+        self.hints_used = 0
+        self.good_answers = 0
+        self.finished = False
+        self.start_question()
+
+    def start_question(self):
+        self.answered = False
+        self.last_answer_correct = None
+        self.hint_used = False  # One hint per question at most
+        self.options: List[Tuple[str, str]] = list(self.question['options'].items())
+        self.time_left = self.time_limit
+
+    @property
+    def question(self):
+        return self.questions[self.index]
+
+    @property
+    def key(self) -> Optional[str]:
+        return None if self.keys is None else self.keys[self.index]
+
+    @property
+    def hints_left(self) -> int:
+        return self.max_hints - self.hints_used
+
+    def can_use_hint(self) -> bool:
+        return not self.answered and not self.hint_used and self.hints_left > 0
+
+    def use_hint(self) -> bool:
+        """
+        Narrows the options down to the right one and a random wrong one.
+        :return: Whether a hint could be used.
+        """
+        if not self.can_use_hint():
+            return False
+        answer = self.question['answer']
+        right_answer = [(label, text) for label, text in self.options if label == answer]
+        wrong_answers = [(label, text) for label, text in self.options if label != answer]
+        self.rng.shuffle(wrong_answers)
+        self.options = right_answer + wrong_answers[:1]
+        self.hints_used += 1
+        self.hint_used = True
+        return True
+
+    def answer(self, label: Optional[str]) -> bool:
+        """
+        Answers the current question.
+        :param label: The label of the chosen option, or None when the time ran out.
+        :return: Whether the answer is right. Answering twice has no effect and returns the first result.
+        """
+        if self.answered:
+            return self.last_answer_correct
+        self.answered = True
+        self.last_answer_correct = label is not None and label == self.question['answer']
+        if self.last_answer_correct:
+            self.good_answers += 1
+        if self.on_answer is not None and self.keys is not None:
+            self.on_answer(self.key, self.last_answer_correct)
+        return self.last_answer_correct
+
+    def tick(self) -> bool:
+        """
+        Counts one second down on the timer. When the time runs out, the question is answered wrong.
+        :return: Whether the time just ran out.
+        """
+        if self.time_left is None or self.answered:
+            return False
+        self.time_left = max(0, self.time_left - 1)
+        if self.time_left == 0:
+            self.answer(None)
+            return True
+        return False
+
+    def next_question(self) -> bool:
+        """
+        Moves to the next question once the current one is answered.
+        :return: Whether there is a next question. If not, the session is finished.
+        """
+        if not self.answered:
+            return False
+        if self.index + 1 < len(self.questions):
+            self.index += 1
+            self.start_question()
+            return True
+        self.finished = True
+        return False
+
+    @property
+    def grade(self) -> float:
+        """
+        :return: The grade out of 20, rounded down to the quarter point.
+        """
+        return int(80 * self.good_answers / len(self.questions)) / 4
+
+
+def simulate(bank, sessions: int = 1000, questions: int = 10, hints: int = 2, expression: str = '',
+             mode: str = 'uniform', skill: float = 0.7, hint_rate: float = 0.5, seed: int = 0) -> Dict[str, float]:
+    """
+    Plays synthetic quizzes against a bank, from the question selection to the grade, to measure
+    the throughput of the quiz engine without a display.
+    :param bank: A bank with iter_query, tags and item access, such as QuizStore or BankFile.
+    :param skill: The probability that the simulated player knows an answer. Otherwise it guesses,
+      after using a hint with probability hint_rate if it has some left.
+    :return: The number of sessions played, their answers, hints and mean grade, the sessions per
+      second, and the seconds spent selecting questions and playing the sessions.
+    """
+    rng = make_rng(seed)
+    history = {}
+    grades = 0.0
+    answers = 0
+    hints_used = 0
+    selection_time = 0.0
+    start = time.perf_counter()
+    for _ in range(sessions):
+        selection_start = time.perf_counter()
+        keys = draw_questions(bank, expression, questions, mode, rng, history)
+        if not keys:
+            raise ValueError("No question matches the expression.")
+        items = [bank[key] for key in keys]
+        selection_time += time.perf_counter() - selection_start
+        session = QuizSession(items, keys, hints, rng=rng,
+                              on_answer=lambda key, correct: record_answer(history, key, correct))
+        while not session.finished:
+            if rng.random() < skill:
+                session.answer(session.question['answer'])
+            else:
+                if session.can_use_hint() and rng.random() < hint_rate:
+                    session.use_hint()
+                session.answer(rng.choice(session.options)[0])
+            answers += 1
+            session.next_question()
+        grades += session.grade
+        hints_used += session.hints_used
+    elapsed = time.perf_counter() - start
+    return {'sessions': sessions, 'answers': answers, 'hints_used': hints_used, 'mean_grade': grades / sessions,
+            'seconds': elapsed, 'sessions_per_second': sessions / elapsed if elapsed else float('inf'),
+            'selection_seconds': selection_time, 'play_seconds': elapsed - selection_time}
+
+
+# Simulate quizzes on a synthetic bank, or on a compiled bank: python quiz_session.py [bank.qzb] [sessions]
+if __name__ == '__main__':
+    import json
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1].endswith(".qzb"):
+        from qzb import BankFile
+        bank = BankFile(sys.argv[1])
+    else:
+        from quiz_store import QuizStore
+        bank = QuizStore()
+        bank.update({f"q{i}": {'type': 'quiz', 'question': f"Question {i}?",
+                               'options': {'A': "Yes", 'B': "No", 'C': "Maybe", 'D': "Sometimes"},
+                               'answer': "ABCD"[i % 4], 'tags': [f"topic{i % 20}", f"level{i % 5}"]}
+                     for i in range(10_000)})
+    sessions = int(sys.argv[-1]) if len(sys.argv) > 1 and sys.argv[-1].isdigit() else 1000
+    for mode in ('uniform', 'errors', 'recency', 'stratified'):
+        print(mode, json.dumps(simulate(bank, sessions, expression="level1 AND topic1", mode=mode)))
+    bank.close()
@@ -0,0 +1,390 @@
+from collections.abc import Mapping, MutableMapping
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import sqlite3
+from instrumentation import count
+from query_planner import TagStatistics, plan
+from tag_index import normalize_tag
+from quiz_items import Item, make_item, make_tags
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    text TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    explanation TEXT,
+    source TEXT  -- Quiz file the item was imported from, NULL once written in the app
+);
+CREATE TABLE IF NOT EXISTS options (
+    item_key TEXT NOT NULL REFERENCES items(key) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (item_key, position)
+);
+CREATE TABLE IF NOT EXISTS tags (
+    item_key TEXT NOT NULL REFERENCES items(key) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    PRIMARY KEY (item_key, position)
+);
+CREATE INDEX IF NOT EXISTS items_by_type ON items(type);
+CREATE INDEX IF NOT EXISTS tags_by_tag ON tags(normalized, item_key);
+
+-- Number of items of each type carrying each tag, kept up to date as items are written, for the
+-- query planner
+CREATE TABLE IF NOT EXISTS tag_counts (
+    type TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (type, normalized)
+);
+
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Source of the items stored before the sources were recorded, which may or may not have been edited
+UNKNOWN_SOURCE = ''
+
+# Name of the text column of each item type
+TEXT_FIELDS = {'quiz': 'question', 'flashcard': 'fact'}
+
+
+class QuizStore(MutableMapping):
+    """
+    Persistent bank of quizzes and flashcards backed by SQLite.
+
+    It behaves like the dictionary of items returned by the parser, keyed by item key, so the GUI
+    can use it in place of a plain dict. Items are read from and written to the database on every
+    access, in insertion order. Bulk writes through update() or |= happen in a single transaction.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        counted = self.connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'tag_counts'").fetchone()
+        self.connection.executescript(SCHEMA)
+        if not any(column == 'source' for _, column, *_ in self.connection.execute("PRAGMA table_info(items)")):
+            with self.connection:
+                self.connection.execute("ALTER TABLE items ADD COLUMN source TEXT")
+                self.connection.execute("UPDATE items SET source = ?", (UNKNOWN_SOURCE,))
+        if not counted:  # Databases created before the tag counts were kept need them counted once
+            with self.connection:
+                self.connection.execute(
+                    "INSERT INTO tag_counts (type, normalized, count) "
+                    "SELECT items.type, tags.normalized, COUNT(DISTINCT tags.item_key) "
+                    "FROM tags JOIN items ON items.key = tags.item_key GROUP BY items.type, tags.normalized")
+        self.statistics_cache: Dict[str, Tuple[Tuple[int, int], TagStatistics]] = {}
+
+    def close(self):
+        self.connection.close()
+
+    # Reading
+
+    def _build_item(self, key: str, item_type: str, text: str, answer: str, explanation: str) -> Item:
+        item = {'type': item_type, TEXT_FIELDS[item_type]: text}
+        if item_type == 'quiz':
+            item['options'] = dict(self.connection.execute(
+                "SELECT label, text FROM options WHERE item_key = ? ORDER BY position", (key,)))
+        item['answer'] = answer
+        if explanation is not None:
+            item['explanation'] = explanation
+        tags = [tag for tag, in self.connection.execute(
+            "SELECT tag FROM tags WHERE item_key = ? ORDER BY position", (key,))]
+        if tags:
+            item['tags'] = tags
+        return make_item(item)
+
+    def __getitem__(self, key: str) -> Item:
+        row = self.connection.execute(
+            "SELECT key, type, text, answer, explanation FROM items WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._build_item(*row)
+
+    def __contains__(self, key) -> bool:
+        return self.connection.execute("SELECT 1 FROM items WHERE key = ?", (key,)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (key for key, in self.connection.execute("SELECT key FROM items ORDER BY rowid"))
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def items_of_type(self, item_type: str = None) -> Iterator[Tuple[str, Item]]:
+        """
+        Iterates over the (key, item) pairs of the bank, optionally only those of one type.
+        """
+        if item_type is None:
+            rows = self.connection.execute(
+                "SELECT key, type, text, answer, explanation FROM items ORDER BY rowid").fetchall()
+        else:
+            rows = self.connection.execute(
+                "SELECT key, type, text, answer, explanation FROM items WHERE type = ? ORDER BY rowid",
+                (item_type,)).fetchall()
+        for row in rows:
+            yield row[0], self._build_item(*row)
+
+    def texts(self) -> List[Tuple[str, str, str]]:
+        """
+        :return: The (key, type, question or fact) of every item, in order, without building the items.
+        """
+        return self.connection.execute("SELECT key, type, text FROM items ORDER BY rowid").fetchall()
+
+    def documents(self) -> Iterator[Tuple[str, str, str]]:
+        """
+        :return: The (key, type, searchable text) of every item, in order, for the search index:
+          its question or fact, option texts and explanation, as search_index.search_text gives.
+        """
+        # group_concat follows the order of the subquery it reads, the options are joined in position order
+        return self.connection.execute(
+            "SELECT key, type, text || coalesce(' ' || (SELECT group_concat(text, ' ') FROM (SELECT text FROM options "
+            "WHERE options.item_key = items.key ORDER BY position)), '') || coalesce(' ' || explanation, '') "
+            "FROM items ORDER BY rowid")
+
+    # Writing
+
+    def _count_tags(self, key: str, counts: Dict[Tuple[str, str], int], sign: int):
+        """
+        Adds sign to the counts of the tags of a stored item, once per distinct tag.
+        """
+        for pair in self.connection.execute(
+                "SELECT DISTINCT items.type, tags.normalized FROM items JOIN tags ON tags.item_key = items.key "
+                "WHERE items.key = ?", (key,)):
+            counts[pair] = counts.get(pair, 0) + sign
+
+    def _save_counts(self, counts: Dict[Tuple[str, str], int]):
+        """
+        Applies the changes of tag counts of a transaction.
+        """
+        self.connection.executemany(
+            "INSERT INTO tag_counts (type, normalized, count) VALUES (?, ?, ?) "
+            "ON CONFLICT(type, normalized) DO UPDATE SET count = count + excluded.count",
+            [(item_type, tag, change) for (item_type, tag), change in counts.items() if change])
+
+    def _write(self, key: str, item: Dict, counts: Dict[Tuple[str, str], int], new: bool = False,
+               source: str = None):
+        """
+        Inserts or replaces an item. Must be called inside a transaction, followed by _save_counts.
+        :param counts: Collects the changes of tag counts.
+        :param new: Whether the item is known not to be stored yet.
+        :param source: The quiz file the item is imported from, None for an item written in the app.
+        """
+        if not new:
+            self._count_tags(key, counts, -1)
+        self.connection.execute(
+            "INSERT INTO items (key, type, text, answer, explanation, source) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET type = excluded.type, text = excluded.text, answer = excluded.answer, "
+            "explanation = excluded.explanation, source = excluded.source",  # Keeps the rowid, hence the order
+            (key, item['type'], item[TEXT_FIELDS[item['type']]], item['answer'], item.get('explanation'), source))
+        self.connection.execute("DELETE FROM options WHERE item_key = ?", (key,))
+        self.connection.execute("DELETE FROM tags WHERE item_key = ?", (key,))
+        self.connection.executemany(
+            "INSERT INTO options (item_key, position, label, text) VALUES (?, ?, ?, ?)",
+            [(key, position, label, text) for position, (label, text) in enumerate(item.get('options', {}).items())])
+        # Positions follow the tags as written, so they read back in the same order
+        tags = [(key, position, tag, normalize_tag(tag))
+                for position, tag in enumerate(make_tags(item.get('tags', ())))]
+        self.connection.executemany("INSERT INTO tags (item_key, position, tag, normalized) VALUES (?, ?, ?, ?)", tags)
+        for tag in {normalized for _, _, _, normalized in tags}:
+            pair = (item['type'], tag)
+            counts[pair] = counts.get(pair, 0) + 1
+
+    def __setitem__(self, key: str, item: Dict):
+        counts = {}
+        with self.connection:
+            self._write(key, item, counts)
+            self._save_counts(counts)
+
+    def __delitem__(self, key: str):
+        counts = {}
+        with self.connection:
+            self._count_tags(key, counts, -1)
+            if self.connection.execute("DELETE FROM items WHERE key = ?", (key,)).rowcount == 0:
+                raise KeyError(key)
+            self._save_counts(counts)
+            # The deleted item may come from a quiz file, it is imported again at the next merge, as it always was
+            self.connection.execute("DELETE FROM settings WHERE name = 'imported_state'")
+
+    def update(self, items: Dict[str, Dict] = (), **kwargs):
+        """
+        Inserts or replaces many items in a single transaction.
+        """
+        counts = {}
+        with self.connection:
+            for key, item in dict(items, **kwargs).items():
+                self._write(key, item, counts)
+            self._save_counts(counts)
+
+    def __ior__(self, items: Dict[str, Dict]) -> 'QuizStore':
+        self.update(items)
+        return self
+
+    def add_missing(self, items: Dict[str, Dict]) -> int:
+        """
+        Inserts the items whose key is not in the store yet, in a single transaction. Items already
+        in the store, possibly edited since, are left untouched.
+        :return: The number of items inserted.
+        """
+        inserted = 0
+        counts = {}
+        with self.connection:
+            for key, item in items.items():
+                if key not in self:
+                    self._write(key, item, counts, new=True)
+                    inserted += 1
+            self._save_counts(counts)
+        return inserted
+
+    def import_items(self, items: Mapping, sources: Dict[str, str], state: str = None) -> Tuple[int, int]:
+        """
+        Merges the items imported from the quiz files, in a single transaction. New items are inserted,
+        and the items of the quiz files that the import no longer produces, because their file was
+        deleted or their text changed, are deleted. Items written in the app are left untouched.
+        :param items: The imported items, keyed by item key. Only the new ones are read.
+        :param sources: The quiz file each imported item comes from, keyed by item key, in import order.
+        :param state: Identifies this import, see imported_state.
+        :return: The number of items inserted and deleted.
+        """
+        inserted = deleted = 0
+        counts = {}
+        with self.connection:
+            stored = dict(self.connection.execute("SELECT key, source FROM items"))
+            for key, source in sources.items():
+                if key not in stored:
+                    self._write(key, items[key], counts, new=True, source=source)
+                    inserted += 1
+                elif stored[key] == UNKNOWN_SOURCE:  # Adopted if unchanged, otherwise it was edited in the app
+                    self.connection.execute("UPDATE items SET source = ? WHERE key = ?",
+                                            (source if self[key] == items[key] else None, key))
+                elif stored[key] is not None and stored[key] != source:  # Moved to another quiz file
+                    self.connection.execute("UPDATE items SET source = ? WHERE key = ?", (source, key))
+            for key, source in stored.items():
+                if source is not None and key not in sources:
+                    if source == UNKNOWN_SOURCE:  # May have been written in the app, kept
+                        self.connection.execute("UPDATE items SET source = NULL WHERE key = ?", (key,))
+                    else:
+                        self._count_tags(key, counts, -1)
+                        self.connection.execute("DELETE FROM items WHERE key = ?", (key,))
+                        deleted += 1
+            self._save_counts(counts)
+            if state is not None:
+                self.connection.execute(
+                    "INSERT INTO settings (name, value) VALUES ('imported_state', ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = excluded.value", (state,))
+        return inserted, deleted
+
+    def imported_state(self) -> Optional[str]:
+        """
+        :return: The state of the last import merged by import_items, or None if none was given or the
+          items were changed since in a way the next import must repair.
+        """
+        row = self.connection.execute("SELECT value FROM settings WHERE name = 'imported_state'").fetchone()
+        return None if row is None else row[0]
+
+    # Tag queries
+
+    def tags(self, item_type: str = 'quiz', expression: str = None) -> List[str]:
+        """
+        :param expression: If given, only the tags of the items matching this tag expression.
+        :return: The normalized tags used by at least one item of the given type, sorted.
+        :raises ValueError: If the expression is malformed.
+        """
+        if expression is None or not expression.strip():
+            return [tag for tag, in self.connection.execute(
+                "SELECT DISTINCT tags.normalized FROM tags JOIN items ON items.key = tags.item_key "
+                "WHERE items.type = ? ORDER BY tags.normalized", (item_type,))]
+        query = self._query_sql(expression, item_type)
+        if query is None:
+            return []
+        sql, parameters = query
+        return [tag for tag, in self.connection.execute(
+            f"SELECT DISTINCT normalized FROM tags WHERE item_key IN ({sql}) ORDER BY normalized", parameters)]
+
+    def query(self, expression: str, item_type: str = 'quiz') -> Set[str]:
+        """
+        Evaluates a tag expression in the database, using the tag index.
+        :param expression: A logical expression, with parentheses, AND, OR, and NOT.
+        :param item_type: Either 'quiz' or 'flashcard'.
+        :return: The set of keys of the matching items.
+        :raises ValueError: If the expression is malformed.
+        """
+        return set(self.iter_query(expression, item_type))
+
+    def statistics(self, item_type: str = 'quiz') -> TagStatistics:
+        """
+        :return: The tag statistics of the items of the given type. They are read again after each
+          change of the database, by this connection or another one, such as the import worker.
+        """
+        version = (self.connection.execute("PRAGMA data_version").fetchone()[0], self.connection.total_changes)
+        cached = self.statistics_cache.get(item_type)
+        if cached is None or cached[0] != version:
+            counts = dict(self.connection.execute(
+                "SELECT normalized, count FROM tag_counts WHERE type = ? AND count > 0", (item_type,)))
+            total = self.connection.execute("SELECT COUNT(*) FROM items WHERE type = ?", (item_type,)).fetchone()[0]
+            cached = self.statistics_cache[item_type] = (version, TagStatistics.from_counts(counts, total))
+        return cached[1]
+
+    def iter_query(self, expression: str, item_type: str = 'quiz') -> Iterator[str]:
+        """
+        Same as query, but streams the keys from the database instead of collecting them.
+        :raises ValueError: If the expression is malformed.
+        """
+        query = self._query_sql(expression, item_type)
+        if query is None:
+            return iter(())
+        return (key for key, in self.connection.execute(*query))
+
+    def _query_sql(self, expression: str, item_type: str) -> Optional[Tuple[str, List[str]]]:
+        """
+        Plans a tag expression from the tag statistics, and translates it to SQL.
+        :return: The SELECT of the keys of the matching items and its parameters, or None if no item can match.
+        """
+        query_plan = plan(expression, self.statistics(item_type))
+        count("expression_evaluations")
+        if query_plan.constant is False:
+            return None
+        if query_plan.constant:
+            return "SELECT key FROM items WHERE type = ?", [item_type]
+        subquery, parameters, negated = postfix_to_sql(query_plan.postfix)
+        return (f"SELECT key FROM items WHERE type = ? AND key {'NOT IN' if negated else 'IN'} ({subquery})",
+                [item_type] + parameters)
+
+
+def postfix_to_sql(postfix: Iterable[str]) -> Tuple[str, List[str], bool]:
+    """
+    Translates a postfix tag expression into a compound SELECT returning item keys.
+    AND and OR become INTERSECT and UNION. Complements are kept symbolic, as in
+    evaluate_postfix_sets, so that a AND NOT b becomes a EXCEPT b rather than a scan of every item.
+    :return: The SELECT, its parameters, and whether it selects the items that do not match.
+    """
+    stack = []
+    for token in postfix:
+        if token in ('AND', 'OR'):
+            right = stack.pop()
+            left = stack.pop()
+            if left[2] == right[2]:
+                # NOT a AND NOT b == NOT (a OR b), NOT a OR NOT b == NOT (a AND b)
+                operator = 'INTERSECT' if (token == 'AND') != left[2] else 'UNION'
+                stack.append((f"SELECT * FROM ({left[0]}) {operator} SELECT * FROM ({right[0]})",
+                              left[1] + right[1], left[2]))
+            else:
+                positive, negative = (right, left) if left[2] else (left, right)
+                if token == 'AND':  # a AND NOT b == a - b
+                    stack.append((f"SELECT * FROM ({positive[0]}) EXCEPT SELECT * FROM ({negative[0]})",
+                                  positive[1] + negative[1], False))
+                else:  # a OR NOT b == NOT (b - a)
+                    stack.append((f"SELECT * FROM ({negative[0]}) EXCEPT SELECT * FROM ({positive[0]})",
+                                  negative[1] + positive[1], True))
+        elif token == 'NOT':
+            operand, parameters, negated = stack.pop()
+            stack.append((operand, parameters, not negated))
+        else:
+            stack.append(("SELECT item_key FROM tags WHERE normalized = ?", [token], False))
+    return stack.pop()
@@ -0,0 +1,482 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import json
+import mmap
+import os
+import struct
+import sys
+from file_parser import parse_quiz_and_flashcards_file
+from quiz_items import Item, make_item, make_tags
+from query_planner import TagStatistics, plan
+from instrumentation import count
+from quiz_store import TEXT_FIELDS
+from search_index import search_text
+from tag_index import evaluate_postfix_sets, normalize_tag
+
+# Layout of a .qzb file, all integers little-endian, sections aligned on 8 bytes:
+#   header
+#   string offsets   u32 * (string_count + 1), string i is string_data[offsets[i]:offsets[i + 1]]
+#   string data      UTF-8
+#   items            ITEM * item_count, in bank order
+#   options          (label, text) string ids * option_count
+#   item tags        (tag id, string id of the tag as written) * item tag count, in runs of one item each
+#   tags             TAG * tag_count, sorted by name
+#   postings         item indexes: every quiz, every flashcard, then the quizzes and flashcards of each tag
+#   sorted keys      item indexes sorted by key, for binary search
+#   manifest         JSON: the source files and their state when the bank was compiled
+MAGIC = b"QZB1"
+FORMAT_VERSION = 3  # 2: items record the file they come from, 3: item tags keep their case and order
+HEADER = struct.Struct("<4s5I9QI")  # magic, version, counts, section offsets, manifest length
+# type, key, text, answer, explanation, options start/count, tags start/count, index of the source file in the manifest
+ITEM = struct.Struct("<B3xIIIIIIIII")
+TAG = struct.Struct("<IIIII")  # name, then start and count of its quizzes and of its flashcards in postings
+NO_STRING = 0xFFFFFFFF  # String id of a missing explanation
+NO_SOURCE = 0xFFFFFFFF  # Source file index of an item without a known file
+ITEM_TYPES = ('quiz', 'flashcard')
+
+
+def write_bank(output_path: str, items: Mapping, files: List[Tuple[str, int, int, int]], stable_ids: bool,
+               sources: Mapping[str, str] = None):
+    """
+    Writes items into a binary bank file. The file is replaced atomically.
+    :param items: The items, keyed by item key, in bank order.
+    :param files: The (path, size, mtime_ns, error_code) of the source files of the items.
+    :param stable_ids: Whether the keys were derived from the content of the items.
+    :param sources: The path of the file each item comes from, one of files.
+    """
+    file_ids = {file[0]: file_id for file_id, file in enumerate(files)}
+    sources = {} if sources is None else sources
+    strings: Dict[str, int] = {}
+
+    def string_id(text: Optional[str]) -> int:
+        if text is None:
+            return NO_STRING
+        return strings.setdefault(text, len(strings))
+
+    keys = []
+    records = bytearray()
+    options = array('I')
+    item_tags = []
+    by_type = ([], [])
+    tag_items: Dict[str, Tuple[List[int], List[int]]] = {}
+    for index, (key, item) in enumerate(items.items()):
+        type_id = ITEM_TYPES.index(item['type'])
+        item_options = item.get('options', {})
+        tags = make_tags(item.get('tags', ()))
+        records += ITEM.pack(type_id, string_id(key), string_id(item[TEXT_FIELDS[item['type']]]),
+                             string_id(item['answer']), string_id(item.get('explanation')),
+                             len(options) // 2, len(item_options), len(item_tags), len(tags),
+                             file_ids.get(sources.get(key), NO_SOURCE))
+        for label, text in item_options.items():
+            options.extend((string_id(label), string_id(text)))
+        for tag in tags:
+            normalized = normalize_tag(tag)
+            tag_items.setdefault(normalized, ([], []))[type_id].append(index)
+            item_tags.append((normalized, string_id(tag)))
+        keys.append(key)
+        by_type[type_id].append(index)
+
+    # Tag ids follow the name order, so the tag table can be searched by name
+    tag_names = sorted(tag_items)
+    tag_ids = {tag: tag_id for tag_id, tag in enumerate(tag_names)}
+    item_tags = array('I', [value for tag, sid in item_tags for value in (tag_ids[tag], sid)])
+    postings = array('I', by_type[0] + by_type[1])
+    tag_records = bytearray()
+    for tag in tag_names:
+        quizzes, flashcards = tag_items[tag]
+        tag_records += TAG.pack(string_id(tag), len(postings), len(quizzes),
+                                len(postings) + len(quizzes), len(flashcards))
+        postings.extend(quizzes)
+        postings.extend(flashcards)
+    sorted_keys = array('I', sorted(range(len(keys)), key=keys.__getitem__))
+
+    string_offsets = array('I', [0])
+    string_data = bytearray()
+    for text in strings:  # Insertion order is the id order
+        string_data += text.encode('utf-8')
+        string_offsets.append(len(string_data))
+    manifest = json.dumps({'stable_ids': stable_ids, 'files': files}).encode('utf-8')
+
+    arrays = (string_offsets, options, item_tags, postings, sorted_keys)
+    if sys.byteorder == 'big':
+        for values in arrays:
+            values.byteswap()
+    body = bytearray(HEADER.size)
+    offsets = []
+    for section in (string_offsets, string_data, records, options, item_tags, tag_records, postings, sorted_keys,
+                    manifest):
+        body += bytes(-len(body) % 8)
+        offsets.append(len(body))
+        body += section.tobytes() if isinstance(section, array) else section
+    HEADER.pack_into(body, 0, MAGIC, FORMAT_VERSION, len(keys), len(strings), len(tag_names), len(by_type[0]),
+                     *offsets, len(manifest))
+
+    temporary_path = output_path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(body)
+    os.replace(temporary_path, output_path)
+
+
+def compile_bank(file_paths: Iterable[str], output_path: str, stable_ids: bool = True) -> List[Tuple[str, int]]:
+    """
+    Compiles quiz files into a binary bank file. Items are merged in file order, like import_files
+    does, and the files with errors are left out.
+    :return: The (path, error_code) of the files that could not be parsed.
+    """
+    items = {}
+    sources = {}
+    files = []
+    errors = []
+    for path in file_paths:
+        stat = os.stat(path)
+        file_items, error_code = parse_quiz_and_flashcards_file(path, stable_ids)
+        files.append((path, stat.st_size, stat.st_mtime_ns, error_code))
+        if error_code != 0:
+            errors.append((path, error_code))
+        else:
+            items.update(file_items)
+            sources.update(dict.fromkeys(file_items, path))
+    write_bank(output_path, items, files, stable_ids, sources)
+    return errors
+
+
+class BankFile(Mapping):
+    """
+    Read-only bank backed by a memory-mapped .qzb file. Opening it only reads the header and the
+    manifest, and items are decoded straight from the mapping when accessed, so opening a large
+    bank is immediate. The pages are shared by every process that maps the same file.
+
+    It can be read like the dictionary of items returned by the parser, and answers tag queries
+    from its prebuilt tag index.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:  # A damaged file must not keep the map open, so that it can be compiled again in its place
+            self.view = memoryview(self.map)
+            try:
+                (magic, version, self.item_count, string_count, self.tag_count, self.quiz_count,
+                 strings_offset, self.data_offset, self.items_offset, options_offset, item_tags_offset,
+                 self.tags_offset, postings_offset, sorted_keys_offset, manifest_offset,
+                 manifest_length) = HEADER.unpack_from(self.map)
+            except struct.error:
+                magic = version = None
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"{path} is not a bank file of version {FORMAT_VERSION}")
+            self.string_offsets = self._u32_array(strings_offset, strings_offset + 4 * (string_count + 1))
+            self.options = self._u32_array(options_offset, item_tags_offset)
+            self.item_tags = self._u32_array(item_tags_offset, self.tags_offset)
+            self.postings = self._u32_array(postings_offset, sorted_keys_offset)
+            self.sorted_keys = self._u32_array(sorted_keys_offset, sorted_keys_offset + 4 * self.item_count)
+            if self.items_offset + ITEM.size * self.item_count > len(self.map) \
+                    or manifest_offset + manifest_length > len(self.map):
+                raise ValueError(f"{path} is truncated")
+            self.manifest = json.loads(bytes(self.view[manifest_offset:manifest_offset + manifest_length]))
+        except BaseException:
+            self.close()
+            raise
+
+    def _u32_array(self, start: int, end: int):
+        """
+        :return: The little-endian 32-bit integers stored between two offsets of the file.
+        :raises ValueError: If the range is not a whole number of integers inside the file.
+        """
+        if not 0 <= start <= end <= len(self.map) or (end - start) % 4:
+            raise ValueError(f"{self.path} is truncated or corrupt")
+        values = self.view[start:end].cast('I')
+        if sys.byteorder == 'big':  # The file is little-endian, big-endian machines work on a swapped copy
+            values = array('I', values)
+            values.byteswap()
+        return values
+
+    def close(self):
+        for name in ('string_offsets', 'options', 'item_tags', 'postings', 'sorted_keys', 'view'):
+            values = getattr(self, name, None)
+            if isinstance(values, memoryview):
+                values.release()
+        self.map.close()
+
+    def is_fresh(self, file_paths: Iterable[str], stable_ids: bool) -> bool:
+        """
+        :return: Whether the bank was compiled from exactly these files, in this order, as they are now.
+        """
+        files = self.manifest['files']
+        file_paths = list(file_paths)
+        if self.manifest['stable_ids'] != stable_ids or len(files) != len(file_paths):
+            return False
+        for (path, size, mtime, _), file_path in zip(files, file_paths):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return False
+            if path != file_path or size != stat.st_size or mtime != stat.st_mtime_ns:
+                return False
+        return True
+
+    # Decoding
+
+    def string(self, sid: int) -> Optional[str]:
+        if sid == NO_STRING:
+            return None
+        start = self.data_offset + self.string_offsets[sid]
+        return str(self.view[start:self.data_offset + self.string_offsets[sid + 1]], 'utf-8')
+
+    def _record(self, index: int) -> Tuple[int, ...]:
+        return ITEM.unpack_from(self.map, self.items_offset + ITEM.size * index)
+
+    def key_at(self, index: int) -> str:
+        return self.string(self._record(index)[1])
+
+    def item_at(self, index: int) -> Item:
+        """
+        Decodes the item at a position of the bank.
+        """
+        type_id, _, text, answer, explanation, options_start, options_count, tags_start, tags_count, _ = \
+            self._record(index)
+        item_type = ITEM_TYPES[type_id]
+        item = {'type': item_type, TEXT_FIELDS[item_type]: self.string(text), 'answer': self.string(answer)}
+        if item_type == 'quiz':
+            options = self.options[2 * options_start:2 * (options_start + options_count)]
+            item['options'] = [(self.string(options[i]), self.string(options[i + 1]))
+                               for i in range(0, len(options), 2)]
+        if explanation != NO_STRING:
+            item['explanation'] = self.string(explanation)
+        if tags_count:
+            tags = self.item_tags[2 * tags_start:2 * (tags_start + tags_count)]
+            item['tags'] = [self.string(tags[i]) for i in range(1, len(tags), 2)]
+        return make_item(item)
+
+    def source_at(self, index: int) -> Optional[str]:
+        """
+        :return: The path of the file the item at a position of the bank comes from, if known.
+        """
+        file_id = self._record(index)[9]
+        return None if file_id == NO_SOURCE else self.manifest['files'][file_id][0]
+
+    def sources(self) -> Dict[str, str]:
+        """
+        :return: The path of the file each item comes from, keyed by item key, in bank order. Only
+          the keys are decoded.
+        """
+        paths = [file[0] for file in self.manifest['files']]
+        sources = {}
+        for index in range(self.item_count):
+            _, key, *_, file_id = self._record(index)
+            if file_id != NO_SOURCE:
+                sources[self.string(key)] = paths[file_id]
+        return sources
+
+    def index_of(self, key: str) -> int:
+        """
+        :return: The position of an item in the bank, or -1 if the key is not in it.
+        """
+        low, high = 0, self.item_count
+        while low < high:  # Binary search over the keys, in key order
+            middle = (low + high) // 2
+            if self.key_at(self.sorted_keys[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.item_count and self.key_at(self.sorted_keys[low]) == key:
+            return self.sorted_keys[low]
+        return -1
+
+    # Mapping
+
+    def __getitem__(self, key: str) -> Item:
+        index = self.index_of(key)
+        if index < 0:
+            raise KeyError(key)
+        return self.item_at(index)
+
+    def __contains__(self, key) -> bool:
+        return isinstance(key, str) and self.index_of(key) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.key_at(index) for index in range(self.item_count))
+
+    def __len__(self) -> int:
+        return self.item_count
+
+    def items_of_type(self, item_type: str = None) -> Iterator[Tuple[str, Item]]:
+        """
+        Iterates over the (key, item) pairs of the bank, optionally only those of one type.
+        """
+        indexes = range(self.item_count) if item_type is None else sorted(self._type_postings(item_type))
+        for index in indexes:
+            yield self.key_at(index), self.item_at(index)
+
+    def texts(self) -> List[Tuple[str, str, str]]:
+        """
+        :return: The (key, type, question or fact) of every item, in order, without building the items.
+        """
+        texts = []
+        for index in range(self.item_count):
+            type_id, key, text = self._record(index)[:3]
+            texts.append((self.string(key), ITEM_TYPES[type_id], self.string(text)))
+        return texts
+
+    def documents(self) -> Iterator[Tuple[str, str, str]]:
+        """
+        :return: The (key, type, searchable text) of every item, in order, for the search index.
+        """
+        for key, item in self.items_of_type():
+            yield key, item.type, search_text(item)
+
+    # Tag queries
+
+    def _tag_record(self, tag_id: int) -> Tuple[int, int, int, int, int]:
+        return TAG.unpack_from(self.map, self.tags_offset + TAG.size * tag_id)
+
+    def _tag_name(self, tag_id: int) -> str:
+        return self.string(self._tag_record(tag_id)[0])
+
+    def _type_postings(self, item_type: str) -> memoryview:
+        if item_type == 'quiz':
+            return self.postings[:self.quiz_count]
+        return self.postings[self.quiz_count:self.item_count]
+
+    def _find_tag(self, tag: str) -> Optional[Tuple[int, int, int, int, int]]:
+        tag_id = bisect_left(range(self.tag_count), tag, key=self._tag_name)
+        if tag_id == self.tag_count or self._tag_name(tag_id) != tag:
+            return None
+        return self._tag_record(tag_id)
+
+    def _tag_postings(self, tag: str, item_type: str) -> Set[int]:
+        record = self._find_tag(tag)
+        if record is None:
+            return set()
+        _, quizzes_start, quizzes_count, flashcards_start, flashcards_count = record
+        if item_type == 'quiz':
+            return set(self.postings[quizzes_start:quizzes_start + quizzes_count])
+        return set(self.postings[flashcards_start:flashcards_start + flashcards_count])
+
+    def statistics(self, item_type: str = 'quiz') -> TagStatistics:
+        """
+        :return: The tag statistics of the items of the given type, read from the tag table.
+        """
+        count_field = 2 if item_type == 'quiz' else 4
+
+        def frequency(tag):
+            record = self._find_tag(tag)
+            return 0 if record is None else record[count_field]
+
+        return TagStatistics(frequency, self.quiz_count if item_type == 'quiz' else self.item_count - self.quiz_count)
+
+    def tags(self, item_type: str = 'quiz', expression: str = None) -> List[str]:
+        """
+        :param expression: If given, only the tags of the items matching this tag expression.
+        :return: The normalized tags used by at least one item of the given type, sorted.
+        """
+        if expression is None or not expression.strip():
+            count_field = 2 if item_type == 'quiz' else 4
+            return [self._tag_name(tag_id) for tag_id in range(self.tag_count)
+                    if self._tag_record(tag_id)[count_field]]
+        tag_ids = set()
+        for index in self._query_indexes(expression, item_type):
+            tags_start, tags_count = self._record(index)[7:9]
+            tag_ids.update(self.item_tags[2 * tags_start:2 * (tags_start + tags_count):2])
+        return [self._tag_name(tag_id) for tag_id in sorted(tag_ids)]  # Tag ids follow the name order
+
+    def query(self, expression: str, item_type: str = 'quiz') -> Set[str]:
+        """
+        Evaluates a tag expression against the prebuilt tag index, in the order planned from the tag
+        statistics. Only the postings of the tags left in the plan are read.
+        :return: The set of keys of the matching items.
+        :raises ValueError: If the expression is malformed.
+        """
+        return {self.key_at(index) for index in self._query_indexes(expression, item_type)}
+
+    def _query_indexes(self, expression: str, item_type: str) -> Set[int]:
+        query_plan = plan(expression, self.statistics(item_type))
+        count("expression_evaluations")
+        if query_plan.constant is not None:
+            return set(self._type_postings(item_type)) if query_plan.constant else set()
+        postings = {token: self._tag_postings(token, item_type) for token in query_plan.postfix
+                    if token not in ('AND', 'OR', 'NOT')}
+        indexes, negated = evaluate_postfix_sets(query_plan.postfix, postings)
+        if negated:
+            indexes = set(self._type_postings(item_type)) - indexes
+        return indexes
+
+    def iter_query(self, expression: str, item_type: str = 'quiz') -> 'KeySequence':
+        """
+        Same as query, as a sequence of the keys, decoded when accessed. Sampling a few of them, as
+        reservoir_sample does, does not decode the others.
+        """
+        return KeySequence(self, list(self._query_indexes(expression, item_type)))
+
+
+class KeySequence(Sequence):
+    """
+    Keys of some items of a bank file, given by their position, decoded when accessed.
+    """
+
+    __slots__ = ('bank', 'indexes')
+
+    def __init__(self, bank: BankFile, indexes: List[int]):
+        self.bank = bank
+        self.indexes = indexes
+
+    def __len__(self) -> int:
+        return len(self.indexes)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return KeySequence(self.bank, self.indexes[position])
+        return self.bank.key_at(self.indexes[position])
+
+    def __iter__(self) -> Iterator[str]:
+        return map(self.bank.key_at, self.indexes)
+
+
+def bank_state(path: str) -> Optional[str]:
+    """
+    :return: What identifies the version of a bank file: its size and modification time, or None if
+      it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def open_fresh_bank(path: str, file_paths: Iterable[str], stable_ids: bool) -> Optional[BankFile]:
+    """
+    Opens a bank file if it is up to date with the given source files.
+    :return: The bank, or None if it is missing, unreadable or out of date.
+    """
+    try:
+        bank = BankFile(path)
+    except (OSError, ValueError, TypeError, KeyError, struct.error):
+        return None
+    try:
+        fresh = bank.is_fresh(file_paths, stable_ids)
+    except (TypeError, KeyError, ValueError):  # A manifest of the wrong shape
+        fresh = False
+    if not fresh:
+        bank.close()
+        return None
+    return bank
+
+
+# Compile the quiz files of a folder: python qzb.py <folder> <output.qzb>
+if __name__ == '__main__':
+    import time
+
+    folder, output_path = sys.argv[1:3]
+    paths = [os.path.join(subdir, file) for subdir, _, files in os.walk(folder) for file in files
+             if file.endswith(".qz") or file.endswith(".txt")]
+    start = time.perf_counter()
+    for path, error_code in compile_bank(paths, output_path):
+        print(f"{path} : Error {error_code}")
+    print(f"Compiled {len(paths)} files in {time.perf_counter() - start:.2f} s")
+    start = time.perf_counter()
+    bank = BankFile(output_path)
+    print(f"Opened {len(bank)} items in {(time.perf_counter() - start) * 1000:.2f} ms")
+    bank.close()
@@ -0,0 +1,460 @@
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import calendar
+import json
+import os
+import struct
+import time
+from tag_index import normalize_tag
+
+MAGIC = b"QZRL"
+VERSION = 1
+HEADER = struct.Struct("<4sHQ")  # Magic, version, generation: changes when the log is compacted
+KEY = struct.Struct("<cI")  # b'K', length of the key and its tags in UTF-8, separated by SEPARATOR
+ANSWER = struct.Struct("<cIBII")  # b'A', key id, flags, response time in ms, timestamp in seconds
+SEPARATOR = "\x1f"
+CORRECT = 1
+HINT_USED = 2
+RETENTION = 365 * 24 * 3600  # Seconds answers are kept in the log, their totals are kept in the aggregates
+COMPACTION_SLACK = 30 * 24 * 3600  # How much older than the retention the oldest answer gets before compacting
+
+
+class Stats:
+    """
+    Running totals of the answers to an item, or to the items of a tag.
+    """
+
+    __slots__ = ('attempts', 'correct', 'hints', 'response_ms', 'last')
+
+    def __init__(self, attempts: int = 0, correct: int = 0, hints: int = 0, response_ms: int = 0, last: float = 0):
+        self.attempts = attempts
+        self.correct = correct
+        self.hints = hints
+        self.response_ms = response_ms  # Total response time
+        self.last = last  # Time of the last answer
+
+    def add(self, correct: bool, hint_used: bool, response_ms: int, timestamp: float):
+        self.attempts += 1
+        self.correct += correct
+        self.hints += hint_used
+        self.response_ms += response_ms
+        self.last = max(self.last, timestamp)
+
+    @property
+    def accuracy(self) -> float:
+        return self.correct / self.attempts if self.attempts else 0.0
+
+    @property
+    def difficulty(self) -> float:
+        """
+        Estimated error rate, (mistakes + 1) / (attempts + 2), as error_rate_weight uses: 0.5 without answers.
+        """
+        return (self.attempts - self.correct + 1) / (self.attempts + 2)
+
+    @property
+    def mean_response_time(self) -> float:
+        """
+        In seconds.
+        """
+        return self.response_ms / self.attempts / 1000 if self.attempts else 0.0
+
+    @property
+    def hint_rate(self) -> float:
+        return self.hints / self.attempts if self.attempts else 0.0
+
+    def as_list(self) -> list:
+        return [self.attempts, self.correct, self.hints, self.response_ms, self.last]
+
+    def __repr__(self):
+        return f"Stats{tuple(self.as_list())!r}"
+
+
+class AnswerHistory(Mapping):
+    """
+    The item totals of a results log as the answer history of the weighted sampling modes:
+    key -> (attempts, mistakes, time of the last attempt).
+    """
+
+    def __init__(self, items: Dict[str, Stats]):
+        self.items = items
+
+    def __getitem__(self, key: str) -> Tuple[int, int, float]:
+        stats = self.items[key]
+        return stats.attempts, stats.attempts - stats.correct, stats.last
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class ResultsLog:
+    """
+    Append-only log of the answers given in quizzes, with running totals per item, per tag, and
+    per tag and month.
+
+    The log file starts with a header, then holds two kinds of records: key records, which give
+    an id to an item key and its tags the first time it is answered (again if its tags change),
+    and answer records of 14 bytes referring to them. Totals are updated as answers are recorded,
+    so reading them is O(1). They are saved in a summary file next to the log, with the key table
+    and the length of the log they cover, at each checkpoint. Opening the log reads the summary and
+    replays the answers recorded after it only, so history is never read again.
+
+    Compaction drops the answers older than the retention period from the log. Their totals stay
+    in the aggregates, and the monthly totals per tag keep their trend, so the log stays bounded
+    over years of use. It happens at checkpoints, once the oldest answer is a month past retention.
+    """
+
+    def __init__(self, path: str, retention: float = RETENTION):
+        self.path = path
+        self.summary_path = path + ".summary"
+        self.pending_path = path + ".pending"  # Summary of a compacted log about to replace this one
+        self.retention = retention
+        self.generation = 0
+        self.keys: List[Tuple[str, Tuple[str, ...]]] = []  # Key and tags of each key id
+        self.key_ids: Dict[Tuple[str, Tuple[str, ...]], int] = {}
+        self.items: Dict[str, Stats] = {}
+        self.tags: Dict[str, Stats] = {}
+        self.months: Dict[str, Dict[str, Stats]] = {}  # "YYYY-MM" -> tag -> totals, "" for all the answers
+        self.oldest: Optional[float] = None  # Time of the oldest answer in the log
+        self.history = AnswerHistory(self.items)
+        self._month = (0.0, 0.0, "")  # Start, end and name of the month of the last answer
+        self.file = None
+        self._open()
+
+    # Opening
+
+    def _open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER.size:
+            self._create(self.path)
+        with open(self.path, "rb") as file:
+            magic, version, self.generation = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a results log of version {VERSION}")
+        self._check_pending()
+        offset = self._load_summary()
+        end = self._replay(offset)
+        if end < os.path.getsize(self.path):
+            with open(self.path, "r+b") as file:
+                file.truncate(end)  # A record cut short by a crash
+        self.file = open(self.path, "ab")
+
+    def _create(self, path: str):
+        self.generation = int.from_bytes(os.urandom(8), 'little')
+        with open(path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, self.generation))
+
+    def _read_summary(self, path: str) -> Optional[dict]:
+        """
+        :return: The summary saved at path if it is the one of this log, as identified by its
+          generation, or None.
+        """
+        try:
+            with open(path) as file:
+                summary = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(summary, dict) or summary.get('generation') != self.generation \
+                or summary.get('offset', HEADER.size) > os.path.getsize(self.path):
+            return None
+        return summary
+
+    def _check_pending(self):
+        # The summary of a compaction is saved before the compacted log replaces the old one, and
+        # moved in place after. If the app stopped in between, it is the summary of the log now.
+        if os.path.exists(self.pending_path):
+            if self._read_summary(self.summary_path) is None and self._read_summary(self.pending_path) is not None:
+                os.replace(self.pending_path, self.summary_path)
+            else:
+                os.remove(self.pending_path)  # The compacted log did not replace the old one
+
+    def _load_summary(self) -> int:
+        """
+        Restores the totals of the last checkpoint.
+        :return: The length of the log they cover, where the replay starts. If the summary is missing,
+          or belongs to another version of the log, the whole log is replayed.
+        """
+        summary = self._read_summary(self.summary_path)
+        if summary is None:
+            return HEADER.size
+        self.keys = [(key, tuple(tags)) for key, tags in summary['keys']]
+        self.key_ids = {entry: key_id for key_id, entry in enumerate(self.keys)}
+        self.items.update((key, Stats(*stats)) for key, stats in summary['items'].items())
+        self.tags.update((tag, Stats(*stats)) for tag, stats in summary['tags'].items())
+        self.months.update((month, {tag: Stats(*stats) for tag, stats in tags.items()})
+                           for month, tags in summary['months'].items())
+        self.oldest = summary['oldest']
+        return summary['offset']
+
+    def _read_records(self, offset: int) -> Iterator[Tuple[int, bytes, tuple]]:
+        # (offset after the record, kind, fields) of the records from offset on, until the end or
+        # a record cut short. Raises ValueError on a record that cannot be read.
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            data = file.read()
+        position = 0
+        while position < len(data):
+            kind = data[position:position + 1]
+            if kind == b'A':
+                if position + ANSWER.size > len(data):
+                    return
+                fields = ANSWER.unpack_from(data, position)[1:]
+                position += ANSWER.size
+            elif kind == b'K':
+                if position + KEY.size > len(data):
+                    return
+                length = KEY.unpack_from(data, position)[1]
+                end = position + KEY.size + length
+                if end > len(data):
+                    return
+                key, *tags = str(data[position + KEY.size:end], 'utf-8').split(SEPARATOR)
+                fields = (key, tuple(tags))
+                position = end
+            elif not any(data[position:]):
+                return  # Zeros left by a crash in the blocks allocated to the file
+            else:
+                raise ValueError(f"{self.path} has an unknown record at byte {offset + position}")
+            yield offset + position, kind, fields
+
+    def _replay(self, offset: int) -> int:
+        """
+        Applies the records from offset on.
+        :return: The offset after the last whole record.
+        """
+        for offset, kind, fields in self._read_records(offset):
+            if kind == b'K':
+                self.key_ids[fields] = len(self.keys)
+                self.keys.append(fields)
+            else:
+                key_id, flags, response_ms, timestamp = fields
+                if key_id >= len(self.keys):
+                    raise ValueError(f"{self.path} has an answer to an unknown key before byte {offset}")
+                self._apply(key_id, flags, response_ms, timestamp)
+        return offset
+
+    # Recording
+
+    def _month_of(self, timestamp: float) -> str:
+        start, end, month = self._month
+        if not start <= timestamp < end:
+            year, number = time.gmtime(timestamp)[:2]
+            month = f"{year:04}-{number:02}"
+            start = calendar.timegm((year, number, 1, 0, 0, 0))
+            end = calendar.timegm((year + number // 12, number % 12 + 1, 1, 0, 0, 0))
+            self._month = (start, end, month)
+        return month
+
+    def _apply(self, key_id: int, flags: int, response_ms: int, timestamp: float):
+        key, tags = self.keys[key_id]
+        correct = bool(flags & CORRECT)
+        hint_used = bool(flags & HINT_USED)
+        stats = self.items.get(key)
+        if stats is None:
+            stats = self.items[key] = Stats()
+        stats.add(correct, hint_used, response_ms, timestamp)
+        month = self.months.get(self._month_of(timestamp))
+        if month is None:
+            month = self.months[self._month_of(timestamp)] = {}
+        for tag in (*tags, ""):
+            if tag:
+                stats = self.tags.get(tag)
+                if stats is None:
+                    stats = self.tags[tag] = Stats()
+                stats.add(correct, hint_used, response_ms, timestamp)
+            stats = month.get(tag)
+            if stats is None:
+                stats = month[tag] = Stats()
+            stats.add(correct, hint_used, response_ms, timestamp)
+        if self.oldest is None or timestamp < self.oldest:
+            self.oldest = timestamp
+
+    def _key_id(self, key: str, tags: Tuple[str, ...], file) -> int:
+        key_id = self.key_ids.get((key, tags))
+        if key_id is None:
+            data = SEPARATOR.join((key, *tags)).encode('utf-8')
+            file.write(KEY.pack(b'K', len(data)) + data)
+            key_id = self.key_ids[(key, tags)] = len(self.keys)
+            self.keys.append((key, tags))
+        return key_id
+
+    def record(self, key: str, correct: bool, response_time: float = 0, hint_used: bool = False,
+               tags: Iterable[str] = (), timestamp: float = None):
+        """
+        Appends an answer to the log and adds it to the totals.
+        :param response_time: The seconds taken to answer.
+        :param tags: The tags of the item, which get the answer in their totals.
+        :param timestamp: When the answer was given, now by default.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        tags = tuple(sorted({tag for tag in map(normalize_tag, tags) if tag}))
+        key_id = self._key_id(key, tags, self.file)
+        flags = (CORRECT if correct else 0) | (HINT_USED if hint_used else 0)
+        response_ms = min(max(0, round(response_time * 1000)), 0xFFFFFFFF)
+        self.file.write(ANSWER.pack(b'A', key_id, flags, response_ms, int(timestamp)))
+        self.file.flush()  # Kept by the system if the app crashes
+        self._apply(key_id, flags, response_ms, int(timestamp))
+
+    # Reading
+
+    def item(self, key: str) -> Stats:
+        """
+        :return: The totals of the answers to an item, empty if it was never answered.
+        """
+        return self.items.get(key) or Stats()
+
+    def tag(self, tag: str) -> Stats:
+        return self.tags.get(normalize_tag(tag)) or Stats()
+
+    def month(self, month: str, tag: str = "") -> Stats:
+        """
+        :param month: As "YYYY-MM", in UTC.
+        :param tag: A tag, or "" for all the answers of the month.
+        """
+        return self.months.get(month, {}).get(normalize_tag(tag)) or Stats()
+
+    def events(self) -> Iterator[Tuple[str, bool, float, bool, int]]:
+        """
+        :return: The (key, correct, response time in seconds, hint used, timestamp) of the answers
+          still in the log, oldest first. Unlike the totals, this reads the whole log.
+        """
+        self.file.flush()
+        for _, kind, fields in self._read_records(HEADER.size):
+            if kind == b'A':
+                key_id, flags, response_ms, timestamp = fields
+                yield (self.keys[key_id][0], bool(flags & CORRECT), response_ms / 1000, bool(flags & HINT_USED),
+                       timestamp)
+
+    # Maintenance
+
+    def checkpoint(self, now: float = None):
+        """
+        Saves the totals, and compacts the log if its oldest answer is well past the retention.
+        """
+        now = time.time() if now is None else now
+        if self.oldest is not None and self.oldest < now - self.retention - COMPACTION_SLACK:
+            self.compact(now)  # Saves the totals too
+            return
+        self.file.flush()
+        self._save_summary(self.summary_path, self.file.tell())
+
+    def _save_summary(self, path: str, offset: int):
+        """
+        Writes the totals, with the generation and the length of the log they cover. The file is
+        replaced atomically.
+        """
+        summary = {'generation': self.generation, 'offset': offset, 'oldest': self.oldest,
+                   'keys': self.keys,
+                   'items': {key: stats.as_list() for key, stats in self.items.items()},
+                   'tags': {tag: stats.as_list() for tag, stats in self.tags.items()},
+                   'months': {month: {tag: stats.as_list() for tag, stats in tags.items()}
+                              for month, tags in self.months.items()}}
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(summary, file, separators=(',', ':'))
+        os.replace(temporary_path, path)
+
+    def compact(self, now: float = None):
+        """
+        Rewrites the log without the answers older than the retention, and with only the keys the
+        others refer to. The totals do not change.
+
+        The compacted log gets a new generation. Its summary is saved before it replaces the log, and
+        moved in place after, so if the app stops at any point, the next opening finds a log and a
+        summary that match.
+        """
+        now = time.time() if now is None else now
+        self.file.flush()
+        horizon = now - self.retention
+        keys = self.keys
+        kept = [fields for _, kind, fields in self._read_records(HEADER.size) if kind == b'A' and fields[3] >= horizon]
+        temporary_path = self.path + ".tmp"
+        self.file.close()
+        self._create(temporary_path)
+        self.keys = []
+        self.key_ids = {}
+        with open(temporary_path, "ab") as file:
+            for key_id, flags, response_ms, timestamp in kept:
+                new_id = self._key_id(*keys[key_id], file)
+                file.write(ANSWER.pack(b'A', new_id, flags, response_ms, timestamp))
+            offset = file.tell()
+        self.oldest = min((fields[3] for fields in kept), default=None)
+        self._save_summary(self.pending_path, offset)
+        os.replace(temporary_path, self.path)
+        os.replace(self.pending_path, self.summary_path)
+        self.file = open(self.path, "ab")
+
+    def close(self):
+        if self.file is not None:
+            self.checkpoint()
+            self.file.close()
+            self.file = None
+
+
+def open_results_log(path: str, retention: float = RETENTION) -> Tuple[ResultsLog, Optional[str]]:
+    """
+    Opens a results log, or starts a new one if it cannot be read. The unreadable log and its
+    summary are moved aside, next to it, rather than deleted.
+    :return: The log, and the reason it was started anew, or None.
+    """
+    try:
+        return ResultsLog(path, retention), None
+    except ValueError as e:
+        aside = f"{path}.{time.strftime('%Y%m%d-%H%M%S')}.corrupt"
+        os.replace(path, aside)
+        if os.path.exists(path + ".summary"):
+            os.replace(path + ".summary", aside + ".summary")
+        return ResultsLog(path, retention), f"{e}. It was moved to {aside}, and a new log was started."
+
+
+# Show the accuracy and difficulty of the tags of a results log: python results_log.py [results.qzl] [--compact]
+# Without a log, benchmark one with a million answers.
+if __name__ == '__main__':
+    import random
+    import sys
+    import tempfile
+
+    if len(sys.argv) > 1 and not sys.argv[1].startswith("--"):
+        log = ResultsLog(sys.argv[1])
+        if "--compact" in sys.argv:
+            log.compact()
+        print(f"{'Tag':<30} {'Answers':>8} {'Accuracy':>9} {'Difficulty':>11} {'Mean s':>8} {'Hints':>6}")
+        for tag, stats in sorted(log.tags.items(), key=lambda entry: -entry[1].difficulty):
+            print(f"{tag:<30} {stats.attempts:>8} {stats.accuracy:>9.0%} {stats.difficulty:>11.2f} "
+                  f"{stats.mean_response_time:>8.1f} {stats.hint_rate:>6.0%}")
+        print()
+        for month in sorted(log.months):
+            stats = log.month(month)
+            print(f"{month}: {stats.attempts} answers, {stats.accuracy:.0%} right")
+        log.close()
+        sys.exit()
+
+    ANSWERS = 1_000_000
+    rng = random.Random(0)
+    now = time.time()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "results.qzl")
+        log = ResultsLog(path)
+        tags = [(f"tag{i % 50}", f"level{i % 5}") for i in range(10_000)]
+        start = time.perf_counter()
+        for i in range(ANSWERS):
+            item = rng.randrange(10_000)
+            log.record(f"item{item}", rng.random() < 0.7, rng.uniform(1, 20), rng.random() < 0.1, tags[item],
+                       now - (ANSWERS - i) * 60)  # One answer a minute, about two years
+        elapsed = time.perf_counter() - start
+        print(f"Recorded {ANSWERS} answers in {elapsed:.2f} s, {elapsed / ANSWERS * 1e6:.1f} µs each, "
+              f"log of {os.path.getsize(path) / 1e6:.1f} MB")
+        start = time.perf_counter()
+        log.checkpoint(now - RETENTION)  # Not compacted yet
+        print(f"Checkpoint in {(time.perf_counter() - start) * 1000:.0f} ms")
+        log.record("item0", True, 3, timestamp=now)
+        log.file.close()
+        start = time.perf_counter()
+        log = ResultsLog(path)
+        print(f"Reopened in {(time.perf_counter() - start) * 1000:.0f} ms, tag0: {log.tag('tag0')}")
+        start = time.perf_counter()
+        log.compact(now)
+        print(f"Compacted to {os.path.getsize(path) / 1e6:.1f} MB in {time.perf_counter() - start:.2f} s, "
+              f"tag0: {log.tag('tag0')}")
+        log.close()
@@ -0,0 +1,184 @@
+from itertools import islice
+from typing import Callable, Collection, Dict, Hashable, Iterable, List, Mapping, Optional, Sequence, Tuple, \
+    TypeVar
+import heapq
+import math
+import random
+import time
+from expression_parser import compile_expression
+
+T = TypeVar('T')
+
+# Answer history of an item: (attempts, mistakes, time of the last attempt)
+History = Mapping[Hashable, Tuple[int, int, float]]
+
+RECENCY_HALF_LIFE = 24 * 3600  # Seconds after which a question seen is half as likely to come back
+_END = object()
+
+
+def make_rng(seed: Optional[int] = None) -> random.Random:
+    """
+    :return: A random generator of its own, so that a quiz drawn with the same seed and pool is the same.
+    """
+    return random.Random(seed)
+
+
+def reservoir_sample(stream: Iterable[T], n: int, rng: random.Random = random) -> List[T]:
+    """
+    Draws n elements uniformly from a stream of unknown length, keeping only n of them in memory
+    (Li's algorithm L, which skips over the elements that cannot enter the reservoir).
+    :return: The drawn elements in random order, or all of them if the stream has fewer than n.
+    """
+    if isinstance(stream, Sequence) and not isinstance(stream, range):
+        # Same draw over the positions, so only the drawn elements are read, as the keys of BankFile.iter_query
+        return [stream[position] for position in reservoir_sample(range(len(stream)), n, rng)]
+    stream = iter(stream)
+    reservoir = list(islice(stream, n))
+    if len(reservoir) < n or n == 0:
+        rng.shuffle(reservoir)
+        return reservoir
+    w = math.exp(math.log(rng.random() or 1e-300) / n)
+    while True:
+        skip = int(math.log(rng.random() or 1e-300) / math.log1p(-w)) if w < 1 else 0
+        element = next(islice(stream, skip, None), _END)
+        if element is _END:
+            break
+        reservoir[rng.randrange(n)] = element
+        w *= math.exp(math.log(rng.random() or 1e-300) / n)
+    rng.shuffle(reservoir)
+    return reservoir
+
+
+def weighted_sample(stream: Iterable[Tuple[T, float]], n: int, rng: random.Random = random) -> List[T]:
+    """
+    Draws n elements without replacement from a stream of (element, weight), each draw being
+    proportional to the weights (Efraimidis and Spirakis' A-Res). Elements of weight 0 are never drawn.
+    Only the n best keys are kept, in a heap.
+    :return: The drawn elements, the heaviest keys first.
+    """
+    heap = []
+    for count, (element, weight) in enumerate(stream):
+        if weight <= 0:
+            continue
+        key = math.log(rng.random() or 1e-300) / weight  # Log of u ** (1 / weight), which keeps the order
+        if len(heap) < n:
+            heapq.heappush(heap, (key, count, element))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, count, element))
+    return [element for _, _, element in sorted(heap, reverse=True)]
+
+
+def stratified_sample(strata: Mapping[Hashable, Iterable[T]], n: int, rng: random.Random = random,
+                      weight: Callable[[T], float] = None) -> List[T]:
+    """
+    Draws n elements spread as evenly as possible over strata, such as tags. Each stratum is
+    sampled on its own, then elements are taken from the strata in turn, so a small stratum gives
+    all it has and the others make up for it. An element in several strata is only drawn once.
+    Memory is O(n) per stratum.
+    :param strata: The stream of each stratum.
+    :param weight: If given, strata are sampled with weighted_sample rather than uniformly.
+    :return: The drawn elements in random order.
+    """
+    samples = []
+    for stratum in sorted(strata, key=str):  # Sorted, so a seed gives the same quiz whatever the mapping order
+        stream = strata[stratum]
+        if weight is None:
+            samples.append(reservoir_sample(stream, n, rng))
+        else:
+            samples.append(weighted_sample(((element, weight(element)) for element in stream), n, rng))
+    drawn = {}
+    for rank in range(n):
+        for sample in samples:
+            if len(drawn) == n:
+                break
+            if rank < len(sample):
+                drawn.setdefault(sample[rank], None)
+    drawn = list(drawn)
+    rng.shuffle(drawn)
+    return drawn
+
+
+# Weights from the answer history
+
+def error_rate_weight(history: History) -> Callable[[Hashable], float]:
+    """
+    Weighs items by their estimated error rate, (mistakes + 1) / (attempts + 2), so questions
+    often missed come back more, and unseen questions have an even chance.
+    """
+    def weight(key):
+        attempts, mistakes, _ = history.get(key, (0, 0, 0))
+        return (mistakes + 1) / (attempts + 2)
+
+    return weight
+
+
+def recency_weight(history: History, now: float = None,
+                   half_life: float = RECENCY_HALF_LIFE) -> Callable[[Hashable], float]:
+    """
+    Weighs items by how long ago they were last asked: unseen questions weigh 1, and a question
+    just asked weighs almost nothing, half as much as an unseen one after half_life seconds.
+    """
+    if now is None:
+        now = time.time()
+
+    def weight(key):
+        entry = history.get(key)
+        if entry is None:
+            return 1.0
+        age = max(0.0, now - entry[2])
+        return max(1e-6, 1 - 0.5 ** (age / half_life))
+
+    return weight
+
+
+def record_answer(history: Dict[Hashable, Tuple[int, int, float]], key: Hashable, correct: bool,
+                  now: float = None):
+    """
+    Adds an answer to the history of an item.
+    """
+    attempts, mistakes, _ = history.get(key, (0, 0, 0))
+    history[key] = (attempts + 1, mistakes + (not correct), time.time() if now is None else now)
+
+
+def draw_questions(bank, expression: str, count: int, mode: str = 'uniform', rng: random.Random = random,
+                   history: History = None, within: Collection[str] = None) -> List[str]:
+    """
+    Draws the keys of the questions of a quiz, streaming the matching questions rather than listing them.
+    :param bank: A bank with iter_query and tags, such as QuizStore.
+    :param expression: The tag expression the questions must match.
+    :param count: The number of questions wanted. Fewer are returned if not enough questions match.
+    :param mode: 'uniform', 'errors', 'recency' or 'stratified'. 'errors' and 'recency' favour the
+      questions missed most or asked least recently according to history, and 'stratified' spreads
+      the quiz over the tags of the expression, or over the other tags of the matching questions if
+      it has fewer than two. The questions with none of these tags make one more stratum.
+    :param rng: The random generator, seeded for a reproducible quiz.
+    :param history: The answer history used by the weighted modes.
+    :param within: If given, only these keys are drawn, such as the matches of a text search.
+    :raises ValueError: If the expression is malformed.
+    """
+    def matching(expression):
+        keys = bank.iter_query(expression, 'quiz')
+        return keys if within is None else (key for key in keys if key in within)
+
+    if mode == 'stratified':
+        tags = list(dict.fromkeys(token for token in compile_expression(expression).postfix
+                                  if token not in ('AND', 'OR', 'NOT')))
+        if len(tags) < 2:
+            # Only tags that can be written in an expression on their own
+            tags = [tag for tag in bank.tags('quiz', expression)
+                    if tag not in tags and compile_expression(tag).postfix == (tag,)]
+        scope = f"({expression}) AND " if expression.strip() else ""
+        strata = {tag: matching(scope + tag) for tag in tags}
+        if tags:
+            strata[""] = matching(f"{scope}NOT ({' OR '.join(tags)})")  # No tag can be empty
+        drawn = stratified_sample(strata, count, rng)
+        return drawn if drawn else reservoir_sample(matching(expression), count, rng)
+
+    keys = matching(expression)
+    if mode == 'uniform':
+        return reservoir_sample(keys, count, rng)
+    history = {} if history is None else history
+    weight = error_rate_weight(history) if mode == 'errors' else recency_weight(history)
+    drawn = weighted_sample(((key, weight(key)) for key in keys), count, rng)
+    rng.shuffle(drawn)
+    return drawn
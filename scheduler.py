@@ -0,0 +1,211 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import heapq
+import sqlite3
+import time
+
+DAY = 24 * 3600
+AGAIN_DELAY = 10 * 60  # Seconds before a forgotten card comes back in the session
+INITIAL_EASE = 2.5
+MINIMUM_EASE = 1.3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reviews (
+    key TEXT PRIMARY KEY,
+    due REAL NOT NULL,
+    interval REAL NOT NULL,
+    ease REAL NOT NULL,
+    repetitions INTEGER NOT NULL,
+    lapses INTEGER NOT NULL
+);
+"""
+
+
+class CardState:
+    """
+    Review state of a flashcard, as SM-2 keeps it. Intervals are in days, due times in seconds since the epoch.
+    """
+
+    __slots__ = ('key', 'due', 'interval', 'ease', 'repetitions', 'lapses')
+
+    def __init__(self, key: str, due: float, interval: float = 0, ease: float = INITIAL_EASE,
+                 repetitions: int = 0, lapses: int = 0):
+        self.key = key
+        self.due = due
+        self.interval = interval
+        self.ease = ease
+        self.repetitions = repetitions
+        self.lapses = lapses
+
+    def as_tuple(self) -> Tuple[str, float, float, float, int, int]:
+        return self.key, self.due, self.interval, self.ease, self.repetitions, self.lapses
+
+    def __repr__(self):
+        return f"CardState{self.as_tuple()!r}"
+
+
+def sm2_update(state: CardState, grade: int, now: float):
+    """
+    Updates a card after a review, following SuperMemo 2.
+    :param grade: How well the card was remembered, from 0 (blackout) to 5 (perfect). Below 3, the
+      card is relearned: it comes back after AGAIN_DELAY and its interval starts over.
+    """
+    if grade < 3:
+        state.repetitions = 0
+        state.interval = 0
+        state.lapses += 1
+        state.due = now + AGAIN_DELAY
+    else:
+        state.repetitions += 1
+        if state.repetitions == 1:
+            state.interval = 1
+        elif state.repetitions == 2:
+            state.interval = 6
+        else:
+            state.interval = round(state.interval * state.ease)
+        state.due = now + state.interval * DAY
+    state.ease = max(MINIMUM_EASE, state.ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+
+
+class Scheduler:
+    """
+    Spaced-repetition scheduler: a min-heap of cards keyed on their due time.
+
+    Getting the next due card and rescheduling one cost O(log n). Rescheduled cards are pushed
+    again rather than moved, and the outdated heap entries are skipped when they reach the top
+    (lazy deletion). The heap is rebuilt when outdated entries outnumber the cards.
+    """
+
+    def __init__(self, states: Iterable[CardState] = ()):
+        self.states: Dict[str, CardState] = {state.key: state for state in states}
+        self.heap: List[Tuple[float, str]] = [(state.due, state.key) for state in self.states.values()]
+        heapq.heapify(self.heap)
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def __contains__(self, key) -> bool:
+        return key in self.states
+
+    def __getitem__(self, key: str) -> CardState:
+        return self.states[key]
+
+    def _push(self, state: CardState):
+        heapq.heappush(self.heap, (state.due, state.key))
+        if len(self.heap) > 2 * len(self.states) + 64:
+            self.heap = [(state.due, state.key) for state in self.states.values()]
+            heapq.heapify(self.heap)
+
+    def _top(self) -> Optional[CardState]:
+        # Drops the outdated entries on top of the heap
+        while self.heap:
+            due, key = self.heap[0]
+            state = self.states.get(key)
+            if state is not None and state.due == due:
+                return state
+            heapq.heappop(self.heap)
+        return None
+
+    def add(self, key: str, now: float = None) -> CardState:
+        """
+        Schedules a new card, due right away. Cards already scheduled are left as they are.
+        """
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = CardState(key, time.time() if now is None else now)
+            self._push(state)
+        return state
+
+    def remove(self, key: str):
+        """
+        Stops scheduling a card. Its heap entry is dropped when it reaches the top.
+        """
+        del self.states[key]
+
+    def next_due(self, now: float = None) -> Optional[CardState]:
+        """
+        :return: The card due the earliest if it is due by now, else None.
+        """
+        state = self._top()
+        if state is None or state.due > (time.time() if now is None else now):
+            return None
+        return state
+
+    def next_due_time(self) -> Optional[float]:
+        """
+        :return: When the next card is due, or None if there are no cards.
+        """
+        state = self._top()
+        return None if state is None else state.due
+
+    def review(self, key: str, grade: int, now: float = None) -> CardState:
+        """
+        Records a review of a card and reschedules it.
+        :param grade: From 0 to 5, see sm2_update.
+        """
+        state = self.states[key]
+        sm2_update(state, grade, time.time() if now is None else now)
+        self._push(state)
+        return state
+
+
+class ScheduleStore:
+    """
+    Persists the review states of the cards in SQLite, next to the bank. Each review writes one row.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def load(self) -> Iterator[CardState]:
+        return (CardState(*row) for row in self.connection.execute(
+            "SELECT key, due, interval, ease, repetitions, lapses FROM reviews"))
+
+    def save(self, state: CardState):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO reviews (key, due, interval, ease, repetitions, lapses) "
+                                    "VALUES (?, ?, ?, ?, ?, ?)", state.as_tuple())
+
+    def delete(self, key: str):
+        with self.connection:
+            self.connection.execute("DELETE FROM reviews WHERE key = ?", (key,))
+
+    def new_cards(self, limit: int) -> List[str]:
+        """
+        Finds flashcards never reviewed in the bank stored in the same database (see quiz_store.QuizStore),
+        with an anti-join on the reviews, so the scheduled cards are not brought back into Python.
+        :return: The keys of at most limit such cards, in bank order.
+        """
+        return [key for key, in self.connection.execute(
+            "SELECT key FROM items WHERE type = 'flashcard' AND NOT EXISTS "
+            "(SELECT 1 FROM reviews WHERE reviews.key = items.key) ORDER BY rowid LIMIT ?", (limit,))]
+
+
+# Benchmark the scheduler on a large collection
+if __name__ == '__main__':
+    import random
+
+    CARDS = 1_000_000
+    REVIEWS = 100_000
+    rng = random.Random(0)
+    now = time.time()
+
+    start = time.perf_counter()
+    scheduler = Scheduler(CardState(f"card{i}", now + rng.uniform(-30, 30) * DAY) for i in range(CARDS))
+    print(f"Built a schedule of {len(scheduler)} cards in {time.perf_counter() - start:.2f} s")
+
+    start = time.perf_counter()
+    reviewed = 0
+    while reviewed < REVIEWS:
+        state = scheduler.next_due(now)
+        if state is None:
+            now += DAY
+            continue
+        scheduler.review(state.key, rng.choice((1, 3, 4, 4, 5)), now)
+        reviewed += 1
+    elapsed = time.perf_counter() - start
+    print(f"{REVIEWS} reviews in {elapsed:.2f} s, {elapsed / REVIEWS * 1e6:.1f} µs per next card and review")
@@ -0,0 +1,383 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Collection, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+import heapq
+import math
+import re
+from instrumentation import count
+from tag_index import ITEM_TYPES
+
+WORD = re.compile(r"\w+")
+MAX_EXPANSIONS = 50  # Words a partial search term may stand for, the shortest first
+PREFIX_WEIGHT = 0.8  # Score of a word starting with the term, relative to the term itself
+INFIX_WEIGHT = 0.5  # Score of a word containing the term elsewhere
+K1 = 1.2  # BM25 parameters: saturation of repeated words, and normalization by text length
+B = 0.75
+RANKED_SIZE = 4096  # Postings from which a term is searched best match first instead of scanned
+MAX_CANDIDATES = 2048  # Documents scored by a search made only of common words, see _best_first
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into lowercase words, the same way for items and searches.
+    """
+    return WORD.findall(text.lower())
+
+
+def search_text(item: Mapping) -> str:
+    """
+    :return: The searchable text of an item: its question or fact, options and explanation.
+    """
+    return " ".join(filter(None, (item.get('question') or item.get('fact'), *item.get('options', {}).values(),
+                                  item.get('explanation'))))
+
+
+def trigrams(word: str) -> Set[str]:
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class SearchIndex:
+    """
+    Inverted index over the text of the items, for full-text search.
+
+    Each word maps to the sorted ids of the documents containing it, one entry per occurrence, in
+    a compact array. Words are found by their trigrams too, so a search term also matches the
+    words it is part of ("capit" finds "capital"). Searches are ranked with BM25.
+
+    A search starts from its rarest term and only checks the other terms on the documents found
+    so far, by binary search in their postings, so a selective search stays fast on a large bank.
+    When even the rarest term is common, its documents are visited best match first, and the
+    search stops as soon as no other document can make it to the results.
+    Items that are edited or removed get a new id, and their old ids are dropped from the
+    postings once they are a majority (lazy deletion, as in the scheduler).
+    """
+
+    def __init__(self):
+        self.keys: List[Optional[str]] = []  # Key of each document id, None once removed
+        self.doc_ids: Dict[str, int] = {}  # Current document id of each key
+        self.types = bytearray()  # Index in ITEM_TYPES of the type of each document
+        self.lengths = array('I')  # Number of words of each document
+        self.postings: Dict[str, array] = {}
+        self.frequencies: Dict[str, int] = {}  # Documents containing each word, removed ones until compacted
+        self.trigrams: Dict[str, Set[str]] = {}  # Trigram -> words containing it. Numbers are left out.
+        self.total_length = 0  # Words of the current documents
+        self.rankings: Dict[str, Dict[int, array]] = {}  # See ranking, built on demand
+
+    @classmethod
+    def from_items(cls, items: Mapping[str, Mapping]) -> 'SearchIndex':
+        index = cls()
+        index.update(items)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def __contains__(self, key) -> bool:
+        return key in self.doc_ids
+
+    # Indexing
+
+    def add_document(self, key: str, item_type: str, text: str):
+        """
+        Indexes the text of an item, replacing the previous one if the key is already indexed.
+        """
+        if key in self.doc_ids:
+            self.remove(key)
+        doc_id = len(self.keys)
+        words = tokenize(text)
+        self.keys.append(key)
+        self.doc_ids[key] = doc_id
+        self.types.append(ITEM_TYPES.index(item_type))
+        self.lengths.append(len(words))
+        self.total_length += len(words)
+        for word in words:
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = array('I')
+                self.frequencies[word] = 0
+                if not word.isdigit():
+                    for trigram in trigrams(word):
+                        self.trigrams.setdefault(trigram, set()).add(word)
+            if not postings or postings[-1] != doc_id:
+                self.frequencies[word] += 1
+            postings.append(doc_id)
+        if self.rankings:
+            for word, occurrences in Counter(words).items():
+                ranking = self.rankings.get(word)
+                if ranking is not None:
+                    group = ranking.setdefault(occurrences, array('I'))
+                    group.insert(bisect_right(group, len(words), key=self.lengths.__getitem__), doc_id)
+
+    def add(self, key: str, item: Mapping):
+        self.add_document(key, item['type'], search_text(item))
+
+    def update(self, items: Mapping[str, Mapping]):
+        for key, item in items.items():
+            self.add(key, item)
+
+    def update_documents(self, documents: Iterable[Tuple[str, str, str]]):
+        """
+        Indexes (key, type, text) documents, such as the ones of QuizStore.documents().
+        """
+        for key, item_type, text in documents:
+            self.add_document(key, item_type, text)
+
+    def remove(self, key: str):
+        doc_id = self.doc_ids.pop(key)
+        self.keys[doc_id] = None
+        self.total_length -= self.lengths[doc_id]
+        if len(self.keys) > 2 * len(self.doc_ids) + 1024:
+            self.compact()
+
+    def compact(self):
+        """
+        Drops the removed documents from the postings, and renumbers the others.
+        """
+        new_ids = array('i', [-1]) * len(self.keys)
+        keys = []
+        types = bytearray()
+        lengths = array('I')
+        for doc_id, key in enumerate(self.keys):
+            if key is not None:
+                new_ids[doc_id] = len(keys)
+                keys.append(key)
+                types.append(self.types[doc_id])
+                lengths.append(self.lengths[doc_id])
+        for word, postings in list(self.postings.items()):
+            kept = array('I', [new_ids[doc_id] for doc_id in postings if new_ids[doc_id] >= 0])
+            if kept:
+                self.postings[word] = kept
+                self.frequencies[word] = len(set(kept))
+            else:
+                del self.postings[word]
+                del self.frequencies[word]
+                for trigram in trigrams(word) if not word.isdigit() else ():
+                    words = self.trigrams[trigram]
+                    words.discard(word)
+                    if not words:
+                        del self.trigrams[trigram]
+        self.rankings.clear()
+        self.keys = keys
+        self.doc_ids = {key: doc_id for doc_id, key in enumerate(keys)}
+        self.types = types
+        self.lengths = lengths
+
+    def rank_common_words(self):
+        """
+        Builds the rankings of the words searched best match first, which the first search of each
+        would build otherwise. Meant to be run in the background once the bank is indexed.
+        """
+        for word, postings in list(self.postings.items()):
+            if len(postings) >= RANKED_SIZE:
+                self.ranking(word)
+
+    # Searching
+
+    def expand(self, term: str) -> List[Tuple[str, float]]:
+        """
+        :return: The indexed words a search term stands for, with their weight: the term itself,
+          and the words it is part of if it has at least 3 characters, the shortest first.
+        """
+        words = [(term, 1.0)] if term in self.postings else []
+        if len(term) < 3 or term.isdigit():
+            return words
+        candidates = None
+        for trigram in sorted(trigrams(term), key=lambda trigram: len(self.trigrams.get(trigram, ()))):
+            found = self.trigrams.get(trigram)
+            if not found:
+                return words
+            candidates = set(found) if candidates is None else candidates & found
+        partial = sorted((word for word in candidates if term in word and word != term),
+                         key=lambda word: (len(word), word))
+        words += [(word, PREFIX_WEIGHT if word.startswith(term) else INFIX_WEIGHT)
+                  for word in partial[:MAX_EXPANSIONS - len(words)]]
+        return words
+
+    def ranking(self, word: str) -> Dict[int, array]:
+        """
+        :return: The documents containing a word, grouped by number of occurrences, each group
+          sorted by length, then by id. Along a group, the BM25 score of the word can only
+          decrease, whatever the average length is, so the ranking stays valid as documents are added.
+        """
+        ranking = self.rankings.get(word)
+        if ranking is None:
+            groups = {}
+            for doc_id, occurrences in Counter(self.postings[word]).items():
+                if self.keys[doc_id] is not None:
+                    groups.setdefault(occurrences, []).append(doc_id)
+            ranking = self.rankings[word] = {occurrences: array('I', sorted(group, key=self.lengths.__getitem__))
+                                             for occurrences, group in groups.items()}
+        return ranking
+
+    def _terms(self, query: str) -> List[List[Tuple[str, float]]]:
+        # The words each term of the query stands for, with their idf, the rarest term first.
+        # Empty if a term matches no word.
+        terms = []
+        documents = len(self.doc_ids)
+        for term in dict.fromkeys(tokenize(query)):
+            words = self.expand(term)
+            if not words:
+                return []
+            terms.append([(word, word_weight * self._idf(word, documents)) for word, word_weight in words])
+        terms.sort(key=lambda words: sum(len(self.postings[word]) for word, _ in words))
+        return terms
+
+    def _idf(self, word: str, documents: int) -> float:
+        frequency = min(self.frequencies[word], documents)  # Removed documents may still be counted
+        return math.log(1 + (documents - frequency + 0.5) / (frequency + 0.5))
+
+    def _filter(self, item_type: Optional[str], within: Optional[Collection[str]]):
+        keys = self.keys
+        types = self.types
+        type_code = None if item_type is None else ITEM_TYPES.index(item_type)
+        return lambda doc_id: (keys[doc_id] is not None and (type_code is None or types[doc_id] == type_code)
+                               and (within is None or keys[doc_id] in within))
+
+    def _bm25(self, doc_id: int, occurrences: int, idf: float, average_length: float) -> float:
+        return idf * occurrences * (K1 + 1) / (occurrences + K1 * (1 - B + B * self.lengths[doc_id] / average_length))
+
+    def _term_score(self, doc_id: int, words: List[Tuple[str, float]], average_length: float) -> float:
+        # Score of a document for a term: that of the best word the term stands for, 0 if none
+        best = 0
+        for word, idf in words:
+            postings = self.postings[word]
+            start = bisect_left(postings, doc_id)
+            if start < len(postings) and postings[start] == doc_id:
+                best = max(best, self._bm25(doc_id, bisect_right(postings, doc_id, start) - start, idf, average_length))
+        return best
+
+    def _scan(self, terms, accept, average_length: float) -> Dict[int, float]:
+        # Document id -> score of the accepted documents matching every term
+        scores = {}
+        for word, idf in terms[0]:
+            postings = self.postings[word]
+            start = 0
+            while start < len(postings):
+                doc_id = postings[start]
+                end = bisect_right(postings, doc_id, start)
+                if accept(doc_id):
+                    score = self._bm25(doc_id, end - start, idf, average_length)
+                    if score > scores.get(doc_id, 0):
+                        scores[doc_id] = score
+                start = end
+        for words in terms[1:]:
+            matched = {}
+            for doc_id, score in scores.items():
+                best = self._term_score(doc_id, words, average_length)
+                if best:
+                    matched[doc_id] = score + best
+            scores = matched
+            if not scores:
+                break
+        return scores
+
+    def _best_first(self, terms, accept, limit: int, average_length: float) -> List[Tuple[float, int]]:
+        # The (score, -document id) of the best matches, visiting the documents of the first term
+        # best first, until the score of the first term plus the most the other terms could add
+        # cannot beat the last of the results. When every term is common, the other terms can
+        # reorder many documents, so the search also stops after MAX_CANDIDATES matches: common
+        # words barely separate the items anyway.
+        def walk(group, occurrences, idf):
+            for doc_id in group:
+                yield -self._bm25(doc_id, occurrences, idf, average_length), doc_id
+
+        walks = [walk(group, occurrences, idf) for word, idf in terms[0]
+                 for occurrences, group in self.ranking(word).items()]
+        # The best score of a word is that of the first document of one of its groups
+        ceiling = sum(max(self._bm25(group[0], occurrences, idf, average_length)
+                          for word, idf in words for occurrences, group in self.ranking(word).items())
+                      for words in terms[1:])
+        best = []  # Heap of the results so far, the last one on top
+        seen = set()
+        candidates = 0
+        for negative_score, doc_id in heapq.merge(*walks):
+            if len(best) == limit and ((-negative_score + ceiling, -doc_id) < best[0] or candidates >= MAX_CANDIDATES):
+                break
+            if doc_id in seen:
+                continue  # Already seen through a better word of the first term
+            seen.add(doc_id)
+            if not accept(doc_id):
+                continue
+            score = -negative_score
+            for words in terms[1:]:
+                term_score = self._term_score(doc_id, words, average_length)
+                if not term_score:
+                    break
+                score += term_score
+            else:
+                candidates += 1
+                if len(best) < limit:
+                    heapq.heappush(best, (score, -doc_id))
+                elif (score, -doc_id) > best[0]:
+                    heapq.heapreplace(best, (score, -doc_id))
+        return sorted(best, reverse=True)
+
+    def search(self, query: str, item_type: str = None, limit: int = 50,
+               within: Collection[str] = None) -> List[Tuple[str, float]]:
+        """
+        Finds the items whose text contains every word of the query, or words the query's words
+        are part of.
+        :param item_type: If given, only items of that type are returned.
+        :param limit: The number of results wanted.
+        :param within: If given, only these keys are returned, for instance the result of a tag query.
+        :return: The (key, score) of the best matches, the best first. Equal scores keep the bank order.
+          When the first word of the query matches RANKED_SIZE occurrences or more, the search stops
+          after MAX_CANDIDATES matches, so the ranking is approximate for such common words.
+        """
+        terms = self._terms(query)
+        if not terms or limit <= 0 or not self.doc_ids:
+            return []
+        count("searches")
+        average_length = self.total_length / len(self.doc_ids)
+        accept = self._filter(item_type, within)
+        if sum(len(self.postings[word]) for word, _ in terms[0]) >= RANKED_SIZE:
+            best = self._best_first(terms, accept, limit, average_length)
+            return [(self.keys[-negative_id], score) for score, negative_id in best]
+        scores = self._scan(terms, accept, average_length)
+        best = heapq.nsmallest(limit, scores.items(), key=lambda entry: (-entry[1], entry[0]))
+        return [(self.keys[doc_id], score) for doc_id, score in best]
+
+    def matches(self, query: str, item_type: str = None, within: Collection[str] = None) -> Set[str]:
+        """
+        Same as search, but returns the keys of every match, unranked.
+        """
+        terms = self._terms(query)
+        if not terms or not self.doc_ids:
+            return set()
+        count("searches")
+        accept = self._filter(item_type, within)
+        if sum(len(self.postings[word]) for word, _ in terms[0]) < RANKED_SIZE:
+            return {self.keys[doc_id] for doc_id in self._scan(terms, accept, self.total_length / len(self.doc_ids))}
+        # Common terms: set operations on whole postings are cheaper than checking each document
+        found = None
+        for words in terms:
+            documents = set().union(*(self.postings[word] for word, _ in words))
+            found = documents if found is None else found.intersection(documents)
+        if within is not None and len(within) < len(found):
+            found.intersection_update(self.doc_ids.get(key) for key in within)
+        return {self.keys[doc_id] for doc_id in found if accept(doc_id)}
+
+
+# Benchmark searches on a synthetic bank: python search_index.py [items]
+if __name__ == '__main__':
+    import sys
+    import time
+    from benchmark import generate_items
+    from file_parser import parse_quiz_and_flashcards
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    items, _ = parse_quiz_and_flashcards(generate_items(size), True)
+    start = time.perf_counter()
+    index = SearchIndex.from_items(items)
+    print(f"Indexed {len(index)} items in {time.perf_counter() - start:.2f} s, {len(index.postings)} words")
+    start = time.perf_counter()
+    index.rank_common_words()
+    print(f"Ranked {len(index.rankings)} common words in {time.perf_counter() - start:.2f} s")
+    del items
+    for query in ("question 4242", "explanation 77", "optio", "question", "number 99 opt", "question of") * 2:
+        start = time.perf_counter()
+        results = index.search(query)
+        print(f"{query!r}: {len(results)} results in {(time.perf_counter() - start) * 1000:.1f} ms")
+    start = time.perf_counter()
+    print(f"'question' matches {len(index.matches('question'))} items in {(time.perf_counter() - start) * 1000:.1f} ms")
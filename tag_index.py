@@ -0,0 +1,137 @@
+from typing import Dict, Iterable, Set, Tuple
+from instrumentation import count
+from query_planner import TagStatistics, plan
+
+ITEM_TYPES = ('quiz', 'flashcard')
+
+
+def normalize_tag(tag: str) -> str:
+    """
+    Normalizes a tag the same way the expression parser does, so that index lookups match.
+    """
+    return tag.strip().lower()
+
+
+class TagIndex:
+    """
+    Inverted index from normalized tag to the keys of the items carrying it, kept separately for
+    quizzes and flashcards. Tag expressions are evaluated on it with set algebra, so a query costs
+    in proportion to the size of the postings it touches rather than the size of the bank.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, Set[str]]] = {item_type: {} for item_type in ITEM_TYPES}
+        self.keys: Dict[str, Set[str]] = {item_type: set() for item_type in ITEM_TYPES}
+
+    @classmethod
+    def from_items(cls, items: Dict[str, Dict]) -> 'TagIndex':
+        """
+        Builds an index over a dictionary of items, such as quiz_db.
+        """
+        index = cls()
+        index.update(items)
+        return index
+
+    def add(self, key: str, item: Dict):
+        """
+        Indexes an item under all its tags.
+        """
+        postings = self.postings[item['type']]
+        self.keys[item['type']].add(key)
+        for tag in item.get('tags', []):
+            postings.setdefault(normalize_tag(tag), set()).add(key)
+
+    def remove(self, key: str, item: Dict):
+        """
+        Removes an item from the index. The item must still carry the tags it was indexed with.
+        """
+        postings = self.postings[item['type']]
+        self.keys[item['type']].discard(key)
+        for tag in item.get('tags', []):
+            tag = normalize_tag(tag)
+            keys = postings.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:  # Forget tags that no longer have any item
+                    del postings[tag]
+
+    def update(self, items: Dict[str, Dict]):
+        """
+        Indexes every item of a dictionary of items.
+        """
+        for key, item in items.items():
+            self.add(key, item)
+
+    def tags(self, item_type: str = 'quiz') -> Iterable[str]:
+        """
+        :return: The normalized tags used by at least one item of the given type.
+        """
+        return self.postings[item_type].keys()
+
+    def statistics(self, item_type: str = 'quiz') -> TagStatistics:
+        """
+        :return: The live tag statistics of the items of the given type, read from the postings.
+        """
+        postings = self.postings[item_type]
+        return TagStatistics(lambda tag: len(postings.get(tag, ())), len(self.keys[item_type]))
+
+    def query(self, expression: str, item_type: str = 'quiz') -> Set[str]:
+        """
+        Evaluates a tag expression against the index, in the order planned from the tag statistics.
+        :param expression: A logical expression, with parentheses, AND, OR, and NOT.
+        :param item_type: Either 'quiz' or 'flashcard'.
+        :return: The set of keys of the matching items.
+        :raises ValueError: If the expression is malformed.
+        """
+        universe = self.keys[item_type]
+        query_plan = plan(expression, self.statistics(item_type))
+        count("expression_evaluations")
+        if query_plan.constant is not None:
+            return set(universe) if query_plan.constant else set()
+
+        keys, negated = evaluate_postfix_sets(query_plan.postfix, self.postings[item_type])
+        return universe - keys if negated else set(keys)
+
+
+def evaluate_postfix_sets(postfix: Iterable[str], postings: Dict[str, Set[str]]) -> Tuple[Set[str], bool]:
+    """
+    Evaluates a postfix expression as set operations over postings lists.
+
+    Complements are kept symbolic as (keys, True), meaning "every item except keys", so that
+    NOT never has to materialize the whole bank: a AND NOT b becomes a - b.
+
+    :returns: Tuple[Set[str], bool]: The resulting keys and whether they are complemented.
+    """
+    empty = frozenset()
+    stack = []
+    for token in postfix:
+        if token == 'AND':
+            right, right_negated = stack.pop()
+            left, left_negated = stack.pop()
+            if not left_negated and not right_negated:
+                # Intersect starting from the smaller set
+                stack.append((left & right if len(left) <= len(right) else right & left, False))
+            elif not left_negated:
+                stack.append((left - right, False))
+            elif not right_negated:
+                stack.append((right - left, False))
+            else:  # NOT a AND NOT b == NOT (a OR b)
+                stack.append((left | right, True))
+        elif token == 'OR':
+            right, right_negated = stack.pop()
+            left, left_negated = stack.pop()
+            if not left_negated and not right_negated:
+                stack.append((left | right, False))
+            elif not left_negated:  # a OR NOT b == NOT (b - a)
+                stack.append((right - left, True))
+            elif not right_negated:
+                stack.append((left - right, True))
+            else:  # NOT a OR NOT b == NOT (a AND b)
+                stack.append((left & right, True))
+        elif token == 'NOT':
+            keys, negated = stack.pop()
+            stack.append((keys, not negated))
+        else:
+            stack.append((postings.get(token, empty), False))
+
+    return stack.pop()
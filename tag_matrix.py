@@ -0,0 +1,129 @@
+from typing import Dict, Iterable, List
+from expression_parser import compile_expression
+from tag_index import ITEM_TYPES, normalize_tag
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only the benchmark uses the matrix
+    np = None
+
+# Number of set bits in each possible byte, to count items in packed bitsets
+POPCOUNT = None if np is None else np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+class TagMatrix:
+    """
+    Columnar item x tag representation of a bank, stored as one packed bitset per tag.
+
+    Bit i of a tag's bitset is set when the i-th item carries the tag, so a whole tag expression
+    evaluates to a single mask over every item with a handful of vectorized bitwise operations.
+    Requires NumPy. The app evaluates expressions with QuizStore, BankFile or TagIndex, which only
+    read the postings of the tags of the expression; benchmark.py compares them with this full scan.
+    """
+
+    available = np is not None
+
+    def __init__(self, keys: List[str], types: Dict[str, 'np.ndarray'], tag_ids: Dict[str, int],
+                 bits: 'np.ndarray'):
+        self.keys = keys
+        self.types = types  # item type -> boolean mask of the items of that type
+        self.tag_ids = tag_ids  # normalized tag -> row in bits
+        self.bits = bits  # (number of tags, number of bytes) array of packed bitsets
+
+    @classmethod
+    def from_items(cls, items: Dict[str, Dict]) -> 'TagMatrix':
+        """
+        Builds the matrix of a dictionary of items, such as quiz_db.
+        """
+        if np is None:
+            raise ImportError("NumPy is required to build a TagMatrix.")
+
+        keys = list(items)
+        tag_ids = {}
+        rows, columns = [], []
+        type_codes = np.empty(len(keys), dtype=np.uint8)
+        for row, key in enumerate(keys):
+            item = items[key]
+            type_codes[row] = ITEM_TYPES.index(item['type'])
+            for tag in item.get('tags', []):
+                rows.append(row)
+                columns.append(tag_ids.setdefault(normalize_tag(tag), len(tag_ids)))
+
+        bits = np.zeros((len(tag_ids), (len(keys) + 7) // 8), dtype=np.uint8)
+        if rows:
+            rows = np.array(rows, dtype=np.int64)
+            columns = np.array(columns, dtype=np.int64)
+            # Same bit order as np.packbits: the first item is the most significant bit of the first byte
+            np.bitwise_or.at(bits, (columns, rows >> 3), (128 >> (rows & 7)).astype(np.uint8))
+
+        types = {item_type: type_codes == code for code, item_type in enumerate(ITEM_TYPES)}
+        return cls(keys, types, tag_ids, bits)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def tag_bits(self, tag: str) -> 'np.ndarray':
+        """
+        :return: The packed bitset of a normalized tag, empty if no item carries it.
+        """
+        row = self.tag_ids.get(tag)
+        if row is None:
+            return np.zeros(self.bits.shape[1], dtype=np.uint8)
+        return self.bits[row]
+
+    def evaluate_postfix(self, postfix: Iterable[str], item_type: str = None) -> 'np.ndarray':
+        """
+        Evaluates a postfix expression over every item at once.
+        :param postfix: The postfix form of an expression, as given by infix_to_postfix.
+        :param item_type: If given, only items of this type can match.
+        :return: A boolean mask with one entry per item, in the order of self.keys.
+        """
+        stack = []
+        for token in postfix:
+            if token == 'AND':
+                right = stack.pop()
+                stack.append(stack.pop() & right)
+            elif token == 'OR':
+                right = stack.pop()
+                stack.append(stack.pop() | right)
+            elif token == 'NOT':
+                stack.append(~stack.pop())
+            else:
+                stack.append(self.tag_bits(token))
+
+        if stack:
+            # Padding bits past the last item may have been flipped by NOT, cut them off
+            mask = np.unpackbits(stack.pop(), count=len(self.keys)).astype(bool)
+        else:
+            mask = np.ones(len(self.keys), dtype=bool)
+        if item_type is not None:
+            mask &= self.types[item_type]
+        return mask
+
+    def matching_keys(self, expression: str, item_type: str = 'quiz') -> List[str]:
+        """
+        Batch API: evaluates a tag expression over the whole bank.
+        :param expression: A logical expression, with parentheses, AND, OR, and NOT.
+        :param item_type: Either 'quiz' or 'flashcard'.
+        :return: The keys of the matching items, in bank order.
+        :raises ValueError: If the expression is malformed.
+        """
+        mask = self.evaluate_postfix(compile_expression(expression).postfix, item_type)
+        return [self.keys[row] for row in np.flatnonzero(mask)]
+
+    def tag_counts(self) -> Dict[str, int]:
+        """
+        :return: The number of items carrying each tag.
+        """
+        counts = POPCOUNT[self.bits].sum(axis=1, dtype=np.int64)
+        return {tag: int(counts[row]) for tag, row in self.tag_ids.items()}
+
+    def cooccurrence(self, tags: List[str] = None) -> 'np.ndarray':
+        """
+        Counts how many items carry each pair of tags.
+        :param tags: The normalized tags to compare, all tags in index order by default.
+        :return: A square matrix whose [i, j] entry is the number of items carrying both tags i and j.
+        """
+        rows = self.bits if tags is None else np.stack([self.tag_bits(tag) for tag in tags])
+        matrix = np.unpackbits(rows, axis=1, count=len(self.keys)).astype(np.int32)
+        return matrix @ matrix.T
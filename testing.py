@@ -1,6 +1,38 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import threading
 import unittest
-from file_parser import parse_quiz_and_flashcards
-
+from unittest import mock
+from background import BackgroundTask, track_lines
+from bank_layout import MeasureCache, RowLayout
+from benchmark import generate_corpus, generate_items
+from expression_parser import compile_expression, parse_expression, tokenize_expression
+from file_parser import item_key, iter_quiz_and_flashcards, parse_quiz_and_flashcards, \
+    parse_quiz_and_flashcards_file, split_blocks
+from import_cache import ImportCache
+import instrumentation
+from lazy_bank import LazyBank
+from library import import_files, load_library
+from query_planner import TagStatistics, plan
+from quiz_items import make_item
+import quiz_loadgen
+from quiz_server import QuizServer, load_bank
+from quiz_session import QuizSession, simulate
+from quiz_store import QuizStore
+from qzb import BankFile, compile_bank, open_fresh_bank
+from results_log import ANSWER, HEADER, ResultsLog, open_results_log
+from sampling import draw_questions, error_rate_weight, make_rng, recency_weight, record_answer, reservoir_sample, \
+    stratified_sample, weighted_sample
+from scheduler import AGAIN_DELAY, DAY, CardState, Scheduler, ScheduleStore, sm2_update
+import search_index
+from search_index import SearchIndex, search_text
+from tag_index import TagIndex
+from tag_matrix import TagMatrix
 
 class TestParseQuizAndFlashcards(unittest.TestCase):
 
@@ -101,5 +133,1223 @@ END
         _, error_code = parse_quiz_and_flashcards(content)
         self.assertEqual(error_code, 7)
 
+    def test_error_code_8_empty_content(self):
+        _, error_code = parse_quiz_and_flashcards("")
+        self.assertEqual(error_code, 8)
+
+
+class TestIterQuizAndFlashcards(unittest.TestCase):
+
+    def test_items_are_yielded_one_at_a_time(self):
+        lines = iter(["F: Bonjour\n", "A: Hello\n", "END\n", "F: Merci\n", "A: Thank you\n", "END\n"])
+        parser = iter_quiz_and_flashcards(lines)
+        _, first = next(parser)
+        self.assertEqual(first['fact'], 'Bonjour')
+        self.assertEqual(next(lines), "F: Merci\n")  # The second item has not been read yet
+
+    def test_error_code_is_returned(self):
+        parser = iter_quiz_and_flashcards(["F: Bonjour", "A: Hello", "END", "A: Paris"])
+        self.assertEqual(len(list(parser)), 1)
+        with self.assertRaises(StopIteration) as stop:
+            next(iter_quiz_and_flashcards(["A: Paris"]))
+        self.assertEqual(stop.exception.value, 7)
+
+
+class TestItemRecords(unittest.TestCase):
+
+    def test_dict_style_access(self):
+        quiz = make_item({'type': 'quiz', 'question': 'Is 2 even?', 'options': {'A': 'True', 'B': 'False'},
+                          'answer': 'A', 'tags': [' Math', 'Parity']})
+        self.assertEqual(quiz['type'], 'quiz')
+        self.assertEqual(quiz['options'], {'A': 'True', 'B': 'False'})
+        self.assertEqual(quiz['tags'], ('Math', 'Parity'))
+        self.assertIn('math', quiz['tags'])
+        self.assertNotIn('explanation', quiz)
+        self.assertEqual(quiz.get('explanation', ''), '')
+        self.assertEqual(list(quiz), ['type', 'question', 'options', 'answer', 'tags'])
+
+    def test_tags_and_options_are_shared(self):
+        first = make_item({'type': 'quiz', 'question': '1?', 'options': {'A': 'True', 'B': 'False'}, 'answer': 'A',
+                           'tags': ['math']})
+        second = make_item({'type': 'quiz', 'question': '2?', 'options': {'A': 'True', 'B': 'False'}, 'answer': 'B',
+                            'tags': ['Math']})
+        self.assertIs(first.tags.normalized, second.tags.normalized)
+        self.assertIs(first.options, second.options)
+
+    def test_tags_keep_their_order(self):
+        tags = make_item({'type': 'flashcard', 'fact': 'Hola', 'answer': 'Hello',
+                          'tags': ['Spanish', ' ', 'Greetings', 'spanish', 'A1']})['tags']
+        self.assertEqual(tags, ('Spanish', 'Greetings', 'A1'))
+        self.assertEqual(tags.normalized, {'spanish', 'greetings', 'a1'})
+        self.assertTrue(compile_expression("greetings AND NOT b1")(tags))
+        store = QuizStore()
+        store['hola'] = {'type': 'flashcard', 'fact': 'Hola', 'answer': 'Hello', 'tags': tags}
+        self.assertEqual(store['hola']['tags'], tags)
+        store.close()
+
+    def test_setitem(self):
+        flashcard = make_item({'type': 'flashcard', 'fact': 'Bonjour', 'answer': 'Hello'})
+        self.assertNotIn('tags', flashcard)
+        flashcard['tags'] = ['French']
+        self.assertEqual(flashcard['tags'], ('French',))
+        with self.assertRaises(KeyError):
+            flashcard['options'] = {}
+
+
+class TestSplitBlocks(unittest.TestCase):
+
+    def test_blocks(self):
+        content = "\nQ: a\nO:\nA. x\nA: A\nEND\n\nF: b\nA: c\nEND\n"
+        self.assertEqual(split_blocks(content), ["\nQ: a\nO:\nA. x\nA: A\nEND\n\n", "F: b\nA: c\nEND\n"])
+        self.assertEqual(split_blocks("A: x\nF: b\nA: c\nEND"), ["A: x\n", "F: b\nA: c\nEND"])
+        self.assertEqual(split_blocks("  \n"), [])
+
+    def test_parsing_blocks_is_like_parsing_the_content(self):
+        lines = ["Q: q", "F: f", "O:", "A. x", "B. y", "A: A", "A: z", "E: e", "T: t", "END", "", "X: j"]
+        rng = random.Random(0)
+        for _ in range(2000):
+            content = "\n".join(rng.choice(lines) for _ in range(rng.randint(1, 14)))
+            items, error_code = parse_quiz_and_flashcards(content, stable_ids=True)
+            block_items, block_error_code = {}, 0
+            for block in split_blocks(content):
+                items_of_block, block_error_code = parse_quiz_and_flashcards(block, stable_ids=True)
+                if block_error_code:
+                    break
+                block_items |= items_of_block
+            if error_code == 8:  # Empty content has no block
+                error_code = 0
+            self.assertEqual(block_error_code, error_code, content)
+            if not error_code:
+                self.assertEqual(block_items, items)
+
+
+class TestStableIds(unittest.TestCase):
+    content = """
+Q: What is the capital of France?
+O:
+A. Paris
+B. London
+A: A
+END
+F: Bonjour
+A: Hello
+T: french
+END
+F: Bonjour
+A: Hello
+T: language
+END
+"""
+
+    def test_keys_are_stable(self):
+        first, _ = parse_quiz_and_flashcards(self.content, stable_ids=True)
+        second, _ = parse_quiz_and_flashcards(self.content, stable_ids=True)
+        self.assertEqual(list(first), list(second))
+        self.assertEqual(list(first), [item_key(item) for item in first.values()])
+
+    def test_duplicates_collapse(self):
+        items, error_code = parse_quiz_and_flashcards(self.content, stable_ids=True)
+        self.assertEqual(error_code, 0)
+        self.assertEqual(len(items), 2)
+        self.assertEqual(list(items.values())[1]['tags'], ('language',))  # The last duplicate wins
+
+    def test_random_keys_by_default(self):
+        first, _ = parse_quiz_and_flashcards(self.content)
+        second, _ = parse_quiz_and_flashcards(self.content)
+        self.assertEqual(len(first), 3)
+        self.assertFalse(first.keys() & second.keys())
+
+
+class TestCompileExpression(unittest.TestCase):
+
+    def test_operators_are_whole_words(self):
+        self.assertEqual(tokenize_expression("history or notation"), ['history', 'OR', 'notation'])
+        self.assertEqual(tokenize_expression("a&&b|c"), ['a', 'AND', 'b', 'OR', 'c'])
+
+    def test_evaluation(self):
+        matches = compile_expression("(Geography OR history) AND NOT capitals")
+        self.assertTrue(matches(['History']))
+        self.assertFalse(matches(['geography', 'capitals']))
+        self.assertFalse(matches([]))
+        self.assertTrue(parse_expression("", ['anything']))
+
+    def test_compiled_expressions_are_cached(self):
+        self.assertIs(compile_expression("a and b"), compile_expression("a and b"))
+
+    def test_malformed_expression(self):
+        for expression in ("a and", "(a or b", "a b"):
+            with self.assertRaises(ValueError):
+                compile_expression(expression)
+
+
+class TestTagIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.items = {
+            'a': {'type': 'quiz', 'tags': ['Geography', 'capitals']},
+            'b': {'type': 'quiz', 'tags': ['history']},
+            'c': {'type': 'quiz'},
+            'd': {'type': 'flashcard', 'tags': ['geography']},
+        }
+        self.index = TagIndex.from_items(self.items)
+
+    def test_query_matches_parse_expression(self):
+        for expression in ("geography", "NOT capitals", "geography OR history", "NOT geography AND NOT history",
+                           "NOT (geography AND capitals)", "history OR NOT capitals", "", "unknown"):
+            expected = {key for key, item in self.items.items()
+                        if item['type'] == 'quiz' and parse_expression(expression, item.get('tags', []))}
+            self.assertEqual(self.index.query(expression, 'quiz'), expected, expression)
+
+    def test_types_are_indexed_separately(self):
+        self.assertEqual(self.index.query("geography", 'flashcard'), {'d'})
+
+    def test_remove_and_add(self):
+        self.index.remove('b', self.items['b'])
+        self.index.add('b', {'type': 'quiz', 'tags': ['geography']})
+        self.assertEqual(self.index.query("geography", 'quiz'), {'a', 'b'})
+        self.assertNotIn('history', self.index.tags('quiz'))
+
+
+@unittest.skipUnless(TagMatrix.available, "NumPy is not installed")
+class TestTagMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.items = {str(i): {'type': 'quiz' if i % 3 else 'flashcard',
+                               'tags': [tag for tag in ('even', 'five', 'seven')
+                                        if i % {'even': 2, 'five': 5, 'seven': 7}[tag] == 0]}
+                      for i in range(30)}
+        self.matrix = TagMatrix.from_items(self.items)
+
+    def test_matching_keys_matches_parse_expression(self):
+        for expression in ("even", "NOT five", "even AND NOT (five OR seven)", "unknown", ""):
+            expected = [key for key, item in self.items.items()
+                        if item['type'] == 'quiz' and parse_expression(expression, item['tags'])]
+            self.assertEqual(self.matrix.matching_keys(expression, 'quiz'), expected, expression)
+
+    def test_evaluate_postfix(self):
+        mask = self.matrix.evaluate_postfix(compile_expression("five OR seven").postfix)
+        self.assertEqual(list(mask), [parse_expression("five OR seven", item['tags']) for item in self.items.values()])
+
+    def test_statistics(self):
+        self.assertEqual(self.matrix.tag_counts(), {'even': 15, 'five': 6, 'seven': 5})
+        cooccurrence = self.matrix.cooccurrence(['even', 'five'])
+        self.assertEqual(cooccurrence.tolist(), [[15, 3], [3, 6]])
+
+
+class TestImportCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, "cache.pickle")
+        self.quiz_path = os.path.join(self.directory.name, "quiz.qz")
+        self.write("F: Bonjour\nA: Hello\nEND\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, content, mtime_ns=None):
+        with open(self.quiz_path, "w") as file:
+            file.write(content)
+        if mtime_ns is not None:
+            os.utime(self.quiz_path, ns=(mtime_ns, mtime_ns))
+
+    def test_round_trip(self):
+        cache = ImportCache(self.cache_path)
+        cache.store(self.quiz_path, os.stat(self.quiz_path), {'key': {'type': 'flashcard'}}, 0)
+        cache.save()
+        cache = ImportCache(self.cache_path)
+        self.assertEqual(cache.lookup(self.quiz_path, os.stat(self.quiz_path)), ({'key': {'type': 'flashcard'}}, 0))
+        cache.prune([])
+        self.assertIsNone(cache.lookup(self.quiz_path, os.stat(self.quiz_path)))
+
+    def test_modified_files_are_invalidated(self):
+        cache = ImportCache(self.cache_path)
+        cache.store(self.quiz_path, os.stat(self.quiz_path), {}, 0)
+        self.write("F: Bonjour\nA: Hello\nEND\n", mtime_ns=10 ** 18)  # Touched only
+        self.assertEqual(cache.lookup(self.quiz_path, os.stat(self.quiz_path)), ({}, 0))
+        self.write("F: Bonjour\nA: Salut\nEND\n", mtime_ns=2 * 10 ** 18)  # Same size, new content
+        self.assertIsNone(cache.lookup(self.quiz_path, os.stat(self.quiz_path)))
+
+
+class TestImportFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.directory.name, "quizzes")
+        self.paths = generate_corpus(self.folder, 300, files=6)
+        with open(self.paths[0]) as source, open(os.path.join(self.folder, "copy.qz"), "w") as copy:
+            copy.write(source.read())  # Same keys as another file
+        with open(os.path.join(self.folder, "broken.qz"), "w") as file:
+            file.write("Q: Unfinished\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_parallel_matches_serial(self):
+        serial, serial_errors, serial_success = import_files(self.folder, workers=1)
+        parallel, parallel_errors, parallel_success = import_files(self.folder, workers=2)
+        self.assertEqual(list(parallel), list(serial))
+        self.assertEqual({key: dict(item) for key, item in parallel.items()},
+                         {key: dict(item) for key, item in serial.items()})
+        self.assertEqual((parallel_errors, parallel_success), (serial_errors, serial_success))
+        self.assertEqual((len(serial_errors), serial_success), (1, 7))
+
+    def test_cache(self):
+        cache_path = os.path.join(self.directory.name, "cache.pickle")
+        expected = import_files(self.folder, workers=1)
+        self.assertEqual(import_files(self.folder, workers=1, cache=ImportCache(cache_path)), expected)
+        parse = mock.Mock(wraps=parse_quiz_and_flashcards_file)
+        with mock.patch('library.parse_quiz_and_flashcards_file', parse):
+            self.assertEqual(import_files(self.folder, workers=1, cache=ImportCache(cache_path)), expected)
+            self.assertEqual(parse.call_count, 0)  # Warm start
+
+            with open(self.paths[1], "a") as file:
+                file.write("F: Added\nA: Card\nEND\n")
+            os.remove(self.paths[2])
+            items, errors, nb_success = import_files(self.folder, workers=1, cache=ImportCache(cache_path))
+            self.assertEqual([call.args[0] for call in parse.call_args_list], [self.paths[1]])
+        self.assertEqual(import_files(self.folder, workers=1), (items, errors, nb_success))
+        self.assertEqual(nb_success, 6)
+        self.assertIn("Added", [item.get('fact') for item in items.values()])
+
+        with open(cache_path, "wb") as file:  # Refers to a class that does not exist
+            file.write(b"\x80\x04\x8c\x07nowhere\x94\x8c\x01X\x94\x93\x94.")
+        self.assertEqual(import_files(self.folder, workers=1, cache=ImportCache(cache_path)), (items, errors, 6))
+
+
+class TestQuizStore(unittest.TestCase):
+    content = """
+Q: What is the capital of France?
+O:
+A. Paris
+B. London
+A: A
+E: Paris is the capital of France.
+T: Geography, capitals
+END
+F: Bonjour
+A: Hello
+T: language, french
+END
+Q: 2 + 2 = ?
+O:
+A. 4
+B. 5
+A: A
+END
+"""
+
+    def setUp(self):
+        self.items, _ = parse_quiz_and_flashcards(self.content, stable_ids=True)
+        self.store = QuizStore()
+        self.store |= self.items
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_round_trip(self):
+        self.assertEqual(dict(self.store.items()), self.items)
+        self.assertEqual(list(self.store), list(self.items))
+
+    def test_query(self):
+        for expression in ("geography", "NOT capitals", "french OR geography", "NOT (geography OR math)", ""):
+            expected = {key for key, item in self.items.items()
+                        if item['type'] == 'quiz' and parse_expression(expression, item.get('tags', []))}
+            self.assertEqual(self.store.query(expression, 'quiz'), expected, expression)
+        self.assertEqual(self.store.tags('flashcard'), ['french', 'language'])
+
+    def test_add_missing_keeps_edits(self):
+        key = next(iter(self.items))
+        edited = dict(self.items[key], tags=['History'])
+        self.store[key] = edited
+        self.assertEqual(self.store.add_missing(self.items), 0)
+        self.assertEqual(self.store[key]['tags'], ('History',))
+        self.assertEqual(self.store.query("history"), {key})
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bank.db")
+            store = QuizStore(path)
+            store.update(self.items)
+            store.close()
+            store = QuizStore(path)
+            self.assertEqual(dict(store.items()), self.items)
+            del store[next(iter(self.items))]
+            self.assertEqual(len(store), 2)
+            store.close()
+
+    def test_load_library_follows_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            folder = os.path.join(directory, "quizzes")
+            os.mkdir(folder)
+            paths = [os.path.join(folder, f"{n}.txt") for n in range(2)]
+            for path, question in zip(paths, ("What is the capital of Spain?", "3 + 3 = ?")):
+                with open(path, "w", encoding="utf-8") as file:
+                    file.write(f"Q: {question}\nO:\nA. Yes\nB. No\nA: A\nEND\nF: Fact of {path}\nA: True\nEND\n")
+            database_path = os.path.join(directory, "bank.db")
+            bank_path = os.path.join(directory, "bank.qzb")
+            self.assertEqual(load_library(database_path, folder, bank_path=bank_path), ([], 2))
+            store = QuizStore(database_path)
+            self.assertEqual(len(store), 4)
+            edited = next(key for key, item in store.items() if item.get('fact') == f"Fact of {paths[0]}")
+            store[edited] = dict(store[edited], answer="Edited in the app")
+            store.close()
+
+            os.remove(paths[0])
+            with open(paths[1], "r+", encoding="utf-8") as file:
+                content = file.read().replace("3 + 3", "3 + 4")
+                file.seek(0)
+                file.write(content)
+            self.assertEqual(load_library(database_path, folder, bank_path=bank_path), ([], 1))
+            store = QuizStore(database_path)
+            self.assertEqual(sorted(item.get('question', item.get('fact')) for item in store.values()),
+                             ["3 + 4 = ?", f"Fact of {paths[0]}", f"Fact of {paths[1]}"])
+            self.assertEqual(store[edited]['answer'], "Edited in the app")
+            store.close()
+
+            with mock.patch.object(QuizStore, 'import_items', autospec=True,
+                                   side_effect=QuizStore.import_items) as import_items:
+                load_library(database_path, folder, bank_path=bank_path)  # Nothing changed, nothing to merge
+                self.assertEqual(import_items.call_count, 0)
+                os.remove(paths[1])
+                load_library(database_path, folder, bank_path=bank_path)
+                self.assertEqual(import_items.call_count, 1)
+            store = QuizStore(database_path)
+            self.assertEqual(list(store), [edited])
+            store.close()
+
+
+class TestBankLayout(unittest.TestCase):
+
+    @staticmethod
+    def fresh_rows(widths, max_width):
+        layout = RowLayout()
+        layout.update(widths, max_width)
+        return layout.rows
+
+    def test_rows(self):
+        self.assertEqual(self.fresh_rows([30, 30, 50, 10, 80, 10], 70), [0, 2, 4, 5])
+
+    def test_incremental_updates_match_a_fresh_layout(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            widths = [rng.randint(1, 50) for _ in range(rng.randint(0, 30))]
+            max_width = rng.randint(10, 120)
+            layout = RowLayout()
+            layout.update(widths, max_width)
+            for _ in range(5):
+                old_rows = list(layout.rows)
+                if rng.random() < 0.5:
+                    max_width = rng.randint(10, 120)
+                    first_row = layout.update(max_width=max_width)
+                else:
+                    widths = widths + [rng.randint(1, 50)]
+                    widths[rng.randrange(len(widths))] = rng.randint(1, 50)
+                    first_row = layout.update(widths)
+                expected = self.fresh_rows(widths, max_width)
+                self.assertEqual(layout.rows, expected)
+                self.assertEqual(old_rows[:first_row], expected[:first_row])
+
+    def test_measure_cache(self):
+        measured = []
+
+        class FakeFont:
+            def __init__(self, size):
+                self.size = size
+
+            def measure(self, text):
+                measured.append(text)
+                return len(text) * self.size
+
+        cache = MeasureCache(lambda font_spec: FakeFont(font_spec[1]))
+        self.assertEqual(cache.measure(("Arial", 2), "abc"), 6)
+        self.assertEqual(cache.measure(("Arial", 2), "abc"), 6)
+        self.assertEqual(cache.measure(("Arial", 3), "abc"), 9)
+        self.assertEqual(measured, ["abc", "abc"])
+
+
+class TestLazyBank(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "bank.qz")
+        with open(self.path, "w") as file:
+            for i in range(50):
+                file.write(f"Q: Question {i}?\nO:\nA. Yes\nB. No\nA: A\nE: Because {i}.\nT: Even, Level{i % 5}\nEND\n\n"
+                           if i % 2 == 0 else f"F: Fact {i}\nA: Answer {i}\nT: Odd\nEND\n")
+        self.bank = LazyBank(budget=500, stable_ids=True)
+        self.assertEqual(self.bank.add_file(self.path), 0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_same_items_as_parser(self):
+        items, _ = parse_quiz_and_flashcards_file(self.path, stable_ids=True)
+        self.assertEqual(list(self.bank), list(items))
+        for key, item in items.items():
+            self.assertEqual(dict(self.bank[key]), dict(item))
+        self.assertEqual(self.bank.texts()[1], (list(items)[1], 'flashcard', "Fact 1"))
+
+    def test_cache_budget(self):
+        for key in self.bank:
+            self.bank[key]
+        self.assertLessEqual(self.bank.cache.used, 500)
+        self.assertLess(len(self.bank.cache), len(self.bank))
+
+    def test_queries_and_edits(self):
+        self.assertEqual(len(self.bank.query("even AND level1", 'quiz')), 5)
+        self.assertEqual(list(self.bank.iter_query("level1 OR level2", 'quiz')),
+                         [key for key in self.bank if key in self.bank.query("level1 OR level2", 'quiz')])
+        key = next(iter(self.bank.query("level1", 'quiz')))
+        item = self.bank[key]
+        item['tags'] = ["Edited"]
+        self.bank[key] = item
+        self.assertEqual(self.bank.query("edited", 'quiz'), {key})
+        for expression in ("edited", "NOT level1", ""):
+            self.assertEqual(list(self.bank.iter_query(expression, 'quiz')),
+                             [key for key in self.bank if key in self.bank.query(expression, 'quiz')])
+        with self.assertRaises(ValueError):
+            self.bank.iter_query("level1 AND", 'quiz')
+        self.assertEqual(len(self.bank.query("level1", 'quiz')), 4)
+        self.assertEqual(self.bank.tags('flashcard'), ['odd'])
+        self.assertEqual(self.bank.tags('quiz', "level2"), ['even', 'level2'])
+
+    def test_file_with_error(self):
+        path = os.path.join(self.directory.name, "broken.qz")
+        with open(path, "w") as file:
+            file.write("F: Valid fact\nA: Answer\nEND\nQ: Unfinished\n")
+        self.assertNotEqual(self.bank.add_file(path), 0)
+        self.assertEqual(len(self.bank), 50)  # Like import_files, none of its items are added
+
+
+class TestBankFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = []
+        for n in range(3):
+            path = os.path.join(self.directory.name, f"{n}.qz")
+            with open(path, "w", encoding="utf-8") as file:
+                for i in range(20):
+                    file.write(f"Q: Quelle est la réponse {i}?\nO:\nA. Oui\nB. Non\nA: B\nT: File{n}, Q{i % 3}\nEND\n"
+                               if i % 4 else f"F: Fact {i}\nA: Answer\nE: Shared by all files.\nT: Q{i % 3}\nEND\n")
+            self.paths.append(path)
+        with open(self.paths[2], "a") as file:
+            file.write("Q: Unfinished\n")
+        self.bank_path = os.path.join(self.directory.name, "bank.qzb")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        self.assertEqual(compile_bank(self.paths, self.bank_path), [(self.paths[2], 2)])
+        items = {}
+        for path in self.paths[:2]:
+            items.update(parse_quiz_and_flashcards_file(path, stable_ids=True)[0])
+        bank = BankFile(self.bank_path)
+        self.assertEqual(list(bank), list(items))
+        self.assertEqual({key: dict(item) for key, item in bank.items()},
+                         {key: dict(item) for key, item in items.items()})
+        self.assertNotIn("missing", bank)
+
+        index = TagIndex.from_items(items)
+        for expression in ("", "file0", "q1 OR NOT file1", "NOT q2", "unknown"):
+            for item_type in ('quiz', 'flashcard'):
+                self.assertEqual(bank.query(expression, item_type), index.query(expression, item_type))
+        self.assertEqual(bank.tags('flashcard'), ['q0', 'q1', 'q2'])
+        self.assertEqual(bank.tags('quiz', "file1 AND q1"), ['file1', 'q1'])
+        sources = {}
+        for path in self.paths[:2]:
+            sources.update(dict.fromkeys(parse_quiz_and_flashcards_file(path, stable_ids=True)[0], path))
+        self.assertEqual(bank.sources(), sources)
+        self.assertEqual(bank.source_at(bank.index_of(next(iter(items)))), sources[next(iter(items))])
+        bank.close()
+
+    def test_freshness(self):
+        compile_bank(self.paths, self.bank_path)
+        bank = open_fresh_bank(self.bank_path, self.paths, True)
+        self.assertIsNotNone(bank)
+        bank.close()
+        self.assertIsNone(open_fresh_bank(self.bank_path, self.paths, False))
+        self.assertIsNone(open_fresh_bank(self.bank_path, self.paths[:2], True))
+        with open(self.paths[0], "a") as file:
+            file.write("F: New\nA: Card\nEND\n")
+        self.assertIsNone(open_fresh_bank(self.bank_path, self.paths, True))
+        self.assertIsNone(open_fresh_bank(self.paths[0], self.paths, True))  # Not a bank file
+
+    def test_damaged_bank(self):
+        compile_bank(self.paths, self.bank_path)
+        with open(self.bank_path, "rb") as file:
+            content = file.read()
+        for length in range(0, len(content), 7):
+            with open(self.bank_path, "wb") as file:
+                file.write(content[:length])
+            self.assertIsNone(open_fresh_bank(self.bank_path, self.paths, True), length)
+        with open(self.bank_path, "wb") as file:  # Sections out of order
+            file.write(content[:12] + bytes(reversed(content[12:80])) + content[80:])
+        self.assertIsNone(open_fresh_bank(self.bank_path, self.paths, True))
+        os.remove(self.bank_path)  # The damaged bank was closed
+
+
+class TestSampling(unittest.TestCase):
+
+    def test_reservoir_sample(self):
+        self.assertEqual(reservoir_sample(range(100_000), 10, make_rng(1)),
+                         reservoir_sample(range(100_000), 10, make_rng(1)))
+        self.assertEqual(sorted(reservoir_sample(range(5), 10)), [0, 1, 2, 3, 4])
+        # Sequences are sampled by position, with the same draw as when streamed
+        self.assertEqual(reservoir_sample([str(i) for i in range(1000)], 10, make_rng(3)),
+                         reservoir_sample((str(i) for i in range(1000)), 10, make_rng(3)))
+        sample = reservoir_sample(iter(range(100_000)), 50)
+        self.assertEqual(len(set(sample)), 50)
+        # Every element is about as likely to be drawn
+        counts = [0] * 20
+        rng = make_rng(2)
+        for _ in range(4000):
+            for element in reservoir_sample(range(20), 5, rng):
+                counts[element] += 1
+        self.assertTrue(all(850 < count < 1150 for count in counts), counts)
+
+    def test_weighted_sample(self):
+        rng = make_rng(3)
+        heavy = sum(weighted_sample([(0, 9), (1, 1)], 1, rng)[0] == 0 for _ in range(2000))
+        self.assertTrue(1700 < heavy < 1900, heavy)
+        self.assertEqual(weighted_sample([(0, 0), (1, 1)], 2, rng), [1])
+
+    def test_stratified_sample(self):
+        strata = {'big': range(1000), 'small': range(1000, 1003), 'shared': [0, 1000, 2000]}
+        sample = stratified_sample(strata, 9, make_rng(4))
+        self.assertEqual(len(sample), len(set(sample)))
+        self.assertEqual(len(sample), 9)
+        self.assertTrue({1000, 1001, 1002} <= set(sample))
+        self.assertIn(2000, sample)
+
+    def test_history_weights(self):
+        history = {}
+        record_answer(history, 'missed', False, now=0)
+        record_answer(history, 'known', True, now=1000)
+        errors = error_rate_weight(history)
+        self.assertGreater(errors('missed'), errors('new'))
+        self.assertGreater(errors('new'), errors('known'))
+        recency = recency_weight(history, now=1000, half_life=1000)
+        self.assertEqual(recency('new'), 1)
+        self.assertAlmostEqual(recency('missed'), 0.5)
+        self.assertLess(recency('known'), 0.01)
+
+    def test_stratified_draws(self):
+        def quiz(*tags):
+            return {'type': 'quiz', 'question': "?", 'options': {'A': "Yes", 'B': "No"}, 'answer': 'A',
+                    'tags': list(tags)}
+
+        store = QuizStore()
+        store.update({'u1': quiz(), 'u2': quiz()})
+        self.assertEqual(sorted(draw_questions(store, "", 5, 'stratified', make_rng(0))), ['u1', 'u2'])
+        store.update({'a1': quiz("a", "x"), 'a2': quiz("a", "y"), 'b1': quiz("b", "z")})
+        self.assertEqual(store.tags('quiz', "a"), ['a', 'x', 'y'])
+        self.assertEqual(store.tags('quiz', "NOT a"), ['b', 'z'])
+        # The untagged questions make a stratum of their own
+        self.assertEqual(sorted(draw_questions(store, "", 5, 'stratified', make_rng(1))),
+                         ['a1', 'a2', 'b1', 'u1', 'u2'])
+        self.assertEqual(sorted(draw_questions(store, "a", 5, 'stratified', make_rng(2))), ['a1', 'a2'])
+        self.assertEqual(draw_questions(store, "missing", 5, 'stratified', make_rng(3)), [])
+        store.close()
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_sm2_intervals(self):
+        state = CardState('card', 0)
+        intervals = []
+        for grade in (4, 4, 4, 1, 5):
+            sm2_update(state, grade, 0)
+            intervals.append(state.interval)
+        self.assertEqual(intervals, [1, 6, 15, 0, 1])
+        self.assertEqual(state.due, DAY)
+        self.assertEqual(state.lapses, 1)
+        self.assertGreaterEqual(state.ease, 1.3)
+
+    def test_due_order(self):
+        scheduler = Scheduler([CardState(f"card{i}", i) for i in range(10, 0, -1)])
+        self.assertEqual(scheduler.next_due(now=5).key, 'card1')
+        self.assertIsNone(scheduler.next_due(now=0))
+        for _ in range(4):
+            scheduler.review(scheduler.next_due(now=5).key, 1, now=5)  # Comes back after AGAIN_DELAY
+        self.assertEqual(scheduler.next_due(now=5).key, 'card5')
+        scheduler.remove('card5')
+        self.assertEqual(scheduler.next_due_time(), 6)
+        self.assertEqual(scheduler.next_due(now=5 + AGAIN_DELAY).key, 'card6')
+        self.assertEqual(len(scheduler), 9)
+
+    def test_store(self):
+        store = ScheduleStore()
+        scheduler = Scheduler()
+        store.save(scheduler.add('a', now=0))
+        store.save(scheduler.review('a', 5, now=0))
+        store.save(scheduler.add('b', now=0))
+        store.delete('b')
+        self.assertEqual([state.as_tuple() for state in store.load()], [scheduler['a'].as_tuple()])
+        store.close()
+
+    def test_new_cards(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bank.db")
+            bank = QuizStore(path)
+            bank.update({f"card{i}": {'type': 'flashcard', 'fact': f"Fact {i}", 'answer': "Yes"} for i in range(5)})
+            bank['quiz'] = {'type': 'quiz', 'question': "?", 'options': {'A': "Yes"}, 'answer': 'A'}
+            store = ScheduleStore(path)
+            scheduler = Scheduler()
+            for key in ('card0', 'card2'):
+                store.save(scheduler.add(key, now=0))
+            self.assertEqual(store.new_cards(2), ['card1', 'card3'])
+            self.assertEqual(store.new_cards(10), ['card1', 'card3', 'card4'])
+            store.close()
+            bank.close()
+
+
+class TestQuizSession(unittest.TestCase):
+
+    def setUp(self):
+        self.questions = [make_item({'type': 'quiz', 'question': f"Question {i}?",
+                                     'options': {'A': "One", 'B': "Two", 'C': "Three"}, 'answer': 'B'})
+                          for i in range(4)]
+
+    def test_progression_and_grade(self):
+        answers = []
+        session = QuizSession(self.questions, ['a', 'b', 'c', 'd'],
+                              on_answer=lambda key, correct: answers.append((key, correct)))
+        self.assertFalse(session.next_question())  # Not answered yet
+        for label in ('B', 'A', 'B', 'B'):
+            self.assertEqual(session.answer(label), label == 'B')
+            self.assertEqual(session.answer('B'), label == 'B')  # Only the first answer counts
+            session.next_question()
+        self.assertTrue(session.finished)
+        self.assertEqual(session.grade, 15)
+        self.assertEqual(answers, [('a', True), ('b', False), ('c', True), ('d', True)])
+
+    def test_hints_and_timer(self):
+        session = QuizSession(self.questions, hints=1, time_limit=2, rng=random.Random(0))
+        self.assertTrue(session.use_hint())
+        self.assertEqual(len(session.options), 2)
+        self.assertIn(('B', "Two"), session.options)
+        self.assertFalse(session.use_hint())
+        self.assertFalse(session.tick())
+        self.assertTrue(session.tick())
+        self.assertTrue(session.answered)
+        self.assertFalse(session.last_answer_correct)
+        session.next_question()
+        self.assertEqual(session.time_left, 2)
+        self.assertFalse(session.can_use_hint())
+
+    def test_simulate(self):
+        bank = QuizStore()
+        bank.update({str(i): dict(self.questions[0], tags=[f"t{i % 3}"]) for i in range(30)})
+        stats = simulate(bank, sessions=20, questions=5, expression="t1 OR t2", skill=1)
+        self.assertEqual(stats['answers'], 100)
+        self.assertEqual(stats['mean_grade'], 20)
+        bank.close()
+
+
+class TestBenchmarkCorpus(unittest.TestCase):
+
+    def test_generate_items(self):
+        content = generate_items(200, tags=10, options=3, flashcard_share=0.5, seed=1)
+        self.assertEqual(content, generate_items(200, tags=10, options=3, flashcard_share=0.5, seed=1))
+        items, error_code = parse_quiz_and_flashcards(content, True)
+        self.assertEqual(error_code, 0)
+        self.assertEqual(len(items), 200)
+        self.assertTrue(all(len(item['options']) == 3 for item in items.values() if item.type == 'quiz'))
+        self.assertLessEqual(len(TagIndex.from_items(items).tags('quiz')), 10)
+
+    def test_generate_corpus(self):
+        with tempfile.TemporaryDirectory() as folder:
+            paths = generate_corpus(folder, 95, files=10)
+            self.assertEqual(len({os.path.dirname(path) for path in paths}), 10)
+            self.assertEqual(sum(len(parse_quiz_and_flashcards_file(path)[0]) for path in paths), 95)
+
+
+class TestBackgroundTask(unittest.TestCase):
+
+    def run_task(self, function, **callbacks):
+        # Stand-in for the Tk event loop: scheduled polls are run in order until none is left
+        pending = []
+        task = BackgroundTask(lambda delay, callback: pending.append(callback), function, poll_interval=0,
+                              **callbacks)
+        task.start()
+        while pending:
+            pending.pop(0)()
+        return task
+
+    def test_result_and_progress(self):
+        done, progress = [], []
+        content = "Q: Question?\nA: Answer\nEND\n" * 1000
+        task = self.run_task(lambda task: sum(1 for _ in track_lines(io.StringIO(content), len(content), task)),
+                             on_done=done.append, on_progress=progress.append)
+        self.assertTrue(task.finished)
+        self.assertEqual(done, [3000])
+        self.assertTrue(all(0 < value <= 1 for value in progress))
+
+    def test_error(self):
+        errors = []
+        self.run_task(lambda task: 1 / 0, on_error=errors.append)
+        self.assertIsInstance(errors[0], ZeroDivisionError)
+
+    def test_cancel(self):
+        started, release, done = threading.Event(), threading.Event(), []
+
+        def work(task):
+            started.set()
+            release.wait()
+            task.check()
+            return "stale"
+
+        task = BackgroundTask(lambda delay, callback: None, work, on_done=done.append)
+        task.start()
+        started.wait()
+        task.cancel()
+        release.set()
+        task.thread.join()
+        task.poll()
+        self.assertEqual(done, [])
+        self.assertEqual(task.messages.get_nowait(), ('cancelled', None))
+
+
+class TestQueryPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.statistics = TagStatistics.from_counts({'common': 900, 'rare': 5, 'medium': 200, 'everywhere': 1000}, 1000)
+        self.items = {f"k{i}": {'type': 'quiz', 'question': f"Q{i}", 'options': {'A': "a"}, 'answer': 'A',
+                                'tags': [f"Tag{i % 3}"] + (["Rare"] if i % 10 == 0 else []) + ["All"]}
+                      for i in range(60)}
+
+    def test_and_most_selective_first(self):
+        self.assertEqual(plan("common AND medium AND rare", self.statistics).postfix,
+                         ('rare', 'medium', 'AND', 'common', 'AND'))
+
+    def test_or_most_likely_first(self):
+        self.assertEqual(plan("rare OR common", self.statistics).postfix, ('common', 'rare', 'OR'))
+
+    def test_not_pushed_down(self):
+        # NOT (rare OR common) == NOT common AND NOT rare, the rarer complement first
+        self.assertEqual(plan("NOT (rare OR common)", self.statistics).postfix,
+                         ('common', 'NOT', 'rare', 'NOT', 'AND'))
+        self.assertEqual(plan("NOT NOT rare", self.statistics).postfix, ('rare',))
+
+    def test_constant_folding(self):
+        self.assertEqual(plan("rare AND (unknown OR medium)", self.statistics).postfix,
+                         ('rare', 'medium', 'AND'))
+        self.assertIs(plan("rare AND unknown", self.statistics).constant, False)
+        self.assertIs(plan("NOT unknown OR rare", self.statistics).constant, True)
+        self.assertEqual(plan("everywhere AND rare", self.statistics).postfix, ('rare',))
+        self.assertIn("Folded: unknown is carried by no item", plan("rare AND unknown", self.statistics).explain())
+
+    def test_explain_order(self):
+        lines = plan("common AND NOT medium AND rare", self.statistics).explain().splitlines()
+        self.assertEqual([line.split()[0:2] for line in lines[3:]],
+                         [['AND', '~4'], ['rare', '~5'], ['NOT', 'medium'], ['common', '~900']])
+
+    def test_banks_match_unplanned_evaluation(self):
+        store = QuizStore()
+        store.update(self.items)
+        index = TagIndex.from_items(self.items)
+        for expression in ("tag1 AND NOT rare", "NOT (tag0 OR missing)", "all AND (tag2 OR rare)",
+                           "NOT all", "missing OR NOT tag1 AND NOT tag2", ""):
+            expected = {key for key, item in self.items.items() if compile_expression(expression)(item['tags'])}
+            self.assertEqual(index.query(expression), expected, expression)
+            self.assertEqual(store.query(expression), expected, expression)
+        store.close()
+
+    def test_store_statistics_follow_writes(self):
+        store = QuizStore()
+        store.update(self.items)
+        self.assertEqual(store.statistics().frequency('rare'), 6)
+        del store['k0']
+        self.assertEqual(store.statistics().frequency('rare'), 5)
+        self.assertEqual(store.query("rare"), {f"k{i}" for i in range(10, 60, 10)})
+        store.close()
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.items = {
+            'capital': {'type': 'quiz', 'question': "What is the capital of France?",
+                        'options': {'A': "Paris", 'B': "Lyon"}, 'answer': 'A', 'explanation': "Paris is the capital."},
+            'capitals': {'type': 'quiz', 'question': "Which capitals are on the Danube?",
+                         'options': {'A': "Vienna and Budapest", 'B': "Rome"}, 'answer': 'A'},
+            'river': {'type': 'quiz', 'question': "Which river flows through Paris?",
+                      'options': {'A': "Seine", 'B': "Loire"}, 'answer': 'A'},
+            'fact': {'type': 'flashcard', 'fact': "Paris hosted the Olympics in 2024", 'answer': "Yes"},
+        }
+        self.index = SearchIndex.from_items(self.items)
+
+    def test_ranking(self):
+        # "paris" is repeated in the text of the first item, then shorter texts rank higher
+        self.assertEqual([key for key, _ in self.index.search("paris")], ['capital', 'fact', 'river'])
+        self.assertEqual([key for key, _ in self.index.search("paris", limit=1)], ['capital'])
+        self.assertEqual(self.index.search("nothing"), [])
+        self.assertEqual(self.index.search(""), [])
+
+    def test_partial_words(self):
+        # The word itself first, then the words it starts
+        self.assertEqual([key for key, _ in self.index.search("capital")], ['capital', 'capitals'])
+        self.assertEqual(self.index.matches("capit"), {'capital', 'capitals'})
+        self.assertEqual(self.index.matches("anub"), {'capitals'})
+        self.assertEqual(self.index.matches("ca"), set())  # Too short to stand for other words
+
+    def test_every_term_required(self):
+        self.assertEqual(self.index.matches("paris capital"), {'capital'})
+        self.assertEqual(self.index.matches("paris danube"), set())
+        self.assertEqual(self.index.matches("Paris, SEINE?"), {'river'})
+
+    def test_filters(self):
+        self.assertEqual(self.index.matches("paris", 'flashcard'), {'fact'})
+        self.assertEqual(self.index.matches("paris", 'quiz', within={'river', 'fact'}), {'river'})
+
+    def test_edits(self):
+        item = dict(self.items['river'], question="Which river flows through Vienna?")
+        self.index.add('river', item)
+        self.assertEqual(self.index.matches("paris"), {'capital', 'fact'})
+        self.assertEqual(self.index.matches("vienna"), {'capitals', 'river'})
+        self.index.remove('capitals')
+        self.assertEqual(self.index.matches("vienna"), {'river'})
+        self.index.compact()
+        self.assertEqual(len(self.index.keys), 3)
+        self.assertEqual(self.index.matches("vienna"), {'river'})
+        self.assertEqual(self.index.search("paris")[0][0], 'capital')
+        for key in list(self.index.doc_ids):
+            self.index.remove(key)
+        self.assertEqual(self.index.search("paris"), [])
+        self.assertEqual(self.index.matches("paris"), set())
+
+    def test_common_words_ranked_best_first(self):
+        index = SearchIndex()
+        rng = random.Random(0)
+        for i in range(search_index.RANKED_SIZE + 100):
+            index.add_document(f"k{i}", 'quiz' if i % 3 else 'flashcard',
+                               " ".join(["common"] * rng.randint(1, 3) + ["filler"] * rng.randint(0, 8)))
+
+        def scanned(query, item_type=None):
+            terms = index._terms(query)
+            scores = index._scan(terms, index._filter(item_type, None), index.total_length / len(index))
+            return sorted(((index.keys[doc_id], score) for doc_id, score in scores.items()),
+                          key=lambda entry: (-entry[1], index.doc_ids[entry[0]]))[:50]
+
+        self.assertEqual(index.search("common"), scanned("common"))
+        self.assertEqual(index.search("commo", 'flashcard'), scanned("commo", 'flashcard'))
+        # Rankings follow the documents added or edited after they are built
+        index.add_document("k5", 'quiz', "common common common common")
+        index.add_document("new", 'quiz', "common common common common common")
+        self.assertEqual(index.search("common")[:2], scanned("common")[:2])
+        self.assertEqual([key for key, _ in index.search("common", limit=2)], ["new", "k5"])
+        terms = index._terms("common filler")
+        self.assertEqual(index.matches("common filler", 'quiz'),
+                         {index.keys[doc_id] for doc_id in index._scan(terms, index._filter('quiz', None), 1)})
+
+    def test_bank_documents(self):
+        store = QuizStore()
+        store.update(self.items)
+        expected = {key: sorted(search_index.tokenize(search_text(item))) for key, item in self.items.items()}
+        self.assertEqual({key: sorted(search_index.tokenize(text)) for key, _, text in store.documents()}, expected)
+        # The options are joined in their order, as search_text does
+        self.assertEqual(list(store.documents()), [(key, item['type'], search_text(item))
+                                                   for key, item in self.items.items()])
+        store.close()
+
+    def test_draw_within_search(self):
+        store = QuizStore()
+        store.update(self.items)
+        within = self.index.matches("paris", 'quiz')
+        for mode in ('uniform', 'errors'):
+            self.assertEqual(sorted(draw_questions(store, "", 10, mode, make_rng(0), within=within)),
+                             ['capital', 'river'])
+
+
+class TestQuizServer(unittest.TestCase):
+
+    def setUp(self):
+        self.bank = QuizStore()
+        self.bank.update({f"q{i}": {'type': 'quiz', 'question': f"Question {i}?",
+                                    'options': {'A': "One", 'B': "Two", 'C': "Three"}, 'answer': 'B',
+                                    'explanation': "Two it is.", 'tags': [f"t{i % 2}"]} for i in range(20)})
+        self.now = 0.0
+        self.server = QuizServer(self.bank, clock=lambda: self.now)
+
+    def tearDown(self):
+        self.bank.close()
+
+    def call(self, method, target, payload=None):
+        return self.server.handle(method, target, b"" if payload is None else json.dumps(payload).encode())
+
+    def test_session(self):
+        status, state = self.call('POST', '/sessions', {'tags': "t1", 'questions': 3, 'hints': 1, 'seed': 4})
+        self.assertEqual(status, 201)
+        path = f"/sessions/{state['session']}"
+        self.assertEqual(self.call('GET', path + "/question")[1], state)
+        self.assertEqual(int(state['question'].split()[1][:-1]) % 2, 1)
+        self.assertEqual(self.call('POST', path + "/next")[0], 409)  # Not answered yet
+        status, hint = self.call('POST', path + "/hint")
+        self.assertTrue(hint['used'])
+        self.assertEqual(len(hint['options']), 2)
+        for label in ('B', 'A', 'B'):
+            status, result = self.call('POST', path + "/answer", {'answer': label})
+            self.assertEqual(result, {'correct': label == 'B', 'answer': 'B', 'explanation': "Two it is."})
+            self.assertEqual(self.call('POST', path + "/answer", {'answer': 'B'})[0], 409)
+            status, state = self.call('POST', path + "/next")
+        self.assertTrue(state['finished'])
+        status, grade = self.call('POST', path + "/finish")
+        self.assertEqual((grade['good_answers'], grade['hints_used'], grade['grade']), (2, 1, 13.25))
+        self.assertEqual(self.call('GET', path + "/question")[0], 404)
+
+    def test_timer_and_expiry(self):
+        _, state = self.call('POST', '/sessions', {'time_limit': 10})
+        path = f"/sessions/{state['session']}"
+        self.now = 4.5
+        self.assertEqual(self.call('GET', path + "/question")[1]['time_left'], 6)
+        self.now = 11
+        state = self.call('GET', path + "/question")[1]
+        self.assertTrue(state['answered'])
+        self.assertFalse(state['correct'])
+        self.now += 3600.5
+        self.call('POST', '/sessions', {})
+        self.assertEqual(self.call('GET', path + "/question")[0], 404)
+        self.assertEqual(self.call('GET', '/status')[1], {'items': 20, 'sessions': 1})
+
+    def test_bad_requests(self):
+        self.assertEqual(self.server.handle('POST', '/sessions', b"{"), (400, {'error': "The body must be JSON."}))
+        self.assertEqual(self.call('POST', '/sessions', {'tags': "t1 AND"})[0], 400)
+        self.assertEqual(self.call('POST', '/sessions', {'questions': 0})[0], 400)
+        for questions in (2.5, True, "many"):
+            self.assertEqual(self.call('POST', '/sessions', {'questions': questions})[0], 400)
+        self.assertEqual(self.server.handle('POST', '/sessions', b'{"questions": 1e400}')[0], 400)
+        self.assertEqual(self.call('POST', '/sessions', {'questions': 2.0})[0], 201)
+        self.assertEqual(self.call('POST', '/sessions', {'search': "two"})[0], 400)  # No search index
+        self.assertEqual(self.call('POST', '/sessions', {'tags': "unknown"})[0], 404)
+        self.assertEqual(self.call('GET', '/sessions')[0], 405)
+        self.assertEqual(self.call('GET', '/nowhere')[0], 404)
+        self.assertEqual(self.call('GET', '/sessions/missing/question')[0], 404)
+        self.server.bank = None  # A bug answers 500 instead of dropping the connection
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(self.call('GET', '/status'), (500, {'error': "Internal server error."}))
+
+    def test_bad_content_length(self):
+        async def scenario():
+            serving = asyncio.ensure_future(self.server.serve("127.0.0.1", 0))
+            while self.server.server is None:
+                await asyncio.sleep(0.01)
+            port = self.server.server.sockets[0].getsockname()[1]
+            try:
+                statuses = []
+                for length in ("-1", "ten", str(1 << 20)):
+                    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                    writer.write(f"POST /sessions HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode())
+                    statuses.append((await reader.readline()).split()[1])
+                    writer.close()
+                return statuses
+            finally:
+                serving.cancel()
+
+        self.assertEqual(asyncio.run(scenario()), [b"400", b"400", b"413"])
+
+    def test_load_generator(self):
+        with tempfile.TemporaryDirectory() as folder:
+            generate_corpus(folder, 200, files=2)
+            bank, errors, nb_success = load_bank(folder)
+        self.assertEqual((errors, nb_success, len(bank)), ([], 2, 200))
+        server = QuizServer(bank)
+
+        async def scenario():
+            serving = asyncio.ensure_future(server.serve("127.0.0.1", 0))
+            while server.server is None:
+                await asyncio.sleep(0.01)
+            port = server.server.sockets[0].getsockname()[1]
+            try:
+                return await quiz_loadgen.run("127.0.0.1", port, takers=4, duration=0.3,
+                                              quiz={'tags': "tag0 OR tag1", 'questions': 3, 'hints': 1})
+            finally:
+                serving.cancel()
+
+        results = asyncio.run(scenario())
+        bank.close()
+        self.assertEqual(results['errors'], {})
+        self.assertGreater(results['quizzes'], 0)
+        self.assertEqual(results['endpoints_ms']['answer']['requests'], results['endpoints_ms']['question']['requests'])
+
+
+class TestResultsLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "results.qzl")
+        self.now = 1_700_000_000  # 2023-11-14
+        self.forever = float('inf')  # Retention, so closing the logs does not compact these old answers
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fill(self, log):
+        log.record('capital', True, 2.5, False, ['Geography', 'capitals'], self.now)
+        log.record('capital', False, 4, True, ['Geography', 'capitals'], self.now + 10)
+        log.record('river', True, 1, False, ['geography'], self.now + 20)
+
+    def test_totals(self):
+        log = ResultsLog(self.path, self.forever)
+        self.fill(log)
+        self.assertEqual(log.item('capital').as_list(), [2, 1, 1, 6500, self.now + 10])
+        self.assertEqual(log.tag('GEOGRAPHY').attempts, 3)
+        self.assertAlmostEqual(log.tag('geography').accuracy, 2 / 3)
+        self.assertAlmostEqual(log.tag('capitals').difficulty, 0.5)
+        self.assertAlmostEqual(log.item('capital').mean_response_time, 3.25)
+        self.assertEqual(log.month('2023-11').attempts, 3)
+        self.assertEqual(log.month('2023-11', 'capitals').hints, 1)
+        self.assertEqual(log.item('new').attempts, 0)
+        self.assertEqual([event[:2] for event in log.events()],
+                         [('capital', True), ('capital', False), ('river', True)])
+        log.close()
+        key_records = 5 + len("capital\x1fcapitals\x1fgeography") + 5 + len("river\x1fgeography")
+        self.assertEqual(os.path.getsize(self.path), HEADER.size + key_records + 3 * ANSWER.size)
+
+    def test_reopen(self):
+        log = ResultsLog(self.path, self.forever)
+        self.fill(log)
+        log.checkpoint()
+        log.record('river', False, 3, False, ['geography'], self.now + 30)  # After the checkpoint, replayed
+        log.file.close()
+        with open(self.path, "ab") as file:
+            file.write(ANSWER.pack(b'A', 0, 1, 100, self.now)[:7])  # Cut short by a crash
+        log = ResultsLog(self.path, self.forever)
+        self.assertEqual(log.tag('geography').as_list(), [4, 2, 1, 10500, self.now + 30])
+        self.assertEqual(log.history['river'], (2, 1, self.now + 30))
+        log.record('capital', True, 1, False, ['geography', 'capitals'], self.now + 40)
+        log.close()
+        os.remove(self.path + ".summary")  # Rebuilt from the whole log
+        log = ResultsLog(self.path, self.forever)
+        self.assertEqual(log.tag('geography').attempts, 5)
+        self.assertEqual(log.item('capital').as_list(), [3, 2, 1, 7500, self.now + 40])
+        log.close()
+
+    def test_compaction(self):
+        log = ResultsLog(self.path, retention=100)
+        self.fill(log)
+        log.record('river', True, 1, False, ['geography'], self.now + 200)
+        before = {tag: stats.as_list() for tag, stats in log.tags.items()}
+        size = os.path.getsize(self.path)
+        log.compact(self.now + 215)  # Only the last answer is within the retention
+        self.assertLess(os.path.getsize(self.path), size)
+        self.assertEqual([event[0] for event in log.events()], ['river'])
+        self.assertEqual(len(log.keys), 1)
+        self.assertEqual({tag: stats.as_list() for tag, stats in log.tags.items()}, before)
+        log.file.close()
+        log = ResultsLog(self.path, retention=100)
+        self.assertEqual({tag: stats.as_list() for tag, stats in log.tags.items()}, before)
+        self.assertEqual(log.month('2023-11').attempts, 4)
+        log.checkpoint(self.now + 100 * 24 * 3600)  # Compacts once the oldest answer is well past the retention
+        self.assertEqual(list(log.events()), [])
+        self.assertEqual(log.tag('geography').attempts, 4)
+        log.file.close()
+
+    def test_compaction_interrupted(self):
+        log = ResultsLog(self.path, retention=100)
+        self.fill(log)
+        log.record('river', True, 1, False, ['geography'], self.now + 200)
+        log.checkpoint(self.now + 200)
+        with open(log.summary_path, "rb") as file:
+            old_summary = file.read()
+        before = log.tag('geography').as_list()
+        log.compact(self.now + 215)
+        log.file.close()
+        # As if the app stopped after the compacted log replaced the old one, before its summary did
+        os.replace(log.summary_path, log.pending_path)
+        with open(log.summary_path, "wb") as file:
+            file.write(old_summary)
+        log = ResultsLog(self.path, retention=100)
+        self.assertEqual(log.tag('geography').as_list(), before)
+        self.assertFalse(os.path.exists(log.pending_path))
+        # A summary left over by a compaction that did not replace the log is ignored
+        with open(log.pending_path, "wb") as file:
+            file.write(old_summary)
+        log.file.close()
+        log = ResultsLog(self.path, retention=100)
+        self.assertEqual(log.tag('geography').as_list(), before)
+        self.assertFalse(os.path.exists(log.pending_path))
+        log.file.close()
+
+    def test_unreadable_log(self):
+        log = ResultsLog(self.path, self.forever)
+        self.fill(log)
+        log.close()
+        with open(self.path, "ab") as file:
+            file.write(bytes(ANSWER.size // 2))  # Zeros left by a crash are cut
+        log, error = open_results_log(self.path, self.forever)
+        self.assertIsNone(error)
+        self.assertEqual(log.tag('geography').attempts, 3)
+        log.file.close()
+        with open(self.path, "ab") as file:
+            file.write(b"X" + bytes(ANSWER.size) + ANSWER.pack(b'A', 0, 1, 100, self.now))
+        self.assertRaises(ValueError, ResultsLog, self.path, self.forever)
+        with open(self.path, "r+b") as file:
+            file.write(b"JUNK")
+        log, error = open_results_log(self.path, self.forever)
+        self.assertIn("moved to", error)
+        self.assertEqual(log.tag('geography').attempts, 0)
+        self.assertEqual(len([name for name in os.listdir(self.directory.name) if ".corrupt" in name]), 2)
+        log.close()
+
+    def test_history(self):
+        log = ResultsLog(self.path, self.forever)
+        for i in range(20):
+            log.record('missed', False, 1, timestamp=self.now + i)
+            log.record('known', True, 1, timestamp=self.now + i)
+        errors = error_rate_weight(log.history)
+        self.assertGreater(errors('missed'), errors('new'))
+        self.assertGreater(errors('new'), errors('known'))
+        bank = QuizStore()
+        for key in ('missed', 'known'):
+            bank[key] = {'type': 'quiz', 'question': key, 'options': {'A': 'Yes', 'B': 'No'}, 'answer': 'A',
+                         'tags': set()}
+        drawn = [draw_questions(bank, "", 1, 'errors', make_rng(seed), log.history)[0] for seed in range(50)]
+        self.assertGreater(drawn.count('missed'), 40)
+        bank.close()
+        log.close()
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        # Record without enable(), which would also write a trace when the tests exit
+        self.enabled = instrumentation.ENABLED
+        instrumentation.reset()
+
+    def tearDown(self):
+        instrumentation.ENABLED = self.enabled
+        instrumentation.reset()
+
+    def test_disabled(self):
+        instrumentation.ENABLED = False
+        with instrumentation.span("ignored"):
+            parse_quiz_and_flashcards("F: Fact\nA: Answer\nEND\n")
+        instrumentation.count("ignored")
+        self.assertEqual(instrumentation.spans, [])
+        self.assertEqual(dict(instrumentation.counters), {})
+
+    def test_spans_and_counters(self):
+        instrumentation.ENABLED = True
+        with instrumentation.span("outer", size=3):
+            items, _ = parse_quiz_and_flashcards("F: Fact\nA: Answer\nT: a, b\nEND\n")
+            TagIndex.from_items(items).query("a AND b", 'flashcard')
+        names = [name for name, _, _, _, _ in instrumentation.spans]
+        self.assertEqual(names, ["parse_quiz_and_flashcards", "outer"])  # Inner spans end first
+        self.assertEqual(instrumentation.counters["expression_evaluations"], 1)
+
+        events = instrumentation.chrome_trace()['traceEvents']
+        outer = next(event for event in events if event['name'] == "outer")
+        inner = next(event for event in events if event['name'] == "parse_quiz_and_flashcards")
+        self.assertEqual((outer['ph'], outer['args']), ('X', {'size': 3}))
+        self.assertLessEqual(outer['ts'], inner['ts'])
+        self.assertGreaterEqual(outer['ts'] + outer['dur'], inner['ts'] + inner['dur'])
+        self.assertIn({'name': "expression_evaluations", 'ph': 'C', 'ts': outer['ts'] + outer['dur'],
+                       'pid': os.getpid(), 'args': {'value': 1}}, events)
+        self.assertIn("parse_quiz_and_flashcards", instrumentation.summary())
+
+
 if __name__ == '__main__':
     unittest.main()